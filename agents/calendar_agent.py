@@ -1,30 +1,124 @@
 """
 Calendar Agent: Handles meeting scheduling, availability checks.
 """
-import json
+import itertools
 import logging
+import os
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Assuming tools are correctly initialized and passed or globally available
 # This requires tools/calendar_tool.py and tools/google_calendar_tool.py
 # and potentially memory/supabase_memory.py depending on how state is managed.
 from tools.calendar_tool import CalendarTool 
-from tools.google_calendar_tool import GoogleCalendarOAuthTool
+from utils.llm import LLMError, StructuredOutputError
+from tools.google_calendar_tool import GoogleCalendarOAuthTool, SLOT_SEARCH_DAYS
+from tools.availability import AvailabilityIndex
+from tools.slot_allocator import get_allocator, schedule_batch
 from memory.supabase_memory import memory # If needed for lead info
 
 calendar_tool = CalendarTool()
 
-def schedule_meeting(lead_message: str, access_token: str) -> dict:
-    """Attempts to schedule a meeting based on lead message and access token."""
+# Free slots offered in the reply when the requested time is taken
+ALTERNATIVE_SLOTS = int(os.getenv("CALENDAR_ALTERNATIVE_SLOTS", "3"))
+
+# Other calendars (reps' email addresses) a meeting must fit. With mode "all" our
+# calendar and every team calendar must be free and all of them are invited; with
+# "any" the team is a round-robin pool and one free rep is invited.
+TEAM_CALENDAR_IDS = [c.strip() for c in os.getenv("CALENDAR_TEAM_IDS", "").split(",") if c.strip()]
+TEAM_MODE = os.getenv("CALENDAR_TEAM_MODE", "all").lower()
+if TEAM_MODE not in ("all", "any"):
+    raise ValueError(f"Invalid CALENDAR_TEAM_MODE '{TEAM_MODE}' (expected 'all' or 'any')")
+_round_robin = itertools.count()
+
+# Busy slots of the likely window are fetched while the LLM suggests a time
+CALENDAR_PREFETCH_ENABLED = os.getenv("CALENDAR_PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+_prefetch_pool = ThreadPoolExecutor(max_workers=int(os.getenv("CALENDAR_PREFETCH_WORKERS", "4")),
+                                    thread_name_prefix="calendar-prefetch")
+
+
+def _start_prefetch(calendar_api):
+    """Starts fetching busy slots for every date the suggestion (plus the alternative search) may need."""
+    start_date, end_date = calendar_tool.likely_window()
+    return _prefetch_pool.submit(calendar_api.get_busy_slots_range, start_date,
+                                 end_date + timedelta(days=SLOT_SEARCH_DAYS))
+
+
+def _prefetched(prefetch, start_date, end_date):
+    """The prefetched {date: busy slots} for [start_date, end_date), or None if it doesn't cover it."""
+    if prefetch is None:
+        return None
+    try:
+        busy_by_day = prefetch.result()
+    except Exception as e:
+        logging.warning(f"Calendar prefetch failed, fetching again: {e}")
+        return None
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days)]
+    if any(day not in busy_by_day for day in days):
+        return None
+    return {day: busy_by_day[day] for day in days}
+
+
+def _team_availability(calendar_api, busy_by_day, start_date, tz):
+    """
+    AvailabilityIndex over our calendar and the team calendars (see TEAM_MODE),
+    plus the team calendars that couldn't be read. Those are in neither the
+    search nor the free_calendars() of the index, so they must not be invited.
+    """
+    team_ids = [c for c in TEAM_CALENDAR_IDS if c != calendar_api.calendar_id]
+    busy_by_calendar = calendar_api.get_busy_slots_by_calendar(
+        team_ids, start_date, start_date + timedelta(days=SLOT_SEARCH_DAYS)
+    )
+    unreadable = [c for c in team_ids if c not in busy_by_calendar]
+    if TEAM_MODE == "all":
+        busy_by_calendar = {calendar_api.calendar_id: busy_by_day, **busy_by_calendar}
+    elif not busy_by_calendar:
+        # None of the pool's calendars could be read: there is no rep to book
+        raise RuntimeError(f"Couldn't read the free/busy of any team calendar ({unreadable})")
+    return AvailabilityIndex.from_calendars(busy_by_calendar, mode=TEAM_MODE, tz=tz), unreadable
+
+
+def _pick_rep(free_calendars):
+    """Next rep of the pool, in rotation, among the free ones."""
+    offset = next(_round_robin) % len(TEAM_CALENDAR_IDS)
+    for calendar_id in TEAM_CALENDAR_IDS[offset:] + TEAM_CALENDAR_IDS[:offset]:
+        if calendar_id in free_calendars:
+            return calendar_id
+    return None
+
+def _parse_suggested_time(data, tz):
+    """The suggestion's datetime string as an aware datetime. Raises ValueError if missing or malformed."""
+    datetime_str = data.get("datetime")
+    if not datetime_str:
+        raise ValueError("No datetime found in suggestion")
+
+    if " CET" in datetime_str or " CEST" in datetime_str:
+        datetime_str = datetime_str.replace(" CET", "").replace(" CEST", "")
+
+    try:
+        preferred_time_dt = datetime.strptime(datetime_str, "%A, %B %d, %Y at %I:%M %p")
+    except ValueError:
+        preferred_time_dt = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M")
+    return tz.localize(preferred_time_dt)
+
+def schedule_meeting(lead_message: str, access_token: str, raise_errors: bool = False) -> dict:
+    """
+    Attempts to schedule a meeting based on lead message and access token.
+    With raise_errors, unexpected failures (API, network, LLM errors) are raised
+    instead of reported, so a checkpointed run retries the node.
+    """
     thoughts = []
     tools_used = []
     event_details = {}
     error_message = None
-    tokens = {"input": 0, "output": 0, "total": 0} # Placeholder for potential LLM calls within tools
+    tokens = {"input": 0, "output": 0, "total": 0} # Filled with the usage of the LLM calls made by CalendarTool
     meeting_link = None
     meeting_time = None
     meeting_type = "professional" # Default
+    alternative_slots = []
+    # Team calendars left out because we couldn't read their free/busy
+    unchecked_attendees = []
 
     if not access_token:
         return {
@@ -38,31 +132,19 @@ def schedule_meeting(lead_message: str, access_token: str) -> dict:
         # Initialize the Google Calendar API tool with the token
         calendar_api = GoogleCalendarOAuthTool(access_token=access_token)
         tools_used.append("GoogleCalendarTool")
+        # Runs concurrently with the LLM call below instead of after it
+        prefetch = _start_prefetch(calendar_api) if CALENDAR_PREFETCH_ENABLED else None
 
-        # Use the existing calendar_tool's schedule method (which likely calls LLM internally)
-        raw_json = calendar_tool.schedule(lead_message) 
-        tools_used.append("CalendarTool.schedule")
-        # TODO: Incorporate token counting if calendar_tool.schedule provides it.
-
+        data = None
         try:
-            data = json.loads(raw_json)
+            # CalendarTool.schedule asks the LLM for a schema-validated suggestion
+            data, tokens = calendar_tool.schedule(lead_message)
+            tools_used.append("CalendarTool.schedule")
             thoughts.append(f"[Calendar Agent] Parsed scheduling suggestion: {data}")
 
             # Use CET timezone for parsing - consider making this configurable or using user's timezone
             cet_timezone = pytz.timezone('Europe/Paris')
-            datetime_str = data.get("datetime")
-            if not datetime_str:
-                raise ValueError("No datetime found in suggestion")
-
-            if " CET" in datetime_str or " CEST" in datetime_str:
-                datetime_str = datetime_str.replace(" CET", "").replace(" CEST", "")
-
-            try:
-                preferred_time_dt = datetime.strptime(datetime_str, "%A, %B %d, %Y at %I:%M %p")
-            except ValueError:
-                preferred_time_dt = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M")
-            
-            preferred_time = cet_timezone.localize(preferred_time_dt)
+            preferred_time = _parse_suggested_time(data, cet_timezone)
             meeting_time = preferred_time.strftime("%A, %B %d, %Y at %I:%M %p %Z") 
             thoughts.append(f"[Calendar Agent] Parsed preferred time: {meeting_time}")
 
@@ -74,39 +156,103 @@ def schedule_meeting(lead_message: str, access_token: str) -> dict:
             # Check Availability (This logic was added in orchestrator/graph.py previously)
             # For consistency, it should ideally live here or be called from here.
             # Re-implementing the check logic within the agent:
+            # One ranged query covers the preferred day and the window searched for alternatives
             thoughts.append("[Calendar Agent] Checking availability...")
-            tools_used.append("GoogleCalendarTool.get_busy_slots")
-            busy_slots = calendar_api.get_busy_slots(preferred_time.date())
+            tools_used.append("GoogleCalendarTool.get_busy_slots_range")
+            window = (preferred_time.date(), preferred_time.date() + timedelta(days=SLOT_SEARCH_DAYS))
+            busy_by_day = _prefetched(prefetch, *window)
+            if busy_by_day is not None:
+                thoughts.append("[Calendar Agent] Using availability prefetched during the LLM call.")
+            else:
+                busy_by_day = calendar_api.get_busy_slots_range(*window)
+            # Indexed once, then used for the check and the alternatives
+            if TEAM_CALENDAR_IDS:
+                tools_used.append("GoogleCalendarTool.get_busy_slots_by_calendar")
+                availability, unchecked_attendees = _team_availability(
+                    calendar_api, busy_by_day, preferred_time.date(), cet_timezone
+                )
+                if unchecked_attendees:
+                    thoughts.append(f"[Calendar Agent] Couldn't read free/busy of {unchecked_attendees}; "
+                                    f"they are not checked and won't be invited.")
+            else:
+                availability = AvailabilityIndex(busy_by_day, tz=cet_timezone)
             
             tools_used.append("GoogleCalendarTool.is_slot_free")
             is_free = calendar_api.is_slot_free(
                 start=preferred_time, 
                 end=preferred_time + timedelta(minutes=duration),
-                busy_slots=busy_slots
+                busy_slots=availability
             )
+            # Hold the slot in memory so a lead scheduled concurrently can't take it too
+            allocator = get_allocator(access_token, calendar_api.calendar_id)
+            reservation_id = None
+            if is_free:
+                reservation_id = allocator.try_reserve(preferred_time, preferred_time + timedelta(minutes=duration))
+                if reservation_id is None:
+                    is_free = False
+                    thoughts.append("[Calendar Agent] Slot is being booked for another lead.")
+            rep = None
+            if is_free and TEAM_CALENDAR_IDS and TEAM_MODE == "any":
+                rep = _pick_rep(availability.free_calendars(preferred_time, preferred_time + timedelta(minutes=duration)))
+                if rep is None:
+                    # No single rep is free for the whole meeting: a conflict, not a booking without one
+                    allocator.release(reservation_id)
+                    is_free = False
+                    thoughts.append("[Calendar Agent] No rep of the pool is free for the whole slot.")
 
             if is_free:
                 thoughts.append(f"[Calendar Agent] Slot {meeting_time} is available. Creating event.")
-                meeting_link = calendar_api.create_event(
-                    summary=title,
-                    description=description,
-                    start_time=preferred_time,
-                    duration_minutes=duration,
-                    location=location
-                )
+                attendees = None
+                if TEAM_CALENDAR_IDS:
+                    if TEAM_MODE == "any":
+                        attendees = [rep]
+                    else:
+                        # Only the calendars the slot was actually checked against
+                        attendees = [c for c in TEAM_CALENDAR_IDS
+                                     if c != calendar_api.calendar_id and c not in unchecked_attendees]
+                    thoughts.append(f"[Calendar Agent] Inviting: {attendees}")
+                try:
+                    meeting_link = calendar_api.create_event(
+                        summary=title,
+                        description=description,
+                        start_time=preferred_time,
+                        duration_minutes=duration,
+                        location=location,
+                        attendees=attendees
+                    )
+                except Exception:
+                    allocator.release(reservation_id)
+                    raise
+                allocator.confirm(reservation_id)
                 tools_used.append("GoogleCalendarTool.create_event")
                 thoughts.append(f"[Calendar Agent] Successfully created calendar event: {meeting_link}")
             else:
                 error_message = f"Time slot conflict detected for {meeting_time}"
+                tools_used.append("AvailabilityIndex.find_slots")
+                # At most one suggestion per day so the lead gets a real choice,
+                # leaving out slots held for other leads
+                free_slots = allocator.apply(availability).find_slots(
+                    preferred_time, duration_minutes=duration, k=ALTERNATIVE_SLOTS, max_per_day=1
+                )
+                alternative_slots = [slot.strftime('%A, %B %d, %Y at %I:%M %p %Z') for slot in free_slots]
+                if alternative_slots:
+                    error_message += f"; next free slot: {alternative_slots[0]}"
                 thoughts.append(f"[Calendar Agent] {error_message}")
 
-        except (json.JSONDecodeError, ValueError, KeyError) as parse_error:
+        except StructuredOutputError as parse_error:
+            logging.error(f"Calendar Agent - Invalid scheduling suggestion from LLM: {parse_error}")
+            tokens = parse_error.usage or tokens
+            error_message = f"Failed to parse scheduling suggestion: {parse_error}"
+            thoughts.append(f"[Calendar Agent] {error_message} (Raw response: {str(parse_error.raw_response)[:100]}...)")
+        except (ValueError, KeyError) as parse_error:
             logging.error(f"Calendar Agent - Error parsing or processing schedule data: {parse_error}")
             error_message = f"Failed to parse scheduling suggestion: {parse_error}"
-            thoughts.append(f"[Calendar Agent] {error_message} (Raw response: {raw_json[:100]}...)")
+            thoughts.append(f"[Calendar Agent] {error_message} (Suggestion: {str(data)[:100]}...)")
 
     except Exception as e:
         logging.error(f"Calendar Agent - Unexpected error: {e}", exc_info=True)
+        if raise_errors:
+            raise
         error_message = f"Unexpected calendar processing error: {str(e)}"
         thoughts.append(f"[Calendar Agent] {error_message}")
 
@@ -123,5 +269,73 @@ def schedule_meeting(lead_message: str, access_token: str) -> dict:
         result["meeting_type"] = meeting_type 
     if error_message:
         result["error"] = error_message
+    if alternative_slots:
+        result["alternative_slots"] = alternative_slots
+    if unchecked_attendees:
+        result["unchecked_attendees"] = unchecked_attendees
         
-    return result 
\ No newline at end of file
+    return result 
+
+
+def schedule_meetings_batch(lead_messages, access_token: str, max_workers: int = 8) -> list:
+    """
+    Schedules many leads at once without double-booking: the suggestions are
+    obtained concurrently, then every lead gets a slot from one availability
+    snapshot (its suggested time if free, else the next free slot within
+    SLOT_SEARCH_DAYS) and the events are inserted in one batch.
+    Returns one dict per lead, in order: calendar_link, meeting_time, error, tokens.
+    """
+    if not access_token:
+        return [{"error": "Missing Google access token", "tokens": {"input": 0, "output": 0, "total": 0}}
+                for _ in lead_messages]
+    calendar_api = GoogleCalendarOAuthTool(access_token=access_token)
+    cet_timezone = pytz.timezone('Europe/Paris')
+
+    def suggest(lead_message):
+        # A failing lead gets an error entry; it never aborts the rest of the batch
+        no_tokens = {"input": 0, "output": 0, "total": 0}
+        try:
+            data, tokens = calendar_tool.schedule(lead_message)
+            return data, tokens, None
+        except StructuredOutputError as e:
+            return None, e.usage or no_tokens, f"Failed to parse scheduling suggestion: {e}"
+        except LLMError as e:
+            logging.error(f"Calendar Agent - LLM call failed for a batch lead: {e}")
+            return None, no_tokens, f"LLM call failed: {e}"
+        except Exception as e:
+            logging.error(f"Calendar Agent - Unexpected error for a batch lead: {e}", exc_info=True)
+            return None, no_tokens, f"Unexpected calendar processing error: {e}"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        suggestions = list(pool.map(suggest, lead_messages))
+
+    results = []
+    requests = []
+    for index, (lead_message, (data, tokens, error)) in enumerate(zip(lead_messages, suggestions)):
+        results.append({"tokens": tokens, "error": error})
+        if error:
+            continue
+        try:
+            preferred_time = _parse_suggested_time(data, cet_timezone)
+        except (ValueError, KeyError) as e:
+            results[-1]["error"] = f"Failed to parse scheduling suggestion: {e}"
+            continue
+        requests.append({
+            "lead_id": index,
+            "preferred_start": preferred_time,
+            "duration_minutes": int(data.get("duration", 30)),
+            "window_end": preferred_time + timedelta(days=SLOT_SEARCH_DAYS),
+            "summary": data.get("title", "Meeting"),
+            "description": data.get("description", f"Meeting requested via: {lead_message}"),
+            "location": data.get("location", ""),
+        })
+
+    allocator = get_allocator(access_token, calendar_api.calendar_id)
+    for scheduled in schedule_batch(calendar_api, allocator, requests):
+        result = results[scheduled["lead_id"]]
+        if scheduled["error"]:
+            result["error"] = scheduled["error"]
+        else:
+            result["calendar_link"] = scheduled["link"]
+            result["meeting_time"] = scheduled["start"].strftime("%A, %B %d, %Y at %I:%M %p %Z")
+    return results
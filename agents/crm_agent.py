@@ -5,51 +5,66 @@ Placeholder implementation. In a real system, this would interact
 with a CRM API (like HubSpot, Salesforce, etc.).
 """
 import logging
-from utils.llm import llm_think
+from utils.llm import llm_think_json, llm_think_json_async
 from memory.supabase_memory import memory # Assuming this is the intended memory interface
 
-def log_lead(lead_message: str) -> dict:
-    """Analyzes lead message and simulates logging to CRM."""
-    
-    thoughts = []
-    tools_used = ["CRM Lead Logger (Simulated)"]
-    tokens = {"input": 0, "output": 0, "total": 0} 
-    crm_result_data = None
-    error_message = None
+# Fields extracted for the CRM record; every field may be null when the message doesn't say
+CRM_LEAD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": ["string", "null"]},
+        "email": {"type": ["string", "null"]},
+        "company": {"type": ["string", "null"]},
+        "interest": {"type": ["string", "null"]},
+        "priority": {"type": ["string", "null"]}
+    }
+}
 
-    thoughts.append("Analyzing lead information for CRM logging")
-    
+def _extraction_prompt(lead_message: str) -> str:
     # Optional: Use LLM to extract structured info if needed by CRM
-    prompt = f"""
+    return f"""
 From the following message, extract key information for a CRM system:
 
 {lead_message}
 
 Return a JSON object with fields like "name", "email", "company", "interest", "priority". Use null if info is missing.
 """
-    try:
-        extraction_result_str, tokens_data = llm_think(prompt)
-        thoughts.append("Extracted lead information from message for CRM")
-        
-        if isinstance(tokens_data, dict):
-            tokens = tokens_data
-        else:
-            tokens = {"input": 0, "output": 0, "total": int(tokens_data or 0)}
-        
-        # Simulate CRM logging
-        crm_result_data = {
-            "status": "logged (simulated)",
-            "lead_data": extraction_result_str, # Store raw extraction for now
-            "message": "Lead information stored in CRM system (simulation)"
-        }
-        memory.set("crm_log", crm_result_data) # Store simulation result in memory
-        thoughts.append("Lead information logged to CRM system (simulation)")
-        tools_used.append("LLM CRM Extractor")
 
-    except Exception as e:
-        logging.error(f"CRM Agent - Error during LLM extraction or logging: {e}", exc_info=True)
-        error_message = f"Failed to process lead for CRM: {str(e)}"
+def _crm_result(lead_data=None, tokens_data=None, error=None) -> dict:
+    """Logs the extracted lead (simulated) and builds the agent result; error is the extraction failure, if any."""
+    thoughts = ["Analyzing lead information for CRM logging"]
+    tools_used = ["CRM Lead Logger (Simulated)"]
+    tokens = {"input": 0, "output": 0, "total": 0} 
+    crm_result_data = None
+    error_message = None
+
+    if error is not None:
+        logging.error(f"CRM Agent - Error during LLM extraction: {error}", exc_info=error)
+        error_message = f"Failed to process lead for CRM: {str(error)}"
         thoughts.append(f"[CRM Agent] {error_message}")
+    else:
+        try:
+            thoughts.append("Extracted lead information from message for CRM")
+            
+            if isinstance(tokens_data, dict):
+                tokens = tokens_data
+            else:
+                tokens = {"input": 0, "output": 0, "total": int(tokens_data or 0)}
+            
+            # Simulate CRM logging
+            crm_result_data = {
+                "status": "logged (simulated)",
+                "lead_data": lead_data,
+                "message": "Lead information stored in CRM system (simulation)"
+            }
+            memory.set("crm_log", crm_result_data) # Store simulation result in memory
+            thoughts.append("Lead information logged to CRM system (simulation)")
+            tools_used.append("LLM CRM Extractor")
+
+        except Exception as e:
+            logging.error(f"CRM Agent - Error during CRM logging: {e}", exc_info=True)
+            error_message = f"Failed to process lead for CRM: {str(e)}"
+            thoughts.append(f"[CRM Agent] {error_message}")
 
     # Construct return dictionary
     result = {
@@ -62,4 +77,29 @@ Return a JSON object with fields like "name", "email", "company", "interest", "p
     if error_message:
         result["error"] = error_message
 
-    return result 
\ No newline at end of file
+    return result
+
+def log_lead(lead_message: str, raise_errors: bool = False) -> dict:
+    """
+    Analyzes lead message and simulates logging to CRM. With raise_errors an
+    extraction failure is raised instead of reported (checkpointed runs retry the node).
+    """
+    try:
+        lead_data, tokens_data = llm_think_json(_extraction_prompt(lead_message), schema=CRM_LEAD_SCHEMA, route="crm.extract")
+    except Exception as e:
+        if raise_errors:
+            raise
+        return _crm_result(error=e)
+    return _crm_result(lead_data, tokens_data)
+
+async def alog_lead(lead_message: str, raise_errors: bool = False) -> dict:
+    """Coroutine version of log_lead (async LLM client, no thread)."""
+    try:
+        lead_data, tokens_data = await llm_think_json_async(
+            _extraction_prompt(lead_message), schema=CRM_LEAD_SCHEMA, route="crm.extract"
+        )
+    except Exception as e:
+        if raise_errors:
+            raise
+        return _crm_result(error=e)
+    return _crm_result(lead_data, tokens_data)
@@ -1,20 +1,18 @@
 """
 Inbox Agent: Processes incoming messages, qualifies leads.
 """
-from utils.llm import llm_think
-from memory.supabase_memory import memory # Assuming this is the intended memory interface
+from utils.llm import llm_think, llm_think_async
 
-def process_message(lead_message: str, lead_rule: str) -> dict:
-    """Processes the lead message to qualify it based on the rule."""
-    
-    # Store basic email info in memory (as done in the original coordinator_node)
-    email = {
+def lead_record(lead_message: str) -> dict:
+    """Basic email info for the lead; the graph carries it in state for the later agents."""
+    return {
         "from": "lead@example.com", # Mock sender
         "subject": lead_message
     }
-    memory.set("lead", email)
 
-    prompt = f"""
+def _qualify_prompt(lead_message: str, lead_rule: str) -> str:
+    """Returns the qualification prompt."""
+    return f"""
 Use the following rule to decide if this is a qualified lead:
 {lead_rule}
 
@@ -23,8 +21,8 @@ Here is the message from the lead:
 
 Provide your detailed reasoning and state clearly at the end if this is a qualified lead or not.
 """
-    thought, tokens_data = llm_think(prompt)
-    
+
+def _inbox_result(lead_message, thought, tokens_data) -> dict:
     # Determine qualification status (optional, can be done in orchestrator if needed)
     # is_qualified = "qualified lead" in thought.lower() or "is a lead" in thought.lower()
 
@@ -38,5 +36,16 @@ Provide your detailed reasoning and state clearly at the end if this is a qualif
         "thought": f"[Inbox Agent] {thought}",
         # "is_qualified": is_qualified, # Can be returned if needed by graph logic
         "tokens": tokens,
-        "tools_used": ["EmailTool.read_email"] # Tool used conceptually
-    } 
\ No newline at end of file
+        "tools_used": ["EmailTool.read_email"], # Tool used conceptually
+        "lead": lead_record(lead_message)
+    }
+
+def process_message(lead_message: str, lead_rule: str) -> dict:
+    """Processes the lead message to qualify it based on the rule."""
+    thought, tokens_data = llm_think(_qualify_prompt(lead_message, lead_rule), route="inbox.qualify")
+    return _inbox_result(lead_message, thought, tokens_data)
+
+async def aprocess_message(lead_message: str, lead_rule: str) -> dict:
+    """Coroutine version of process_message (async LLM client, no thread)."""
+    thought, tokens_data = await llm_think_async(_qualify_prompt(lead_message, lead_rule), route="inbox.qualify")
+    return _inbox_result(lead_message, thought, tokens_data)
@@ -1,24 +1,23 @@
 """
 Reply Agent: Generates email replies based on workflow outcomes.
 """
-import logging
-from utils.llm import llm_think
-from memory.supabase_memory import memory # Assuming this is the intended memory interface
+from utils.llm import llm_think, llm_think_stream
 
-def generate_reply(meeting_info: dict = None) -> dict:
-    """Generates a reply email based on meeting info (or lack thereof)."""
+def generate_reply(meeting_info: dict = None, on_token=None, lead: dict = None) -> dict:
+    """
+    Generates a reply email based on meeting info (or lack thereof).
+    lead is the inbox agent's record of the lead being answered (its subject
+    gives the reply context); the graph passes it from the run's state.
+    If on_token is given, the draft is streamed and on_token(delta) is called
+    for each piece of text as it arrives.
+    """
     
     if meeting_info is None: 
         meeting_info = {}
         
-    # Attempt to retrieve lead subject from memory for context
     lead_subject = "your recent inquiry" # Default subject
-    try:
-        lead = memory.get("lead")
-        if lead and isinstance(lead, dict):
-            lead_subject = lead.get("subject", lead_subject)
-    except Exception as e:
-        logging.warning(f"Could not retrieve lead subject from memory: {e}")
+    if lead and isinstance(lead, dict):
+        lead_subject = lead.get("subject") or lead_subject
 
     # Determine context based on meeting_info
     event_context = ""
@@ -47,11 +46,22 @@ def generate_reply(meeting_info: dict = None) -> dict:
     elif meeting_info.get("error"):
         # Error during scheduling (includes conflicts)
         error = meeting_info['error']
-        event_context = (
-            f"Unfortunately, I encountered an issue while trying to schedule the meeting: {error}\n\n"
-            f"Could you please suggest another time or provide more details?"
-        )
-        thought_summary += f"Generated reply indicating scheduling error: {error}."
+        alternatives = meeting_info.get("alternative_slots") or []
+        if alternatives:
+            # The requested time was taken: offer the free slots found in the calendar
+            slot_lines = "\n".join(f"- {slot}" for slot in alternatives)
+            event_context = (
+                f"Unfortunately, the requested time is not available: {error}\n\n"
+                f"These times are free:\n{slot_lines}\n\n"
+                f"Would one of these work for you, or would you prefer another time?"
+            )
+            thought_summary += f"Generated reply proposing {len(alternatives)} alternative slot(s)."
+        else:
+            event_context = (
+                f"Unfortunately, I encountered an issue while trying to schedule the meeting: {error}\n\n"
+                f"Could you please suggest another time or provide more details?"
+            )
+            thought_summary += f"Generated reply indicating scheduling error: {error}."
 
     else:
         # Fallback: No meeting scheduled, no error
@@ -68,27 +78,33 @@ def generate_reply(meeting_info: dict = None) -> dict:
         f"Assume you are a helpful assistant responding to the initial request.\n"
         f"Keep the tone friendly and professional. "
         f"If a meeting was scheduled, confirm the details clearly. "
-        f"If there was an error or no time was found, explain briefly and ask for clarification or alternative times."
+        f"If there was an error or no time was found, explain briefly and ask for clarification or alternative times. "
+        f"If free times are listed, propose them as they are written."
         f"{user_feedback_prompt}" # Append feedback instruction if present
     )
     
-    reply_text, tokens_data = llm_think(prompt)
+    time_to_first_token_ms = None
+    if on_token:
+        stream = llm_think_stream(prompt, route="reply.draft")
+        for delta in stream:
+            on_token(delta)
+        reply_text, tokens_data = stream.content, stream.usage
+        time_to_first_token_ms = stream.ttft_ms
+    else:
+        reply_text, tokens_data = llm_think(prompt, route="reply.draft")
     
-    # Store the draft reply in memory
-    try:
-        memory.set("draft_reply", reply_text)
-    except Exception as e:
-        logging.error(f"Failed to set draft_reply in memory: {e}")
-
     # Ensure tokens_data has the consistent dict structure
     if isinstance(tokens_data, dict):
         tokens = tokens_data
     else:
         tokens = {"input": 0, "output": 0, "total": int(tokens_data or 0)}
 
-    return {
+    result = {
         "thought": f"[Reply Agent] {thought_summary.strip()}", # Use generated summary
         "reply": reply_text,
         "tokens": tokens,
         "tools_used": ["LLM Reply Generator"]
-    } 
\ No newline at end of file
+    }
+    if time_to_first_token_ms is not None:
+        result["time_to_first_token_ms"] = time_to_first_token_ms
+    return result 
\ No newline at end of file
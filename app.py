@@ -1,5 +1,6 @@
 import streamlit as st
-from orchestrator.graph import create_graph
+from orchestrator.graph import get_compiled_graph, materialize_report
+from utils.llm import get_llm_stats
 from memory.supabase_memory import memory
 from urllib.parse import urlencode
 import os
@@ -168,7 +169,8 @@ if st.button("Run Agent Workflow", key="run_workflow_btn"):
     else:
         with st.spinner("Running agent workflow..."):
             try:
-                graph = create_graph()
+                # Compiled once per process, not on every click
+                graph = get_compiled_graph()
                 initial_report_struct = { # Define initial structure for the run
                     "thoughts": [], "tools_used": [], "meeting": None, "error": None,
                     "agent_thoughts": {}, "agent_metrics": {}, "tokens": {"input": 0, "output": 0, "total": 0},
@@ -185,8 +187,11 @@ if st.button("Run Agent Workflow", key="run_workflow_btn"):
                 final_state = graph.invoke(initial_state)
                 
                 # Store the report and clear any previous draft for the UI
-                st.session_state.initial_report = final_state.get("report", {})
-                st.session_state.current_draft = memory.get("draft_reply") # Get latest draft from memory
+                # The state holds an append-only ReportLog; the UI needs the full dict
+                st.session_state.initial_report = materialize_report(final_state.get("report"))
+                st.session_state.current_draft = final_state.get("draft_reply")
+                st.session_state.lead = final_state.get("lead") # Revisions reply to the same lead
+                memory.set("draft_reply", st.session_state.current_draft)
                 st.success("Workflow completed!")
                 # No rerun needed here, results displayed below
 
@@ -217,12 +222,16 @@ if st.session_state.initial_report:
     st.markdown(f"_{report.get('meeting', 'N/A')}_")
     st.markdown("**Final Agent Metrics:**")
     st.json(report.get("agent_metrics", {}))
+    st.markdown("**LLM Usage by Route (this process):**")
+    st.json(get_llm_stats().get("routes", {}))
 
     # --- Human Review Section (Acts on completed draft) --- 
     st.subheader("📧 Draft Reply Review")
-    # current_draft is already fetched from memory and stored in session state above
+    # current_draft is taken from the run's final state and stored in session state above
     if st.session_state.current_draft:
-        st.code(st.session_state.current_draft, language="markdown")
+        # Placeholder so a revision can stream into the same spot as the current draft
+        draft_placeholder = st.empty()
+        draft_placeholder.code(st.session_state.current_draft, language="markdown")
         
         feedback = st.text_area("Provide feedback for revision (optional):", key="feedback_text_hitl")
         
@@ -251,12 +260,20 @@ if st.session_state.initial_report:
                             }
                             # Import and call agent directly
                             from agents.reply_agent import generate_reply 
+                            # Stream the revised draft into the review box as it is generated
+                            streamed_parts = []
+                            def render_delta(delta):
+                                streamed_parts.append(delta)
+                                draft_placeholder.code("".join(streamed_parts), language="markdown")
                             # Ensure generate_reply uses 'user_feedback' key
-                            revision_result = generate_reply(meeting_info=meeting_info_for_revision)
+                            revision_result = generate_reply(meeting_info=meeting_info_for_revision, on_token=render_delta,
+                                                             lead=st.session_state.get("lead"))
                             new_draft = revision_result.get("reply")
                             if new_draft:
                                  st.session_state.current_draft = new_draft # Update draft for display
                                  memory.set("draft_reply", new_draft) # Update memory too
+                                 if revision_result.get("time_to_first_token_ms") is not None:
+                                     logging.info(f"Revision time to first token: {revision_result['time_to_first_token_ms']:.0f} ms")
                                  st.success("Draft revised. Review new version above.")
                                  st.rerun() # Rerun to show the updated draft
                             else:
@@ -0,0 +1,90 @@
+"""
+Compares the scheduling extraction paths of CalendarTool on latency, tokens and
+agreement: the default (rule-based parser, falling back to one LLM call), the
+single LLM call alone and the older two-pass path (date intent + scheduling).
+Also reports the fraction of leads the rule-based parser resolves without the LLM.
+The LLM response cache is off, so no path is served answers cached by another.
+
+    python benchmarks/calendar_extraction_benchmark.py --backend record
+    python benchmarks/calendar_extraction_benchmark.py --backend replay --replay-latency
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Add project root to Python path to allow imports from tools, utils etc.
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from benchmarks.pipeline_benchmark import BENCHMARK_DIR, configure_backend, load_leads
+from utils.stats import percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Single-pass vs two-pass calendar extraction.")
+    parser.add_argument("--leads", default=os.path.join(BENCHMARK_DIR, "leads.jsonl"))
+    parser.add_argument("--backend", choices=["live", "record", "replay"], default="replay")
+    parser.add_argument("--cassette", default=os.path.join(BENCHMARK_DIR, "cassettes", "llm.jsonl"))
+    parser.add_argument("--replay-latency", action="store_true", help="Sleep for the recorded LLM latency")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    return parser.parse_args()
+
+
+def run_path(calendar_tool, lead_message, two_pass=False, use_rules=False):
+    started = time.perf_counter()
+    try:
+        data, usage = calendar_tool.schedule(lead_message, two_pass=two_pass, use_rules=use_rules)
+        error = None
+    except Exception as e:
+        data, usage, error = {}, getattr(e, "usage", None) or {}, str(e)
+    return {
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "total_tokens": usage.get("total", 0),
+        "datetime": data.get("datetime"),
+        "date_intent_type": data.get("date_intent_type"),
+        "source": usage.get("source"),
+        "error": error
+    }
+
+
+def summarize(name, rows):
+    latencies = [row["latency_ms"] for row in rows]
+    print(f"{name:<12} p50={percentile(latencies, 50)} ms  p95={percentile(latencies, 95)} ms  "
+          f"mean={round(statistics.mean(latencies), 1) if latencies else None} ms  "
+          f"tokens={sum(row['total_tokens'] for row in rows)}  errors={sum(1 for row in rows if row['error'])}")
+
+
+def main():
+    args = parse_args()
+    configure_backend(args)
+
+    from tools.calendar_tool import CalendarTool
+
+    calendar_tool = CalendarTool()
+    leads = load_leads(args.leads)
+    default, single, two = [], [], []
+    for index, lead in enumerate(leads):
+        default.append(run_path(calendar_tool, lead["lead_message"], use_rules=True))
+        single.append(run_path(calendar_tool, lead["lead_message"]))
+        two.append(run_path(calendar_tool, lead["lead_message"], two_pass=True))
+        print(json.dumps({"lead": index, "default": default[-1], "single_pass": single[-1], "two_pass": two[-1]}, default=str))
+
+    print("\n--- Calendar extraction ---")
+    summarize("default", default)
+    summarize("single_pass", single)
+    summarize("two_pass", two)
+    for name, rows in (("default", default), ("two_pass", two)):
+        same_datetime = sum(1 for a, b in zip(single, rows) if a["datetime"] and a["datetime"] == b["datetime"])
+        same_intent = sum(1 for a, b in zip(single, rows) if a["date_intent_type"] == b["date_intent_type"])
+        print(f"agreement with single_pass ({name}): datetime {same_datetime}/{len(leads)}  "
+              f"date_intent_type {same_intent}/{len(leads)}")
+    skipped = sum(1 for row in default if row["source"] == "rules")
+    print(f"leads resolved without the LLM: {skipped}/{len(leads)} ({skipped / len(leads):.0%})" if leads else "no leads")
+
+
+if __name__ == "__main__":
+    main()
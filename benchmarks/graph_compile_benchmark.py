@@ -0,0 +1,61 @@
+"""
+Per-lead cost of compiling the LangGraph: create_graph() on every run (what
+app.py used to do on each click) vs. the process-wide get_compiled_graph().
+No LLM or Google calls are made; only graph construction is timed.
+
+    python benchmarks/graph_compile_benchmark.py --runs 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add project root to Python path to allow imports from orchestrator, agents etc.
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.stats import percentile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Graph compile cost: per run vs. compiled once.")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--variant", default="default")
+    return parser.parse_args()
+
+
+def time_calls(fn, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def summarize(name, times):
+    print(f"{name:<22} p50={percentile(times, 50):.3f} ms  p95={percentile(times, 95):.3f} ms  "
+          f"mean={statistics.mean(times):.3f} ms  total={sum(times):.1f} ms")
+
+
+def main():
+    args = parse_args()
+    # No network needed to build the graph
+    os.environ.setdefault("LLM_BACKEND", "replay")
+
+    from orchestrator.graph import GRAPH_VARIANTS, get_compiled_graph, get_graph_stats
+
+    per_run = time_calls(GRAPH_VARIANTS[args.variant], args.runs)
+    registry = time_calls(lambda: get_compiled_graph(args.variant), args.runs)
+
+    print(f"--- Graph compile ({args.variant}, {args.runs} runs) ---")
+    summarize("create_graph per run", per_run)
+    summarize("get_compiled_graph", registry)
+    print(f"registry stats: {get_graph_stats()}")
+    print(f"overhead saved per lead: {statistics.mean(per_run) - statistics.mean(registry):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+End-to-end latency benchmark of the LangGraph pipeline.
+
+Record a cassette once against the real API, then replay it offline (no network,
+no OpenAI key) with or without the recorded latency:
+
+    python benchmarks/pipeline_benchmark.py --backend record
+    python benchmarks/pipeline_benchmark.py --backend replay --replay-latency
+    python benchmarks/pipeline_benchmark.py --backend replay --replay-latency --async --concurrency 8
+
+Without a Google access token the calendar agent is skipped; --fake-calendar runs
+it against an empty in-memory calendar instead, so scheduling (and the
+rule-based date parser) is measured offline too.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+# Add project root to Python path to allow imports from orchestrator, agents etc.
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from utils.stats import percentile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled graph end to end over a set of leads.")
+    parser.add_argument("--leads", default=os.path.join(BENCHMARK_DIR, "leads.jsonl"),
+                        help="JSONL file with one {lead_message, lead_rule} object per line")
+    parser.add_argument("--backend", choices=["live", "record", "replay"], default="replay")
+    parser.add_argument("--cassette", default=os.path.join(BENCHMARK_DIR, "cassettes", "llm.jsonl"))
+    parser.add_argument("--replay-latency", action="store_true", help="Sleep for the recorded LLM latency")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--runs", type=int, default=1, help="Passes over the lead file")
+    parser.add_argument("--llm-cache", action="store_true",
+                        help="Keep the LLM response cache on (later runs then measure cache hits, not the pipeline)")
+    parser.add_argument("--access-token", default=os.getenv("GOOGLE_ACCESS_TOKEN"),
+                        help="Google access token; without one the calendar agent is skipped")
+    parser.add_argument("--fake-calendar", action="store_true",
+                        help="Run the calendar agent against an empty in-memory calendar (no Google token needed)")
+    parser.add_argument("--output", help="Write per-lead results as JSONL to this file")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run the async graph variant with ainvoke")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Leads in flight at once (with --async)")
+    return parser.parse_args()
+
+
+def configure_backend(args):
+    # utils.llm reads its configuration at import time, so set it up first
+    os.environ["LLM_BACKEND"] = args.backend
+    os.environ["LLM_CASSETTE_PATH"] = os.path.abspath(args.cassette)
+    os.environ["LLM_REPLAY_LATENCY"] = "true" if args.replay_latency else "false"
+    os.environ["LLM_REPLAY_LATENCY_SCALE"] = str(args.latency_scale)
+    # Off unless asked for: a cached answer would stand in for the call being measured
+    os.environ["LLM_CACHE_ENABLED"] = "true" if getattr(args, "llm_cache", False) else "false"
+
+
+def load_leads(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def use_fake_calendar():
+    """Swaps the calendar agent's Google tool for an empty in-memory calendar; returns the token to pass."""
+    import agents.calendar_agent as calendar_agent
+    from tools.google_calendar_tool import GoogleCalendarOAuthTool
+
+    class FakeCalendarTool(GoogleCalendarOAuthTool):
+        # Every day is free and events are only counted: no service, no network
+        def __init__(self, access_token, calendar_id="primary", **kwargs):
+            self.service = None
+            self.calendar_id = calendar_id
+            self.event_store = None
+            self._pending_events = []
+            self.created = 0
+
+        def get_busy_slots_range(self, start_date, end_date):
+            return {day: [] for day in self._days(start_date, end_date)}
+
+        def get_busy_slots_by_calendar(self, calendar_ids, start_date, end_date):
+            return {calendar_id: self.get_busy_slots_range(start_date, end_date) for calendar_id in calendar_ids}
+
+        def create_event(self, summary, description, start_time, duration_minutes=30, location="", attendees=None):
+            self.created += 1
+            return f"https://calendar.example/event/{self._event_body(summary, description, start_time, duration_minutes, location, attendees)['id']}"
+
+    calendar_agent.GoogleCalendarOAuthTool = FakeCalendarTool
+    return "fake-calendar-token"
+
+
+async def run_async(jobs, args, ainvoke_graph, record):
+    """Runs the jobs through the async graph, at most args.concurrency at a time."""
+    from orchestrator.graph import initial_state
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def run_one(run, index, lead):
+        async with semaphore:
+            started = time.perf_counter()
+            error = None
+            report = {}
+            try:
+                state = initial_state(lead["lead_message"], lead.get("lead_rule"), args.access_token)
+                report = (await ainvoke_graph(state)).get("report", {})
+                error = report.get("error")
+            except Exception as e:
+                error = str(e)
+            return record(run, index, started, report, error)
+
+    return list(await asyncio.gather(*(run_one(*job) for job in jobs)))
+
+
+def main():
+    args = parse_args()
+    configure_backend(args)
+
+    from orchestrator.graph import ainvoke_graph, get_compiled_graph, get_graph_stats, initial_state
+    from utils.llm import get_llm_stats
+    from tools.date_parser import get_parser_stats
+
+    if args.fake_calendar:
+        args.access_token = use_fake_calendar()
+    leads = load_leads(args.leads)
+    jobs = [(run, index, lead) for run in range(args.runs) for index, lead in enumerate(leads)]
+
+    def record(run, index, started, report, error):
+        result = {
+            "run": run,
+            "lead": index,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "tokens": report.get("tokens", {}),
+            "agent_metrics": report.get("agent_metrics", {}),
+            "error": error
+        }
+        print(f"run {run} lead {index}: {result['latency_ms']} ms" + (f" (error: {error})" if error else ""))
+        return result
+
+    wall_started = time.perf_counter()
+    if args.use_async:
+        results = asyncio.run(run_async(jobs, args, ainvoke_graph, record))
+    else:
+        graph = get_compiled_graph()
+        results = []
+        for run, index, lead in jobs:
+            started = time.perf_counter()
+            error = None
+            report = {}
+            try:
+                state = initial_state(lead["lead_message"], lead.get("lead_rule"), args.access_token)
+                report = graph.invoke(state).get("report", {})
+                error = report.get("error")
+            except Exception as e:
+                error = str(e)
+            results.append(record(run, index, started, report, error))
+    wall_ms = (time.perf_counter() - wall_started) * 1000
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            for result in results:
+                file.write(json.dumps(result, default=str) + "\n")
+
+    latencies = [r["latency_ms"] for r in results]
+    print("\n--- Pipeline latency ---")
+    print(f"backend={args.backend} replay_latency={args.replay_latency} llm_cache={args.llm_cache} "
+          f"leads={len(leads)} runs={args.runs} "
+          f"mode={'async' if args.use_async else 'sync'} concurrency={args.concurrency if args.use_async else 1}")
+    print(f"wall={round(wall_ms, 1)} ms  throughput={round(len(results) / (wall_ms / 1000), 2) if wall_ms else None} leads/s")
+    print(f"p50={percentile(latencies, 50)} ms  p95={percentile(latencies, 95)} ms  "
+          f"mean={round(statistics.mean(latencies), 1) if latencies else None} ms  max={max(latencies, default=None)} ms")
+    print(f"total tokens={sum(r['tokens'].get('total', 0) or 0 for r in results)}  "
+          f"errors={sum(1 for r in results if r['error'])}")
+
+    agents = sorted({agent for r in results for agent in r["agent_metrics"]})
+    for agent in agents:
+        times = [r["agent_metrics"][agent].get("execution_time_ms", 0) for r in results if agent in r["agent_metrics"]]
+        print(f"  {agent:<15} p50={percentile(times, 50)} ms  p95={percentile(times, 95)} ms")
+
+    print(f"graph compile: {get_graph_stats()}")
+
+    parser_stats = get_parser_stats()
+    if parser_stats["parsed"] + parser_stats["deferred"]:
+        print(f"calendar requests resolved without the LLM: {parser_stats['parsed']}/"
+              f"{parser_stats['parsed'] + parser_stats['deferred']} ({parser_stats['fast_path_rate']:.0%})")
+    else:
+        print("calendar requests resolved without the LLM: not measured "
+              "(calendar agent skipped; pass --access-token or --fake-calendar)")
+
+    llm_stats = get_llm_stats()
+    print("\n--- LLM stats ---")
+    print(json.dumps(llm_stats, indent=2, default=str))
+    backend = llm_stats["backend"]
+    if backend.get("misses") or backend.get("route_fallbacks"):
+        # Those requests didn't replay their own recording: the run doesn't measure the recorded pipeline
+        print(f"\nWARNING: {backend.get('misses', 0)} cassette miss(es) and {backend.get('route_fallbacks', 0)} "
+              f"route fallback(s); re-record the cassette ({backend.get('path')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,40 @@
-from orchestrator.graph import run_graph
+"""
+Batch runner: process a backlog of leads from a JSONL or CSV file.
+
+    python main.py leads.jsonl --output reports.jsonl --concurrency 8
+"""
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from orchestrator.batch import BATCH_CONCURRENCY, iter_leads, run_batch
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a file of leads through the agent graph.")
+    parser.add_argument("leads", help="JSONL or .csv file with lead_message (and optional lead_rule, id) per lead")
+    parser.add_argument("--output", default="reports.jsonl", help="Reports are appended here as JSONL")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Leads in flight at once")
+    parser.add_argument("--lead-rule", help="Rule for leads that don't carry their own")
+    parser.add_argument("--access-token", default=os.getenv("GOOGLE_ACCESS_TOKEN"),
+                        help="Google access token; without one the calendar agent is skipped")
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
-    run_graph()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    args = parse_args()
+    summary = run_batch(iter_leads(args.leads, default_rule=args.lead_rule), output=args.output,
+                        access_token=args.access_token, concurrency=args.concurrency)
+
+    print("\n--- Batch summary ---")
+    print(f"leads={summary['leads']}  errors={summary['errors']}  concurrency={summary['concurrency']}")
+    print(f"wall={summary['wall_ms']} ms  throughput={summary['throughput_per_s']} leads/s")
+    print(f"p50={summary['p50_ms']} ms  p95={summary['p95_ms']} ms  p99={summary['p99_ms']} ms")
+    print(f"tokens: input={summary['tokens']['input']}  output={summary['tokens']['output']}  "
+          f"total={summary['tokens']['total']}")
+    print(f"reports written to {args.output}")
@@ -0,0 +1,138 @@
+"""
+Bulk lead processing: run a backlog of leads through the compiled graph.
+
+Leads are read one at a time from a JSONL file (one {lead_message, lead_rule, id}
+object per line) or a CSV file with the same columns, so the input never has to
+fit in memory. At most `concurrency` leads are in flight on a thread pool; each
+report is appended to the output JSONL as soon as its lead finishes (in
+completion order, tagged with the input line), so an interrupted run keeps what
+it already paid for.
+"""
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from orchestrator.graph import run_graph
+from utils.stats import percentile
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+
+def iter_leads(path, default_rule=None):
+    """
+    Yields (line, lead) from a .csv or JSONL file; line is 1-based (CSV: data rows).
+    Malformed rows (invalid JSON, not an object, no lead_message) are logged and skipped.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(file)
+        else:
+            rows = (_parse_jsonl_row(path, line_number, line) for line_number, line in enumerate(file, start=1))
+        for line, row in enumerate(rows, start=1):
+            if not isinstance(row, dict):
+                continue
+            if not isinstance(row.get("lead_message"), str) or not row["lead_message"].strip():
+                logging.warning(f"Skipping line {line} of {path}: no lead_message")
+                continue
+            yield line, {
+                "id": row.get("id") or row.get("lead_id"),
+                "lead_message": row["lead_message"],
+                "lead_rule": row.get("lead_rule") or default_rule,
+            }
+
+
+def _parse_jsonl_row(path, line, text):
+    if not text.strip():
+        return None
+    try:
+        row = json.loads(text)
+    except ValueError as e:
+        logging.warning(f"Skipping line {line} of {path}: invalid JSON ({e})")
+        return None
+    if not isinstance(row, dict):
+        logging.warning(f"Skipping line {line} of {path}: expected a JSON object, got {type(row).__name__}")
+        return None
+    return row
+
+
+def _run_lead(line, lead, access_token):
+    started = time.perf_counter()
+    report, error = {}, None
+    try:
+        # Leads with an id are checkpointed under it: rerunning the file resumes failed
+        # leads where they stopped and returns finished ones without new LLM calls
+        report = run_graph(lead_message=lead["lead_message"], lead_rule=lead["lead_rule"],
+                           access_token=access_token, thread_id=lead["id"])
+        error = report.get("error")
+    except Exception as e:
+        logging.error(f"Lead on line {line} failed: {e}", exc_info=True)
+        error = str(e)
+    return {
+        "line": line,
+        "id": lead["id"],
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "error": error,
+        "report": report,
+    }
+
+
+def run_batch(leads, output=None, access_token=None, concurrency=BATCH_CONCURRENCY):
+    """
+    Runs an iterable of (line, lead) through the graph with at most `concurrency`
+    leads in flight, writing each result to `output` (a path) as it completes.
+    Returns the summary: leads, errors, wall time, throughput, latency percentiles and
+    the tokens spent by this batch (not those of runs restored from checkpoints).
+    """
+    concurrency = max(1, concurrency)
+    latencies = []
+    tokens = {"input": 0, "output": 0, "total": 0}
+    errors = 0
+    out = open(output, "a", encoding="utf-8") if output else None
+
+    def collect(future):
+        nonlocal errors
+        result = future.result()
+        latencies.append(result["latency_ms"])
+        # Threads finished (or partly run) by an earlier batch only add what this batch spent
+        for key in tokens:
+            tokens[key] += int((result["report"].get("tokens_this_run") or {}).get(key, 0) or 0)
+        if result["error"]:
+            errors += 1
+        if out:
+            out.write(json.dumps(result, default=str) + "\n")
+            out.flush()
+        logging.info(f"Lead on line {result['line']} done in {result['latency_ms']} ms"
+                     + (f" (error: {result['error']})" if result["error"] else ""))
+
+    wall_started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lead") as pool:
+            pending = set()
+            for line, lead in leads:
+                # Read the next lead only when a worker is free
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                pending.add(pool.submit(_run_lead, line, lead, access_token))
+            for future in wait(pending).done:
+                collect(future)
+    finally:
+        if out:
+            out.close()
+    wall_ms = (time.perf_counter() - wall_started) * 1000
+
+    return {
+        "leads": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_ms": round(wall_ms, 1),
+        "throughput_per_s": round(len(latencies) / (wall_ms / 1000), 2) if wall_ms else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "tokens": tokens,
+    }
@@ -1,102 +1,39 @@
 from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableConfig
 from memory.supabase_memory import memory
 from tools.email_tool import EmailTool
 from tools.calendar_tool import CalendarTool
 from tools.google_calendar_tool import GoogleCalendarOAuthTool
 from utils.llm import llm_think
-from utils.langfuse_logger import get_langfuse_handler
-from typing import TypedDict, Optional, Annotated, Dict, Any
+from typing import TypedDict, Optional, Annotated, List
 import json
 from datetime import datetime, timedelta, date, time
 import pytz
 import os
+import asyncio
+import time as time_module
 import logging
+import threading
 
 # Import agent functions
-from agents.inbox_agent import process_message
+from agents.inbox_agent import process_message, aprocess_message, lead_record
 from agents.calendar_agent import schedule_meeting
-from agents.crm_agent import log_lead
+from agents.crm_agent import log_lead, alog_lead
 from agents.reply_agent import generate_reply
 
-# --- Helper function & Reducer (DEFINED BEFORE GraphState) ---
-
-def deep_merge_dicts(dict1, dict2):
-    merged = dict1.copy()
-    for key, value2 in dict2.items():
-        if key in merged:
-            value1 = merged[key]
-            if isinstance(value1, dict) and isinstance(value2, dict):
-                merged[key] = deep_merge_dicts(value1, value2)
-            elif isinstance(value1, list) and isinstance(value2, list):
-                merged[key] = value1 + value2
-            elif isinstance(value1, (int, float)) and isinstance(value2, (int, float)) and \
-                 ("tokens" in key.lower() or "time_ms" in key.lower() or key in ["input", "output", "total"]):
-                 merged[key] = value1 + value2 
-            else:
-                merged[key] = value2
-        else:
-            merged[key] = value2
-    return merged
-
-def reduce_report_state(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
-    if left is None: return right
-    if right is None: return left
-    merged_report = left.copy()
-    merged_report["thoughts"] = left.get("thoughts", []) + right.get("thoughts", [])
-    merged_report["tools_used"] = left.get("tools_used", []) + right.get("tools_used", [])
-    merged_report["meeting"] = right.get("meeting") if right.get("meeting") is not None else left.get("meeting")
-    merged_report["error"] = right.get("error") if right.get("error") is not None else left.get("error")
-    left_agent_thoughts = left.get("agent_thoughts", {})
-    if not isinstance(left_agent_thoughts, dict): left_agent_thoughts = {}
-    right_agent_thoughts = right.get("agent_thoughts", {})
-    if not isinstance(right_agent_thoughts, dict): right_agent_thoughts = {}
-    merged_agent_thoughts = left_agent_thoughts.copy()
-    for agent, thoughts in right_agent_thoughts.items():
-        if not isinstance(thoughts, list): thoughts = [str(thoughts)]
-        merged_agent_thoughts[agent] = merged_agent_thoughts.get(agent, []) + thoughts
-    merged_report["agent_thoughts"] = merged_agent_thoughts
-    left_agent_metrics = left.get("agent_metrics", {})
-    if not isinstance(left_agent_metrics, dict): left_agent_metrics = {}
-    right_agent_metrics = right.get("agent_metrics", {})
-    if not isinstance(right_agent_metrics, dict): right_agent_metrics = {}
-    merged_agent_metrics = left_agent_metrics.copy()
-    for agent, metrics_right in right_agent_metrics.items():
-        if not isinstance(metrics_right, dict): continue
-        metrics_left = merged_agent_metrics.get(agent, {})
-        if not isinstance(metrics_left, dict): metrics_left = {}
-        merged_agent_metrics[agent] = {
-            "input_tokens": int(metrics_left.get("input_tokens", 0) or 0) + int(metrics_right.get("input", 0) or 0),
-            "output_tokens": int(metrics_left.get("output_tokens", 0) or 0) + int(metrics_right.get("output", 0) or 0),
-            "total_tokens": int(metrics_left.get("total_tokens", 0) or 0) + int(metrics_right.get("total", 0) or 0),
-            "execution_time_ms": int(metrics_left.get("execution_time_ms", 0) or 0) + int(metrics_right.get("execution_time_ms", 0) or 0),
-        }
-    merged_report["agent_metrics"] = merged_agent_metrics
-    global_input_tokens = 0
-    global_output_tokens = 0
-    global_total_tokens = 0
-    for agent_metrics_data in merged_agent_metrics.values():
-        if isinstance(agent_metrics_data, dict):
-            global_input_tokens += int(agent_metrics_data.get("input_tokens", 0) or 0)
-            global_output_tokens += int(agent_metrics_data.get("output_tokens", 0) or 0)
-            global_total_tokens += int(agent_metrics_data.get("total_tokens", 0) or 0)
-    merged_report["tokens"] = {
-        "input": global_input_tokens,
-        "output": global_output_tokens,
-        "total": global_total_tokens
-    }
-    left_detailed = left.get("detailed_execution", {})
-    if not isinstance(left_detailed, dict): left_detailed = {}
-    right_detailed = right.get("detailed_execution", {})
-    if not isinstance(right_detailed, dict): right_detailed = {}
-    merged_report["detailed_execution"] = deep_merge_dicts(left_detailed, right_detailed)
-    return merged_report
+# The report channel is an append-only log (see orchestrator/report_log.py);
+# the full report dict is only built when someone asks for it
+from orchestrator.report_log import ReportLog, append_report, materialize_report
 
 # --- State Definition (Simplified for non-interrupting graph) ---
 class GraphState(TypedDict):
     lead_message: str
     lead_rule: Optional[str]
     access_token: Optional[str] 
-    report: Annotated[Dict[str, Any], reduce_report_state] 
+    # The inbox agent's record of the lead (sender, subject). Kept in state, not in
+    # the shared memory, so concurrent runs can't read each other's lead
+    lead: Optional[dict]
+    report: Annotated[ReportLog, append_report] 
     
     # Flags/Data indicating completion of stages or data passing
     calendar_done: Optional[bool]
@@ -104,12 +41,15 @@ class GraphState(TypedDict):
     calendar_link: Optional[str]
     meeting_time: Optional[str]
     meeting_type: Optional[str]
+    alternative_slots: Optional[List[str]]
+    # Set for runs with a checkpointer: a failing node raises instead of
+    # reporting, so it stays unfinished and a re-invocation retries it
+    checkpointed: Optional[bool]
     draft_reply: Optional[str] # Reply node output stored here
 
     error: Optional[str]
 
-# Initialize Langfuse handler
-langfuse_handler = get_langfuse_handler()
+# Langfuse is initialized lazily by utils.langfuse_logger on first traced call
 trace = None  # Will store the active trace
 
 email_tool = EmailTool()
@@ -147,103 +87,195 @@ def add_observation_safely(span, name, value=None, metadata=None):
     except Exception as e:
         logging.warning(f"Failed to log observation to Langfuse: {str(e)}")
 
+def agent_metrics(result, started):
+    """Builds the per-agent metrics entry: the agent's LLM usage record plus node wall time."""
+    metrics = dict(result.get("tokens", {}) or {})
+    metrics["execution_time_ms"] = int((time_module.perf_counter() - started) * 1000)
+    return metrics
+
+def _inbox_output(result, started):
+    partial_report = {
+        "thoughts": [result["thought"]],
+        "tools_used": result.get("tools_used", []),
+        "agent_thoughts": {"inbox_agent": [result["thought"]]} ,
+        "agent_metrics": {"inbox_agent": agent_metrics(result, started)}
+    }
+    return {"report": partial_report, "lead": result.get("lead")}
+
 def inbox_node(state: GraphState):
     """Node to process the inbox message."""
+    started = time_module.perf_counter()
     try:
         result = process_message(
             lead_message=state["lead_message"],
             lead_rule=state.get("lead_rule")
         )
-        partial_report = {
-            "thoughts": [result["thought"]],
-            "tools_used": result.get("tools_used", []),
-            "agent_thoughts": {"inbox_agent": [result["thought"]]} ,
-            "agent_metrics": {"inbox_agent": result.get("tokens", {}).copy()}
-        }
-        return {"report": partial_report}
+        return _inbox_output(result, started)
     except Exception as e:
         logging.error(f"Error in inbox_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
         return {"report": {"error": f"Inbox node error: {str(e)}"}}
 
-def calendar_node(state: GraphState):
+async def ainbox_node(state: GraphState):
+    """Async inbox node: the LLM call runs on the async client."""
+    started = time_module.perf_counter()
+    try:
+        result = await aprocess_message(
+            lead_message=state["lead_message"],
+            lead_rule=state.get("lead_rule")
+        )
+        return _inbox_output(result, started)
+    except Exception as e:
+        logging.error(f"Error in inbox_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
+        return {"report": {"error": f"Inbox node error: {str(e)}"}}
+
+def _calendar_output(result, started):
+    partial_report = {
+        "thoughts": [result["thought"]],
+        "tools_used": result.get("tools_used", []),
+        "agent_thoughts": {"calendar_agent": [result["thought"]]} ,
+        "agent_metrics": {"calendar_agent": agent_metrics(result, started)}
+    }
+    output_state = {"report": partial_report, "calendar_done": True}
+    if result.get("calendar_link"): output_state["calendar_link"] = result["calendar_link"]
+    if result.get("meeting_time"): output_state["meeting_time"] = result["meeting_time"]
+    if result.get("meeting_type"): output_state["meeting_type"] = result["meeting_type"]
+    if result.get("alternative_slots"): output_state["alternative_slots"] = result["alternative_slots"]
+    if result.get("error"): 
+        partial_report["error"] = result["error"]
+        partial_report["meeting"] = f"Failed to schedule: {result['error']}"
+        output_state["error"] = result["error"]
+    return output_state
+
+def _access_token(state, config):
+    # Checkpointed runs pass the token in the config so it is never written to the checkpoint
+    # store (nested: LangGraph copies plain string config values into checkpoint metadata)
+    google = ((config or {}).get("configurable") or {}).get("google") or {}
+    return state.get("access_token") or google.get("access_token")
+
+def calendar_node(state: GraphState, config: RunnableConfig):
     """Node to schedule the meeting."""
+    started = time_module.perf_counter()
     try:
         result = schedule_meeting(
             lead_message=state["lead_message"],
-            access_token=state.get("access_token")
+            access_token=_access_token(state, config),
+            raise_errors=bool(state.get("checkpointed"))
         )
-        partial_report = {
-            "thoughts": [result["thought"]],
-            "tools_used": result.get("tools_used", []),
-            "agent_thoughts": {"calendar_agent": [result["thought"]]} ,
-            "agent_metrics": {"calendar_agent": result.get("tokens", {}).copy()}
-        }
-        output_state = {"report": partial_report, "calendar_done": True}
-        if result.get("calendar_link"): output_state["calendar_link"] = result["calendar_link"]
-        if result.get("meeting_time"): output_state["meeting_time"] = result["meeting_time"]
-        if result.get("meeting_type"): output_state["meeting_type"] = result["meeting_type"]
-        if result.get("error"): 
-            partial_report["error"] = result["error"]
-            partial_report["meeting"] = f"Failed to schedule: {result['error']}"
-            output_state["error"] = result["error"]
-        return output_state
+        return _calendar_output(result, started)
     except Exception as e:
         logging.error(f"Error in calendar_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
         return {"report": {"error": f"Calendar node error: {str(e)}"}, "calendar_done": False}
 
+async def acalendar_node(state: GraphState, config: RunnableConfig):
+    """Async calendar node: the Google client is blocking, so the agent runs in a worker thread."""
+    started = time_module.perf_counter()
+    try:
+        result = await asyncio.to_thread(
+            schedule_meeting,
+            lead_message=state["lead_message"],
+            access_token=_access_token(state, config),
+            raise_errors=bool(state.get("checkpointed"))
+        )
+        return _calendar_output(result, started)
+    except Exception as e:
+        logging.error(f"Error in calendar_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
+        return {"report": {"error": f"Calendar node error: {str(e)}"}, "calendar_done": False}
+
+def _crm_output(result, started):
+    partial_report = {
+        "thoughts": [result["thought"]],
+        "tools_used": result.get("tools_used", []),
+        "agent_thoughts": {"crm_agent": [result["thought"]]} ,
+        "agent_metrics": {"crm_agent": agent_metrics(result, started)}
+    }
+    if result.get("error"): partial_report["error"] = result["error"]
+    return {"report": partial_report, "crm_done": True}
+
 def crm_node(state: GraphState):
     """Node to log lead to CRM."""
+    started = time_module.perf_counter()
     try:
-        result = log_lead(lead_message=state["lead_message"])
-        partial_report = {
-            "thoughts": [result["thought"]],
-            "tools_used": result.get("tools_used", []),
-            "agent_thoughts": {"crm_agent": [result["thought"]]} ,
-            "agent_metrics": {"crm_agent": result.get("tokens", {}).copy()}
-        }
-        if result.get("error"): partial_report["error"] = result["error"]
-        return {"report": partial_report, "crm_done": True}
+        return _crm_output(log_lead(lead_message=state["lead_message"],
+                                    raise_errors=bool(state.get("checkpointed"))), started)
     except Exception as e:
         logging.error(f"Error in crm_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
         return {"report": {"error": f"CRM node error: {str(e)}"}, "crm_done": False}
 
+async def acrm_node(state: GraphState):
+    """Async CRM node: the LLM extraction runs on the async client."""
+    started = time_module.perf_counter()
+    try:
+        return _crm_output(await alog_lead(lead_message=state["lead_message"],
+                                           raise_errors=bool(state.get("checkpointed"))), started)
+    except Exception as e:
+        logging.error(f"Error in crm_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
+        return {"report": {"error": f"CRM node error: {str(e)}"}, "crm_done": False}
+
+def _lead(state):
+    # Restored from the checkpoint on resume; threads saved before the lead was
+    # kept in state rebuild it from their own lead_message
+    return state.get("lead") or lead_record(state["lead_message"])
+
+def _meeting_info(state):
+    return {
+        "calendar_link": state.get("calendar_link"),
+        "meeting_time": state.get("meeting_time"),
+        "meeting_type": state.get("meeting_type"),
+        "alternative_slots": state.get("alternative_slots"),
+        "error": (state.get("report") or {}).get("error") or state.get("error"),
+        # No feedback passed via state in this non-looping version
+    }
+
+def _reply_output(result, started):
+    partial_report = {
+        "thoughts": [result["thought"]],
+        "tools_used": result.get("tools_used", []),
+        "agent_thoughts": {"reply_agent": [result["thought"]]} ,
+        "agent_metrics": {"reply_agent": agent_metrics(result, started)}
+    }
+    if result.get("error"): partial_report["error"] = result["error"]
+    
+    # Return the final reply content in the state
+    return {
+        "report": partial_report, 
+        "draft_reply": result.get("reply") 
+    }
+
 def reply_node(state: GraphState):
     """Node to generate the draft reply and store it in state."""
+    started = time_module.perf_counter()
     try:
-        meeting_info = {
-            "calendar_link": state.get("calendar_link"),
-            "meeting_time": state.get("meeting_time"),
-            "meeting_type": state.get("meeting_type"),
-            "error": state.get("report", {}).get("error") or state.get("error"),
-            # No feedback passed via state in this non-looping version
-        }
-        # The generate_reply function saves to memory internally
-        result = generate_reply(meeting_info=meeting_info) 
-        partial_report = {
-            "thoughts": [result["thought"]],
-            "tools_used": result.get("tools_used", []),
-            "agent_thoughts": {"reply_agent": [result["thought"]]} ,
-            "agent_metrics": {"reply_agent": result.get("tokens", {}).copy()}
-        }
-        if result.get("error"): partial_report["error"] = result["error"]
-        
-        # Return the final reply content in the state
-        return {
-            "report": partial_report, 
-            "draft_reply": result.get("reply") 
-        }
+        result = generate_reply(meeting_info=_meeting_info(state), lead=_lead(state))
+        return _reply_output(result, started)
     except Exception as e:
         logging.error(f"Error in reply_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
+        return {"report": {"error": f"Reply node error: {str(e)}"}}
+
+async def areply_node(state: GraphState):
+    """Async reply node: generate_reply (which may stream) runs in a worker thread."""
+    started = time_module.perf_counter()
+    try:
+        result = await asyncio.to_thread(generate_reply, meeting_info=_meeting_info(state), lead=_lead(state))
+        return _reply_output(result, started)
+    except Exception as e:
+        logging.error(f"Error in reply_node: {e}", exc_info=True)
+        if state.get("checkpointed"): raise
         return {"report": {"error": f"Reply node error: {str(e)}"}}
 
 # --- Graph Definition (Simplified Edges) ---
-def create_graph():
-    """Creates the LangGraph StateGraph (no HITL interruption)."""
+def _build_graph(inbox, calendar, crm, reply, checkpointer=None):
     builder = StateGraph(GraphState)
-    builder.add_node("inbox", inbox_node)
-    builder.add_node("calendar", calendar_node)
-    builder.add_node("crm", crm_node) 
-    builder.add_node("reply", reply_node)
+    builder.add_node("inbox", inbox)
+    builder.add_node("calendar", calendar)
+    builder.add_node("crm", crm) 
+    builder.add_node("reply", reply)
     # REMOVED: builder.add_node("human_review", human_review_node)
 
     builder.set_entry_point("inbox")
@@ -257,6 +289,140 @@ def create_graph():
     # REMOVED: Conditional edge
 
     # Compile WITHOUT interruption
-    return builder.compile()
+    return builder.compile(checkpointer=checkpointer)
+
+def create_graph(checkpointer=None):
+    """
+    Creates the LangGraph StateGraph (no HITL interruption). With a checkpointer
+    every finished node is saved under the run's thread_id, and invoking the
+    same thread again resumes after the last finished node.
+    """
+    return _build_graph(inbox_node, calendar_node, crm_node, reply_node, checkpointer=checkpointer)
+
+# --- Checkpointing ---
+GRAPH_CHECKPOINT_PATH = os.getenv("GRAPH_CHECKPOINT_PATH", ".graph_checkpoints.sqlite3")
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+def get_checkpointer():
+    """The process-wide SQLite checkpointer at GRAPH_CHECKPOINT_PATH (opened on first use)."""
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            # Imported here: only checkpointed runs need langgraph-checkpoint-sqlite
+            import sqlite3
+            from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+            from langgraph.checkpoint.sqlite import SqliteSaver
+
+            # One connection shared by every thread; SqliteSaver serializes access to it
+            connection = sqlite3.connect(GRAPH_CHECKPOINT_PATH, check_same_thread=False)
+            serde = JsonPlusSerializer(allowed_msgpack_modules=[("orchestrator.report_log", "ReportLog")])
+            _checkpointer = SqliteSaver(connection, serde=serde)
+            logging.info(f"Graph checkpoints stored in {GRAPH_CHECKPOINT_PATH}")
+        return _checkpointer
+
+def create_async_graph():
+    """Same graph with async nodes, for ainvoke: the calendar and CRM branches overlap on one event loop."""
+    return _build_graph(ainbox_node, acalendar_node, acrm_node, areply_node)
+
+# --- Compiled graph registry ---
+# Builders per graph variant; each is compiled once per process by get_compiled_graph
+GRAPH_VARIANTS = {
+    "default": create_graph,
+    "async": create_async_graph,
+    "checkpointed": lambda: create_graph(checkpointer=get_checkpointer()),
+}
+
+_compiled_graphs = {}
+_compiled_graphs_lock = threading.Lock()
+_graph_stats = {}
+
+def get_compiled_graph(variant: str = "default"):
+    """
+    Returns the process-wide compiled graph for a variant, compiling it on first use.
+    Compiled LangGraph graphs hold no per-run state, so one instance serves every
+    run, from any thread or event loop.
+    """
+    graph = _compiled_graphs.get(variant)
+    if graph is not None:
+        # The counter is shared by every thread; the dict lookup above needs no lock
+        with _compiled_graphs_lock:
+            _graph_stats[variant]["reused"] += 1
+        return graph
+    if variant not in GRAPH_VARIANTS:
+        raise ValueError(f"Unknown graph variant '{variant}' (expected one of {sorted(GRAPH_VARIANTS)})")
+    with _compiled_graphs_lock:
+        # Another thread may have compiled it while we waited
+        graph = _compiled_graphs.get(variant)
+        if graph is None:
+            started = time_module.perf_counter()
+            graph = GRAPH_VARIANTS[variant]()
+            compile_ms = round((time_module.perf_counter() - started) * 1000, 2)
+            _graph_stats[variant] = {"compile_ms": compile_ms, "reused": 0}
+            _compiled_graphs[variant] = graph
+            logging.info(f"Compiled graph '{variant}' in {compile_ms} ms")
+        else:
+            _graph_stats[variant]["reused"] += 1
+        return graph
+
+async def ainvoke_graph(initial_state, variant: str = "async", config=None):
+    """Runs the compiled async graph with ainvoke and returns the final state."""
+    return await get_compiled_graph(variant).ainvoke(initial_state, config)
+
+def get_graph_stats():
+    """Compile time and reuse count per compiled variant."""
+    with _compiled_graphs_lock:
+        return {variant: dict(stats) for variant, stats in _graph_stats.items()}
+
+def initial_state(lead_message: str, lead_rule: Optional[str] = None, access_token: Optional[str] = None,
+                  checkpointed: bool = False):
+    """The state a run starts from: the lead plus an empty report."""
+    return {
+        "lead_message": lead_message,
+        "lead_rule": lead_rule,
+        "access_token": access_token,
+        "checkpointed": checkpointed,
+        "report": {
+            "thoughts": [], "tools_used": [], "meeting": None, "error": None,
+            "agent_thoughts": {}, "agent_metrics": {}, "tokens": {"input": 0, "output": 0, "total": 0},
+            "detailed_execution": {}
+        }
+    }
+
+def run_graph(lead_message: str, lead_rule: Optional[str] = None, access_token: Optional[str] = None,
+              variant: str = "default", config=None, thread_id: Optional[str] = None):
+    """
+    Runs one lead through the compiled graph and returns the report as a plain dict.
+    With a thread_id (e.g. a lead ID) the run is checkpointed: if an earlier run of
+    that thread failed or was interrupted, it resumes after the last finished node
+    (no repeated LLM calls or calendar events); if it completed, its report is returned.
+    report["tokens_this_run"] counts only the tokens spent by this call, not those
+    of nodes restored from the checkpoint.
+    """
+    if thread_id is None:
+        final_state = get_compiled_graph(variant).invoke(initial_state(lead_message, lead_rule, access_token), config)
+        report = materialize_report(final_state.get("report"))
+        report["tokens_this_run"] = dict(report.get("tokens") or {})
+        return report
 
-# The run_graph function is NOT needed here, app.py uses create_graph and invoke
\ No newline at end of file
+    graph = get_compiled_graph("checkpointed")
+    config = dict(config or {})
+    config["configurable"] = {**(config.get("configurable") or {}), "thread_id": str(thread_id),
+                              "google": {"access_token": access_token}}
+    snapshot = graph.get_state(config)
+    # Tokens already in the checkpoint were paid for by an earlier run
+    restored = (materialize_report(snapshot.values["report"]).get("tokens") or {}) \
+        if snapshot.values.get("report") is not None else {}
+    if snapshot.next:
+        logging.info(f"Resuming thread {thread_id} at {list(snapshot.next)}")
+        final_state = graph.invoke(None, config)
+    elif snapshot.values:
+        logging.info(f"Thread {thread_id} already completed; returning its checkpointed report")
+        final_state = snapshot.values
+    else:
+        final_state = graph.invoke(initial_state(lead_message, lead_rule, None, checkpointed=True), config)
+    report = materialize_report(final_state.get("report"))
+    report["tokens_this_run"] = {key: int(value or 0) - int(restored.get(key, 0) or 0)
+                                 for key, value in (report.get("tokens") or {}).items()}
+    return report
@@ -0,0 +1,203 @@
+"""
+Append-only run report for the LangGraph state.
+
+Each node returns a partial report (thoughts, tools_used, agent_thoughts,
+agent_metrics, meeting, error, detailed_execution). Merging those into a fresh
+dict on every step copied the whole report each time; a ReportLog instead
+appends the partial report as one entry of a persistent linked list (a new log
+shares every earlier entry with the previous one) and only updates the running
+aggregates: tokens per agent and in total, execution/LLM time, meeting, error.
+
+The dict shape the UI and the API return is built by to_dict() (or
+materialize_report), once, when it is actually needed.
+"""
+import threading
+
+_EMPTY_TOKENS = {"input": 0, "output": 0, "total": 0}
+# Report keys answered from the aggregates without building the full report
+_AGGREGATE_KEYS = ("tokens", "agent_metrics", "meeting", "error")
+
+
+def _merge_into(target, source):
+    """In-place version of the old deep_merge_dicts: lists concatenate, token/time counters add up."""
+    for key, value2 in source.items():
+        if key in target:
+            value1 = target[key]
+            if isinstance(value1, dict) and isinstance(value2, dict):
+                _merge_into(value1, value2)
+            elif isinstance(value1, list) and isinstance(value2, list):
+                value1.extend(value2)
+            elif isinstance(value1, (int, float)) and isinstance(value2, (int, float)) and \
+                 ("tokens" in key.lower() or "time_ms" in key.lower() or key in ["input", "output", "total"]):
+                target[key] = value1 + value2
+            else:
+                target[key] = _copy(value2)
+        else:
+            target[key] = _copy(value2)
+
+
+def _copy(value):
+    # Entries are shared between logs: never let the materialized report alias them
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class ReportLog:
+    """Immutable report: append() returns a new log sharing this one's entries."""
+
+    __slots__ = ("parent", "entry", "base", "size", "tokens", "agent_metrics", "meeting", "error",
+                 "_report", "_lock")
+
+    def __init__(self, base=None):
+        base = base if isinstance(base, dict) else {}
+        self.parent = None
+        self.entry = None
+        # The initial report passed in by the caller (materialized shape)
+        self.base = base
+        self.size = 0
+        self.agent_metrics = {agent: dict(metrics) for agent, metrics in (base.get("agent_metrics") or {}).items()
+                              if isinstance(metrics, dict)}
+        self.tokens = self._sum_tokens(self.agent_metrics)
+        self.meeting = base.get("meeting")
+        self.error = base.get("error")
+        self._report = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sum_tokens(agent_metrics):
+        return {
+            "input": sum(int(m.get("input_tokens", 0) or 0) for m in agent_metrics.values()),
+            "output": sum(int(m.get("output_tokens", 0) or 0) for m in agent_metrics.values()),
+            "total": sum(int(m.get("total_tokens", 0) or 0) for m in agent_metrics.values()),
+        }
+
+    def append(self, entry):
+        """Returns a new log with one more partial report; O(agents touched by the entry)."""
+        if not isinstance(entry, dict) or not entry:
+            return self
+        log = object.__new__(ReportLog)
+        log.parent = self
+        log.entry = entry
+        log.base = self.base
+        log.size = self.size + 1
+        log.meeting = entry.get("meeting") if entry.get("meeting") is not None else self.meeting
+        log.error = entry.get("error") if entry.get("error") is not None else self.error
+        log._report = None
+        log._lock = threading.Lock()
+
+        metrics = entry.get("agent_metrics")
+        if isinstance(metrics, dict) and metrics:
+            # Copy-on-write: only the agents in this entry get new metric dicts
+            log.agent_metrics = dict(self.agent_metrics)
+            log.tokens = dict(self.tokens)
+            for agent, metrics_right in metrics.items():
+                if not isinstance(metrics_right, dict):
+                    continue
+                metrics_left = self.agent_metrics.get(agent, {})
+                added = {
+                    "input_tokens": int(metrics_right.get("input", 0) or 0),
+                    "output_tokens": int(metrics_right.get("output", 0) or 0),
+                    "total_tokens": int(metrics_right.get("total", 0) or 0),
+                }
+                log.agent_metrics[agent] = {
+                    "input_tokens": int(metrics_left.get("input_tokens", 0) or 0) + added["input_tokens"],
+                    "output_tokens": int(metrics_left.get("output_tokens", 0) or 0) + added["output_tokens"],
+                    "total_tokens": int(metrics_left.get("total_tokens", 0) or 0) + added["total_tokens"],
+                    "execution_time_ms": int(metrics_left.get("execution_time_ms", 0) or 0) + int(metrics_right.get("execution_time_ms", 0) or 0),
+                    "llm_latency_ms": int(metrics_left.get("llm_latency_ms", 0) or 0) + int(metrics_right.get("latency_ms", 0) or 0),
+                    "model": metrics_right.get("model") or metrics_left.get("model"),
+                }
+                log.tokens["input"] += added["input_tokens"]
+                log.tokens["output"] += added["output_tokens"]
+                log.tokens["total"] += added["total_tokens"]
+        else:
+            log.agent_metrics = self.agent_metrics
+            log.tokens = self.tokens
+        return log
+
+    def entries(self):
+        """The partial reports, oldest first."""
+        entries = []
+        log = self
+        while log is not None and log.entry is not None:
+            entries.append(log.entry)
+            log = log.parent
+        entries.reverse()
+        return entries
+
+    def get(self, key, default=None):
+        """Dict-style access; aggregates are answered without building the full report."""
+        if key == "tokens":
+            return dict(self.tokens)
+        if key == "agent_metrics":
+            return {agent: dict(metrics) for agent, metrics in self.agent_metrics.items()}
+        if key in ("meeting", "error"):
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.to_dict().get(key, default)
+
+    def to_dict(self):
+        """The full report dict (built once per log, then reused)."""
+        with self._lock:
+            if self._report is None:
+                self._report = self._build()
+            return self._report
+
+    def _build(self):
+        report = _copy(self.base)
+        thoughts = report["thoughts"] = list(report.get("thoughts") or [])
+        tools_used = report["tools_used"] = list(report.get("tools_used") or [])
+        agent_thoughts = report["agent_thoughts"] = {
+            agent: list(items) for agent, items in (report.get("agent_thoughts") or {}).items()
+        } if isinstance(report.get("agent_thoughts"), dict) else {}
+        detailed = report["detailed_execution"] = report.get("detailed_execution") \
+            if isinstance(report.get("detailed_execution"), dict) else {}
+
+        for entry in self.entries():
+            thoughts.extend(entry.get("thoughts", []))
+            tools_used.extend(entry.get("tools_used", []))
+            right_agent_thoughts = entry.get("agent_thoughts", {})
+            if isinstance(right_agent_thoughts, dict):
+                for agent, items in right_agent_thoughts.items():
+                    if not isinstance(items, list): items = [str(items)]
+                    agent_thoughts.setdefault(agent, []).extend(items)
+            if isinstance(entry.get("detailed_execution"), dict):
+                _merge_into(detailed, entry["detailed_execution"])
+
+        report["meeting"] = self.meeting
+        report["error"] = self.error
+        report["agent_metrics"] = self.get("agent_metrics")
+        report["tokens"] = self.get("tokens")
+        return report
+
+    def _asdict(self):
+        # Checkpoint serialization (LangGraph's serializer rebuilds the log as
+        # ReportLog(**this)): the log is stored as its materialized report
+        return {"base": self.to_dict()}
+
+    def __repr__(self):
+        return f"ReportLog(entries={self.size}, tokens={self.tokens}, error={self.error!r})"
+
+
+def append_report(left, right):
+    """LangGraph reducer for the report channel: appends a node's partial report to the log."""
+    if left is None:
+        left = ReportLog()
+    elif not isinstance(left, ReportLog):
+        left = ReportLog(left)
+    if right is None:
+        return left
+    if isinstance(right, ReportLog):
+        # A whole report written to the channel replaces it
+        return right
+    return left.append(right)
+
+
+def materialize_report(report):
+    """The report as a plain dict, whether the state holds a ReportLog or a dict."""
+    if isinstance(report, ReportLog):
+        return report.to_dict()
+    return report or {}
@@ -0,0 +1,208 @@
+"""
+Minute-resolution availability index for slot searches.
+
+Busy slots (as returned by GoogleCalendarOAuthTool.get_busy_slots_range) are
+painted into one NumPy occupancy bitmap per day, with a prefix sum per row, so
+"is [start, end) free?" is two lookups and "first free N-minute windows at
+granularity G within business hours" is one vectorized pass over every
+candidate start of every day, instead of a linear scan of the busy slots per
+candidate.
+"""
+import logging
+import os
+from datetime import datetime, timedelta, time
+
+import numpy as np
+import pytz
+
+BUSINESS_START_HOUR = int(os.getenv("CALENDAR_BUSINESS_START_HOUR", "9"))
+BUSINESS_END_HOUR = int(os.getenv("CALENDAR_BUSINESS_END_HOUR", "17"))
+# Candidate meeting starts are aligned to this many minutes (9:00, 9:30, ...)
+SLOT_GRANULARITY_MINUTES = int(os.getenv("CALENDAR_SLOT_GRANULARITY_MINUTES", "30"))
+# A day with a busy stretch longer than this (full-day event, off-site) is skipped entirely
+BLOCKING_SLOT_HOURS = 12
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class AvailabilityIndex:
+    """Per-day busy-minute bitmaps built once from {date: [busy slots]}."""
+
+    def __init__(self, busy_by_day, tz=None, days=None):
+        self.tz = tz or pytz.timezone("Europe/Paris")
+        self.days = sorted(days if days is not None else busy_by_day)
+        self._rows = {day: row for row, day in enumerate(self.days)}
+        self.busy = np.zeros((len(self.days), MINUTES_PER_DAY), dtype=bool)
+        self.blocked = np.zeros(len(self.days), dtype=bool)
+        # Per-calendar indexes and their combination mode when built with from_calendars
+        self.calendars = {}
+        self.mode = None
+
+        for day, slots in busy_by_day.items():
+            row = self._rows.get(day)
+            if row is None:
+                continue
+            for slot in slots:
+                if (slot["end"] - slot["start"]).total_seconds() > BLOCKING_SLOT_HOURS * 3600:
+                    self.blocked[row] = True
+                start = self._minute_of_day(day, slot["start"])
+                end = self._minute_of_day(day, slot["end"], round_up=True)
+                self.busy[row, start:end] = True
+        self._update_cumsum()
+
+    def _update_cumsum(self):
+        # Busy minutes of a day in [a, b) = cumsum[b] - cumsum[a]
+        self._cumsum = np.zeros((len(self.days), MINUTES_PER_DAY + 1), dtype=np.int32)
+        np.cumsum(self.busy, axis=1, out=self._cumsum[:, 1:])
+
+    @classmethod
+    def from_calendars(cls, busy_by_calendar, mode="all", tz=None):
+        """
+        Combines {calendar_id: {date: [busy slots]}} into one index.
+        mode "all": a minute is free only if every calendar is free (attendees must all join).
+        mode "any": a slot is free if at least one calendar is free for all of it
+        (round-robin pool); free_calendars() then tells which ones. The combined
+        bitmap only marks minutes when every calendar is busy, so is_free and
+        find_slots also check the calendars one by one.
+        """
+        if mode not in ("all", "any"):
+            raise ValueError(f"Unknown availability mode '{mode}' (expected 'all' or 'any')")
+        days = sorted({day for busy_by_day in busy_by_calendar.values() for day in busy_by_day})
+        calendars = {calendar_id: cls(busy_by_day, tz=tz, days=days)
+                     for calendar_id, busy_by_day in busy_by_calendar.items()}
+
+        combined = cls({}, tz=tz, days=days)
+        combined.calendars = calendars
+        combined.mode = mode
+        if calendars:
+            # One (calendars, days, minutes) stack reduced along the calendar axis
+            busy = np.stack([index.busy for index in calendars.values()])
+            blocked = np.stack([index.blocked for index in calendars.values()])
+            reduce = np.logical_or if mode == "all" else np.logical_and
+            combined.busy = reduce.reduce(busy, axis=0)
+            combined.blocked = reduce.reduce(blocked, axis=0)
+            combined._update_cumsum()
+        return combined
+
+    def _minute_of_day(self, day, moment, round_up=False):
+        """Wall-clock minute of `moment` on `day`, clamped to [0, 1440]."""
+        local = moment.astimezone(self.tz)
+        if local.date() < day:
+            return 0
+        if local.date() > day:
+            return MINUTES_PER_DAY
+        minute = local.hour * 60 + local.minute
+        if round_up and (local.second or local.microsecond):
+            minute += 1
+        return minute
+
+    def _at(self, day, minute):
+        return self.tz.localize(datetime.combine(day, time.min) + timedelta(minutes=int(minute)))
+
+    def _pooled(self):
+        # "any" index: a window of free minutes may be covered by different calendars in turns
+        return self.mode == "any" and bool(self.calendars)
+
+    def _free_starts(self, starts, duration_minutes):
+        """(days, candidates) mask: the window at each start holds no busy minute and its day isn't blocked."""
+        free = (self._cumsum[:, starts + duration_minutes] - self._cumsum[:, starts]) == 0
+        return free & ~self.blocked[:, None]
+
+    def is_free(self, start, end):
+        """
+        True if no busy minute overlaps [start, end). Days outside the index count as free.
+        For an "any" index, one calendar must also be free for the whole window.
+        """
+        if not self._no_busy_minute(start, end):
+            return False
+        if self._pooled():
+            return bool(self.free_calendars(start, end))
+        return True
+
+    def _no_busy_minute(self, start, end):
+        start = start.astimezone(self.tz)
+        end = end.astimezone(self.tz)
+        day = start.date()
+        while day <= end.date():
+            row = self._rows.get(day)
+            if row is not None:
+                first = self._minute_of_day(day, start)
+                last = self._minute_of_day(day, end, round_up=True)
+                if first < last and self._cumsum[row, last] - self._cumsum[row, first] > 0:
+                    return False
+            day += timedelta(days=1)
+        return True
+
+    def mark_busy(self, start, end):
+        """Marks [start, end) busy (e.g. a slot reserved for another lead) and updates the prefix sums."""
+        start = start.astimezone(self.tz)
+        end = end.astimezone(self.tz)
+        day = start.date()
+        while day <= end.date():
+            row = self._rows.get(day)
+            if row is not None:
+                first = self._minute_of_day(day, start)
+                last = self._minute_of_day(day, end, round_up=True)
+                if first < last:
+                    self.busy[row, first:last] = True
+                    np.cumsum(self.busy[row], out=self._cumsum[row, 1:])
+            day += timedelta(days=1)
+
+    def find_slots(self, earliest, duration_minutes=30, granularity=SLOT_GRANULARITY_MINUTES, k=1,
+                   max_per_day=None, start_hour=BUSINESS_START_HOUR, end_hour=BUSINESS_END_HOUR,
+                   skip_weekends=True):
+        """
+        Returns up to k free, non-overlapping slot starts (timezone-aware, in order)
+        at or after `earliest`, aligned to `granularity` minutes and ending within
+        business hours. max_per_day spreads the candidates over several days.
+        Weekends are skipped unless `earliest` itself falls on one.
+        """
+        earliest = earliest.astimezone(self.tz)
+        starts = np.arange(start_hour * 60, end_hour * 60 - duration_minutes + 1, granularity)
+        if not len(starts) or not self.days:
+            return []
+
+        # (days, candidates): a candidate is free when its window holds no busy minute
+        free = self._free_starts(starts, duration_minutes)
+        if self._pooled():
+            free &= np.logical_or.reduce([index._free_starts(starts, duration_minutes)
+                                          for index in self.calendars.values()])
+
+        first_day = earliest.date()
+        days = np.array([(day - first_day).days for day in self.days])
+        usable = days >= 0
+        if skip_weekends:
+            weekdays = np.array([day.weekday() for day in self.days])
+            usable &= (weekdays < 5) | (days == 0)
+        free &= usable[:, None]
+        if first_day in self._rows:
+            earliest_minute = self._minute_of_day(first_day, earliest, round_up=True)
+            free[self._rows[first_day]] &= starts >= earliest_minute
+
+        slots = []
+        per_day = {}
+        last_end = {}
+        # np.nonzero walks day by day, then by start time: chronological order
+        for row, col in zip(*np.nonzero(free)):
+            if len(slots) >= k:
+                break
+            if max_per_day and per_day.get(row, 0) >= max_per_day:
+                continue
+            minute = starts[col]
+            if minute < last_end.get(row, 0):
+                # Overlaps the previous pick of that day
+                continue
+            slots.append(self._at(self.days[row], minute))
+            per_day[row] = per_day.get(row, 0) + 1
+            last_end[row] = minute + duration_minutes
+
+        logging.info(f"Found {len(slots)} free slot(s) of {duration_minutes} min from {earliest}")
+        return slots
+
+    def free_calendars(self, start, end):
+        """Calendars of a from_calendars index that are free for all of [start, end)."""
+        return [calendar_id for calendar_id, index in self.calendars.items() if index.is_free(start, end)]
+
+    def first_free_slot(self, earliest, duration_minutes=30, granularity=SLOT_GRANULARITY_MINUTES, **kwargs):
+        slots = self.find_slots(earliest, duration_minutes, granularity, k=1, **kwargs)
+        return slots[0] if slots else None
@@ -0,0 +1,172 @@
+"""
+Local copies of Google Calendar events kept up to date with sync tokens.
+
+The first read of a calendar does a full events().list (from a short lookback
+to CALENDAR_SYNC_HORIZON_DAYS ahead, so recurring events expand to a bounded
+number of instances) and keeps the nextSyncToken; later reads only fetch what
+changed since, and reads within CALENDAR_SYNC_MAX_AGE_SECONDS are served
+without any API call. Windows outside the synced range aren't served from the
+store (callers list them directly). Stores are shared by every GoogleCalendarOAuthTool built with the
+same access token and calendar, so leads no longer re-download the calendar.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, date, time as dt_time
+
+import pytz
+from googleapiclient.errors import HttpError
+
+CALENDAR_SYNC_ENABLED = os.getenv("CALENDAR_SYNC_ENABLED", "true").lower() in ("1", "true", "yes")
+# Reads within this many seconds of the last sync don't touch the API at all
+CALENDAR_SYNC_MAX_AGE_SECONDS = float(os.getenv("CALENDAR_SYNC_MAX_AGE_SECONDS", "30"))
+# The initial full sync starts this many days in the past
+CALENDAR_SYNC_LOOKBACK_DAYS = int(os.getenv("CALENDAR_SYNC_LOOKBACK_DAYS", "1"))
+# ... and ends this many days ahead
+CALENDAR_SYNC_HORIZON_DAYS = int(os.getenv("CALENDAR_SYNC_HORIZON_DAYS", "90"))
+CALENDAR_SYNC_MAX_STORES = int(os.getenv("CALENDAR_SYNC_MAX_STORES", "32"))
+
+_TZ = pytz.timezone("Europe/Paris")
+
+
+def _event_bounds(event):
+    """(start, end) of an event resource as aware datetimes (all-day dates at Paris midnight), or None."""
+    try:
+        start, end = event.get("start", {}), event.get("end", {})
+        if "date" in start:
+            return (_TZ.localize(datetime.combine(date.fromisoformat(start["date"]), dt_time.min)),
+                    _TZ.localize(datetime.combine(date.fromisoformat(end["date"]), dt_time.min)))
+        return (datetime.fromisoformat(start["dateTime"].replace("Z", "+00:00")),
+                datetime.fromisoformat(end["dateTime"].replace("Z", "+00:00")))
+    except Exception as e:
+        logging.warning(f"Couldn't parse event {event.get('id')}: {e}")
+        return None
+
+
+class CalendarEventStore:
+    """Event copy of one calendar, refreshed incrementally with Google sync tokens."""
+
+    def __init__(self, calendar_id, max_age_seconds=CALENDAR_SYNC_MAX_AGE_SECONDS,
+                 lookback_days=CALENDAR_SYNC_LOOKBACK_DAYS, horizon_days=CALENDAR_SYNC_HORIZON_DAYS):
+        self.calendar_id = calendar_id
+        self.max_age_seconds = max_age_seconds
+        self.lookback_days = lookback_days
+        self.horizon_days = horizon_days
+        # id -> (event resource, (start, end) parsed once when the event is synced)
+        self._events = {}
+        # [time_min, time_max) of the last full sync
+        self._covered = None
+        self._sync_token = None
+        self._synced_at = 0.0
+        self._stale = True
+        # Held while syncing, so concurrent leads wait for one sync instead of each doing their own
+        self._lock = threading.Lock()
+        self.stats = {"full_syncs": 0, "incremental_syncs": 0, "served_from_cache": 0, "token_expired": 0}
+
+    def invalidate(self):
+        """Forces an incremental refresh on the next read (e.g. after we created an event)."""
+        with self._lock:
+            self._stale = True
+
+    def _window(self):
+        now = datetime.now(pytz.utc)
+        return now - timedelta(days=self.lookback_days), now + timedelta(days=self.horizon_days)
+
+    def covers(self, window_start, window_end):
+        """True if [window_start, window_end) lies in the range the store holds (or will after its first sync)."""
+        with self._lock:
+            time_min, time_max = self._covered or self._window()
+        return time_min <= window_start and window_end <= time_max
+
+    def get_events(self, service, window_start=None, window_end=None):
+        """
+        Returns the raw (non-cancelled) event resources overlapping [window_start,
+        window_end) (all of them without a window), syncing first if the copy is stale.
+        """
+        with self._lock:
+            if self._stale or time.monotonic() - self._synced_at > self.max_age_seconds:
+                self._sync(service)
+            else:
+                self.stats["served_from_cache"] += 1
+            return [event for event, bounds in self._events.values()
+                    if bounds is not None
+                    and (window_end is None or bounds[0] < window_end)
+                    and (window_start is None or window_start < bounds[1])]
+
+    def _sync(self, service):
+        # Caller holds the lock
+        if self._sync_token:
+            try:
+                self._fetch(service, syncToken=self._sync_token)
+                self.stats["incremental_syncs"] += 1
+                return
+            except HttpError as e:
+                if getattr(e.resp, "status", None) != 410:
+                    raise
+                # The sync token expired: start over with a full sync
+                logging.info(f"Sync token for calendar {self.calendar_id} expired, doing a full sync")
+                self.stats["token_expired"] += 1
+
+        self._events = {}
+        self._sync_token = None
+        self._covered = None
+        time_min, time_max = self._window()
+        self._fetch(service, timeMin=time_min.isoformat(), timeMax=time_max.isoformat())
+        self._covered = (time_min, time_max)
+        self.stats["full_syncs"] += 1
+
+    def _fetch(self, service, **params):
+        page_token = None
+        changed = 0
+        while True:
+            result = service.events().list(
+                calendarId=self.calendar_id,
+                singleEvents=True,
+                maxResults=2500,
+                pageToken=page_token,
+                **params
+            ).execute()
+            for event in result.get("items", []):
+                changed += 1
+                if event.get("status") == "cancelled":
+                    self._events.pop(event.get("id"), None)
+                else:
+                    self._events[event.get("id")] = (event, _event_bounds(event))
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                # The sync token only comes with the last page
+                self._sync_token = result.get("nextSyncToken", self._sync_token)
+                break
+        self._synced_at = time.monotonic()
+        self._stale = False
+        logging.info(f"Synced calendar {self.calendar_id}: {changed} changed events, {len(self._events)} in store")
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "events": len(self._events), "has_sync_token": self._sync_token is not None}
+
+
+_stores = OrderedDict()
+_stores_lock = threading.Lock()
+
+
+def get_event_store(access_token, calendar_id):
+    """Returns the shared store for this user's calendar (keyed by a hash of the token, never the token)."""
+    key = (hashlib.sha256(access_token.encode("utf-8")).hexdigest(), calendar_id)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = CalendarEventStore(calendar_id)
+        _stores.move_to_end(key)
+        while len(_stores) > CALENDAR_SYNC_MAX_STORES:
+            _stores.popitem(last=False)
+        return store
+
+
+def get_sync_stats():
+    with _stores_lock:
+        stores = list(_stores.values())
+    return [{"calendar_id": store.calendar_id, **store.get_stats()} for store in stores]
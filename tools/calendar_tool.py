@@ -1,12 +1,57 @@
-from utils.llm import llm_think
+from utils.llm import llm_think_json, llm_now, merge_usage, StructuredOutputError
 from datetime import datetime, timedelta
 import logging
+import os
+import time
 import pytz
-import json
 from utils.langfuse_logger import get_langfuse_handler
+from tools.date_parser import parse_meeting_request
 
-# Get Langfuse handler
-langfuse_handler = get_langfuse_handler()
+# Schemas of the JSON objects requested from the LLM (validated locally by llm_think_json)
+DATE_INTENT_SCHEMA = {
+    "type": "object",
+    "required": ["has_date_request", "date_intent_type"],
+    "properties": {
+        "has_date_request": {"type": "boolean"},
+        "date_intent_type": {"type": "string", "enum": ["specific_date", "relative_date", "next_week", "none"]},
+        "parsed_date": {"type": ["string", "null"]},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+    }
+}
+
+SCHEDULE_SCHEMA = {
+    "type": "object",
+    "required": ["datetime"],
+    "properties": {
+        "datetime": {"type": "string"},
+        "mode": {"type": ["string", "null"]},
+        "subject": {"type": ["string", "null"]},
+        "has_specific_date_request": {"type": "boolean"},
+        "date_intent_type": {"type": ["string", "null"]}
+    }
+}
+
+# Single-pass extraction: date intent and meeting suggestion in one structured response
+SINGLE_PASS_SCHEDULE_SCHEMA = {
+    "type": "object",
+    "required": ["datetime", "has_specific_date_request", "date_intent_type"],
+    "properties": {
+        "datetime": {"type": "string"},
+        "mode": {"type": ["string", "null"]},
+        "subject": {"type": ["string", "null"]},
+        "has_specific_date_request": {"type": "boolean"},
+        "date_intent_type": {"type": "string", "enum": ["specific_date", "relative_date", "next_week", "none"]},
+        "parsed_date": {"type": ["string", "null"]},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+    }
+}
+
+# Set CALENDAR_TWO_PASS=true to go back to the date-intent call followed by the scheduling call
+CALENDAR_TWO_PASS = os.getenv("CALENDAR_TWO_PASS", "false").lower() in ("1", "true", "yes")
+
+# Rule-based parsing of common phrasings ("tomorrow at 3pm", "demain à 10h") before any LLM call
+DATE_PARSER_ENABLED = os.getenv("DATE_PARSER_ENABLED", "true").lower() in ("1", "true", "yes")
+DATE_PARSER_MIN_CONFIDENCE = float(os.getenv("DATE_PARSER_MIN_CONFIDENCE", "0.75"))
 
 def add_observation_safely(span, name, value=None, metadata=None):
     """
@@ -45,10 +90,12 @@ class CalendarTool:
         """
         Use the LLM to extract date and time preferences from the message.
         This is more robust than regex patterns for handling natural language and multiple languages.
+        Returns (has_date_request, date_intent_type, usage).
         """
         # Create a Langfuse trace for date extraction
         extract_trace = None
         date_span = None
+        langfuse_handler = get_langfuse_handler()
         
         if langfuse_handler:
             try:
@@ -64,7 +111,7 @@ class CalendarTool:
             
         # Use CET timezone explicitly
         cet_timezone = pytz.timezone('Europe/Paris')
-        now = datetime.now(cet_timezone)
+        now = llm_now(cet_timezone)
         today = now.strftime("%A, %B %d, %Y")
         tomorrow = (now + timedelta(days=1)).strftime("%A, %B %d, %Y")
         
@@ -101,10 +148,12 @@ Only return the JSON object without any other text.
             except Exception as e:
                 logging.warning(f"Failed to create date analysis span: {str(e)}")
             
-        analysis_response, tokens = llm_think(date_analysis_prompt)
-            
+        # The answer depends on today's date, so never serve yesterday's cached analysis
         try:
-            analysis = json.loads(analysis_response)
+            analysis, usage = llm_think_json(
+                date_analysis_prompt, schema=DATE_INTENT_SCHEMA,
+                cache_salt=now.strftime("%Y-%m-%d"), route="calendar.date_intent"
+            )
             has_date_request = analysis.get("has_date_request", False)
             date_intent_type = analysis.get("date_intent_type", "none")
             confidence = analysis.get("confidence", 0)
@@ -117,39 +166,157 @@ Only return the JSON object without any other text.
                     metadata=analysis
                 )
                 
-            return has_date_request, date_intent_type
+            return has_date_request, date_intent_type, usage
             
-        except json.JSONDecodeError as e:
+        except StructuredOutputError as e:
             if date_span:
                 add_observation_safely(
                     date_span,
                     name="date_analysis_error",
                     value=0,
-                    metadata={"error": str(e), "raw_response": analysis_response}
+                    metadata={"error": str(e), "raw_response": e.raw_response}
                 )
             logging.error(f"Failed to parse date analysis response: {e}")
-            return False, "none"
+            return False, "none", e.usage
 
-    def schedule(self, lead_message: str):
-        # Create a Langfuse trace for scheduling
-        schedule_trace = None
+    def likely_window(self, now=None):
+        """
+        [today, end of next week) as dates in CET: where the scheduling prompts steer
+        the suggestion, so callers can fetch availability before it is known.
+        """
+        now = now or llm_now(pytz.timezone('Europe/Paris'))
+        days_until_next_monday = (7 - now.weekday()) % 7 or 7  # If today is Monday, go to next Monday
+        return now.date(), (now + timedelta(days=days_until_next_monday + 7)).date()
+
+    def schedule(self, lead_message: str, two_pass: bool = None, use_rules: bool = None):
+        """
+        Returns a meeting suggestion as (suggestion_dict, usage).
+        Unambiguous requests are resolved locally by tools.date_parser (use_rules,
+        default: DATE_PARSER_ENABLED) with zero tokens. Otherwise a single LLM call
+        extracts the date intent and suggests the meeting; two_pass (default:
+        CALENDAR_TWO_PASS) uses the older date-intent call followed by a scheduling
+        call, and usage then covers both.
+        Raises StructuredOutputError if no valid suggestion could be obtained.
+        """
+        if use_rules is None:
+            use_rules = DATE_PARSER_ENABLED
+        if use_rules:
+            started = time.perf_counter()
+            now = llm_now(pytz.timezone('Europe/Paris'))
+            schedule_data = parse_meeting_request(lead_message, now, min_confidence=DATE_PARSER_MIN_CONFIDENCE)
+            if schedule_data:
+                logging.info(f"Calendar request resolved without LLM: {schedule_data}")
+                usage = merge_usage()
+                usage.update(latency_ms=round((time.perf_counter() - started) * 1000, 1), source="rules")
+                return schedule_data, usage
+
+        if two_pass is None:
+            two_pass = CALENDAR_TWO_PASS
+        schedule_trace = self._start_schedule_trace(lead_message, two_pass)
+        if two_pass:
+            return self._schedule_two_pass(lead_message, schedule_trace)
+        return self._schedule_single_pass(lead_message, schedule_trace)
+
+    def _start_schedule_trace(self, lead_message, two_pass):
+        langfuse_handler = get_langfuse_handler()
+        if not langfuse_handler:
+            return None
+        try:
+            return langfuse_handler.trace(
+                name="schedule_meeting",
+                metadata={
+                    "message_length": len(lead_message),
+                    "timestamp": datetime.now().isoformat(),
+                    "extraction": "two_pass" if two_pass else "single_pass"
+                }
+            )
+        except Exception as e:
+            logging.warning(f"Failed to create schedule trace: {str(e)}")
+            return None
+
+    def _schedule_single_pass(self, lead_message, schedule_trace):
+        """Date intent and meeting suggestion in one LLM round trip."""
         schedule_span = None
-        
-        if langfuse_handler:
+
+        # Use CET timezone explicitly
+        cet_timezone = pytz.timezone('Europe/Paris')
+        now = llm_now(cet_timezone)
+        today = now.strftime("%A, %B %d, %Y")
+        tomorrow = (now + timedelta(days=1)).strftime("%A, %B %d, %Y")
+
+        # Calculate next Monday for "next week" scheduling
+        days_until_next_monday = (7 - now.weekday()) % 7
+        if days_until_next_monday == 0:
+            days_until_next_monday = 7  # If today is Monday, go to next Monday
+        next_week_start = (now + timedelta(days=days_until_next_monday)).strftime("%A, %B %d, %Y")
+
+        prompt = f"""
+Today is {today}.
+Tomorrow is {tomorrow}.
+Next week starts on {next_week_start}.
+
+A customer sent the following message:
+
+"{lead_message}"
+
+First decide whether the message contains a date/time preference, then suggest a meeting.
+If the customer expressed a date/time preference, schedule according to it.
+If not, the meeting should ideally be scheduled for next week starting from {next_week_start} or later.
+Consider normal business hours (9 AM - 5 PM CET) and avoid weekends unless specifically requested.
+
+Return a JSON object with:
+1. "has_specific_date_request": true/false - if the message contains a specific date/time request
+2. "date_intent_type": one of ["specific_date", "relative_date", "next_week", "none"]
+3. "parsed_date": the date mentioned (if any) in natural language, or null
+4. "confidence": 0-1 score of how confident you are in the date extraction
+5. "datetime": the suggested date and time in the format "Monday, April 28, 2025 at 10:00 AM" (without timezone indicator)
+6. "mode": the mode of the meeting (online or in-person)
+7. "subject": a relevant subject line for the meeting based on the message
+
+Only return the JSON object without any other text.
+"""
+        if schedule_trace:
             try:
-                schedule_trace = langfuse_handler.trace(
-                    name="schedule_meeting",
-                    metadata={
-                        "message_length": len(lead_message),
-                        "timestamp": datetime.now().isoformat()
-                    }
+                schedule_span = schedule_trace.span(
+                    name="schedule_generation",
+                    metadata={"prompt_length": len(prompt), "extraction": "single_pass"}
                 )
             except Exception as e:
-                logging.warning(f"Failed to create schedule trace: {str(e)}")
-            
+                logging.warning(f"Failed to create schedule generation span: {str(e)}")
+
+        logging.info(f"LLM Calendar Prompt: {prompt}")
+        try:
+            # The answer depends on today's date, so never serve yesterday's cached suggestion
+            schedule_data, usage = llm_think_json(
+                prompt, schema=SINGLE_PASS_SCHEDULE_SCHEMA,
+                cache_salt=now.strftime("%Y-%m-%d"), route="calendar.schedule_single_pass"
+            )
+        except StructuredOutputError as e:
+            add_observation_safely(
+                schedule_span,
+                name="schedule_error",
+                value=0,
+                metadata={"error": str(e), "raw_response": e.raw_response}
+            )
+            raise
+        logging.info(f"LLM Calendar Response: {schedule_data}")
+
+        add_observation_safely(
+            schedule_span,
+            name="schedule_result",
+            value=1 if schedule_data.get("datetime") else 0,
+            metadata=schedule_data
+        )
+
+        return schedule_data, usage
+
+    def _schedule_two_pass(self, lead_message, schedule_trace):
+        """Original path: a date-intent call, then a scheduling prompt built from its answer."""
+        schedule_span = None
+
         # Use CET timezone explicitly
         cet_timezone = pytz.timezone('Europe/Paris')
-        now = datetime.now(cet_timezone)
+        now = llm_now(cet_timezone)
         today = now.strftime("%A, %B %d, %Y")
         tomorrow = (now + timedelta(days=1)).strftime("%A, %B %d, %Y")
         
@@ -161,7 +328,7 @@ Only return the JSON object without any other text.
         next_week_start = next_monday.strftime("%A, %B %d, %Y")
         
         # Extract date intent first
-        has_date_request, date_intent_type = self.extract_date_intent(lead_message)
+        has_date_request, date_intent_type, intent_usage = self.extract_date_intent(lead_message)
         
         # Prepare scheduling prompt based on date intent
         if has_date_request:
@@ -199,24 +366,26 @@ Only return the JSON object without any other text.
                 logging.warning(f"Failed to create schedule generation span: {str(e)}")
             
         logging.info(f"LLM Calendar Prompt: {prompt}")
-        response, tokens = llm_think(prompt)
-        logging.info(f"LLM Calendar Response: {response}")
+        try:
+            schedule_data, schedule_usage = llm_think_json(
+                prompt, schema=SCHEDULE_SCHEMA, cache_salt=now.strftime("%Y-%m-%d"), route="calendar.schedule"
+            )
+        except StructuredOutputError as e:
+            add_observation_safely(
+                schedule_span,
+                name="schedule_error",
+                value=0,
+                metadata={"error": str(e), "raw_response": e.raw_response}
+            )
+            e.usage = merge_usage(intent_usage, e.usage)
+            raise
+        logging.info(f"LLM Calendar Response: {schedule_data}")
         
-        if schedule_span:
-            try:
-                schedule_data = json.loads(response)
-                add_observation_safely(
-                    schedule_span,
-                    name="schedule_result",
-                    value=1 if schedule_data.get("datetime") else 0,
-                    metadata=schedule_data
-                )
-            except json.JSONDecodeError as e:
-                add_observation_safely(
-                    schedule_span,
-                    name="schedule_error",
-                    value=0,
-                    metadata={"error": str(e), "raw_response": response}
-                )
+        add_observation_safely(
+            schedule_span,
+            name="schedule_result",
+            value=1 if schedule_data.get("datetime") else 0,
+            metadata=schedule_data
+        )
             
-        return response
+        return schedule_data, merge_usage(intent_usage, schedule_usage)
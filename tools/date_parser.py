@@ -0,0 +1,264 @@
+"""
+Rule-based EN/FR date and time extraction for meeting requests.
+
+Covers the phrasings most leads use ("tomorrow at 3pm", "next Tuesday",
+"demain à 10h", "le 28 avril à 15h30", "2025-04-28 14:00"), resolved against
+the Europe/Paris "now" that CalendarTool.schedule computes. Anything ambiguous
+(several different dates or times, negations, "I'm busy ...", a time given in
+another timezone, a bare "at 3", a time in the past) is left to the LLM:
+parse_meeting_request then returns None.
+"""
+import re
+import threading
+from datetime import datetime, timedelta
+
+WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "lundi": 0, "mardi": 1, "mercredi": 2, "jeudi": 3, "vendredi": 4, "samedi": 5, "dimanche": 6,
+}
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6, "july": 7,
+    "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "jun": 6, "jul": 7, "aug": 8, "sep": 9, "sept": 9,
+    "oct": 10, "nov": 11, "dec": 12,
+    "janvier": 1, "février": 2, "fevrier": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6,
+    "juillet": 7, "août": 8, "aout": 8, "septembre": 9, "octobre": 10, "novembre": 11,
+    "décembre": 12, "decembre": 12,
+}
+
+# Longest names first so "sept" wins over "sep" and "mars" over "mar"
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+_WEEKDAY = "|".join(WEEKDAYS)
+_NEXT_WEEK = r"(?:next week|de la semaine prochaine|la semaine prochaine|semaine prochaine)"
+
+# (pattern, kind) in priority order; a later match may not overlap an earlier one
+_DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})"), "iso"),
+    (re.compile(r"\b(\d{1,2})[/.](\d{1,2})[/.](\d{4})\b"), "numeric"),
+    (re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th|er)?\s+(?:of\s+)?({_MONTH})\.?(?:\s+(\d{{4}}))?(?![a-zà-ÿ])"), "day_month"),
+    (re.compile(rf"\b({_MONTH})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(\d{{4}}))?(?!\d)(?!:)"), "month_day"),
+    (re.compile(r"\b(?:the\s+)?day after tomorrow\b|\bapr[eè]s[- ]demain\b"), "plus_2"),
+    (re.compile(r"\btomorrow\b|\bdemain\b"), "plus_1"),
+    # "this afternoon" / "cet après-midi": only "this"/"cet" is the date, the rest is left for the time
+    (re.compile(r"\btoday\b|\baujourd'hui\b|\bthis(?= (?:morning|afternoon)\b)|\bcet(?= apr[eè]s[- ]midi\b)"), "plus_0"),
+    (re.compile(rf"\b(?:(next|this|coming|on|ce)\s+)?({_WEEKDAY})(?:\s+(prochain|suivant))?(?:\s+({_NEXT_WEEK}))?\b"), "weekday"),
+    (re.compile(rf"\b{_NEXT_WEEK}\b"), "next_week"),
+]
+
+_AMPM = r"(a\.?m\.?|p\.?m\.?)(?![a-z])"
+_TIME_PATTERNS = [
+    (re.compile(rf"(?<!\d)(\d{{1,2}})[:h](\d{{2}})\s*(?:{_AMPM})?"), "clock"),
+    (re.compile(rf"(?<!\d)(\d{{1,2}})\s*{_AMPM}"), "ampm"),
+    (re.compile(r"(?<!\d)(\d{1,2})\s*h(?![a-z])"), "hour_h"),
+    (re.compile(r"\bapr[eè]s[- ]midi\b|\bafternoon\b|\baprem\b"), "afternoon"),
+    (re.compile(r"\bmorning\b|\bmatin(?:ée|ee)?\b"), "morning"),
+    (re.compile(r"\bnoon\b|\bmidi\b|\blunch\s?time\b"), "noon"),
+]
+_APPROXIMATE_HOURS = {"morning": 10, "afternoon": 14}
+
+# Phrasings we deliberately don't resolve: negations/exclusions and bare hours ("at 3")
+_NEGATION = re.compile(r"\b(?:not|don't|can't|cannot|won't|except|unless|instead|pas|sauf|plutôt|plutot|impossible)\b|\bn'")
+# "I'm busy tomorrow at 3pm" names the time to avoid, not the one to book
+_UNAVAILABLE = re.compile(r"\b(?:busy|unavailable|occupied|indisponibles?|occupée?s?)\b")
+# Times in another timezone ("3pm EST", "2pm New York time"): abbreviations are matched
+# on the original case so the French "est" isn't one
+_TIMEZONE_ABBREVIATION = re.compile(r"\b(?:[ECMPA][SD]T|GMT|UTC|BST|IST|JST|AEST|AEDT)\b")
+_TIMEZONE_NAME = re.compile(
+    r"\b(?:eastern|central|mountain|pacific|atlantic|new york|london|east coast|west coast|"
+    r"california|chicago|toronto|los angeles|tokyo|singapore|sydney|dubai|india|uk|"
+    r"standard|daylight|local)\s+time\b|\bheure (?:de |d')(?:new york|londres|montr[ée]al|qu[ée]bec|l'est)\b"
+)
+_BARE_HOUR = re.compile(r"\b(?:at|à|vers|around|about)\s+\d{1,2}(?![\d:h]|\s*(?:a\.?m|p\.?m))")
+
+_IN_PERSON = re.compile(r"\bin[- ]person\b|\ben personne\b|\bpr[ée]sentiel\b|\bface[- ]to[- ]face\b|\boffice\b|\bbureaux?\b|\bon[- ]site\b|\bsur place\b")
+_ONLINE = re.compile(r"\bonline\b|\bvideo\b|\bvisio\w*|\bzoom\b|\bteams\b|\bgoogle meet\b|\ben ligne\b|\bremote\b|\bà distance\b|\bcall\b|\bappel\b|\bphone\b|\bt[ée]l[ée]phon\w*")
+
+DEFAULT_HOUR = 10
+EARLIEST_HOUR = 7
+
+_stats = {"parsed": 0, "deferred": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_parser_stats():
+    """How many requests were resolved locally vs. deferred to the LLM."""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["parsed"] + stats["deferred"]
+    stats["fast_path_rate"] = round(stats["parsed"] / total, 4) if total else 0.0
+    return stats
+
+
+def _overlaps(span, taken):
+    return any(span[0] < end and start < span[1] for start, end in taken)
+
+
+def _matches(patterns, text, taken):
+    """Yields (kind, match) for non-overlapping matches, earlier patterns taking precedence."""
+    for pattern, kind in patterns:
+        for match in pattern.finditer(text):
+            if _overlaps(match.span(), taken):
+                continue
+            taken.append(match.span())
+            yield kind, match
+
+
+def _next_monday(today):
+    return today + timedelta(days=(7 - today.weekday()) or 7)
+
+
+def _resolve_date(kind, match, today, in_next_week=False):
+    """
+    Returns (date, date_intent_type) for a date match. Raises ValueError for impossible dates.
+    in_next_week places a weekday in next week ("next week ... Tuesday afternoon").
+    """
+    if kind == "iso":
+        year, month, day = (int(g) for g in match.groups())
+        return today.replace(year=year, month=month, day=day), "specific_date"
+    if kind == "numeric":
+        # Day first, as written in France
+        day, month, year = (int(g) for g in match.groups())
+        return today.replace(year=year, month=month, day=day), "specific_date"
+    if kind in ("day_month", "month_day"):
+        if kind == "day_month":
+            day, month_name, year = match.groups()
+        else:
+            month_name, day, year = match.groups()
+        resolved = today.replace(year=int(year) if year else today.year, month=MONTHS[month_name], day=int(day))
+        if not year and resolved < today:
+            resolved = resolved.replace(year=today.year + 1)
+        return resolved, "specific_date"
+    if kind.startswith("plus_"):
+        return today + timedelta(days=int(kind[-1])), "relative_date"
+    if kind == "weekday":
+        qualifier, weekday_name, _suffix, next_week = match.groups()
+        weekday = WEEKDAYS[weekday_name]
+        if next_week or in_next_week:
+            return _next_monday(today) + timedelta(days=weekday), "next_week"
+        days_ahead = (weekday - today.weekday()) % 7
+        if days_ahead == 0 and qualifier not in ("this", "ce"):
+            days_ahead = 7
+        return today + timedelta(days=days_ahead), "relative_date"
+    if kind == "next_week":
+        return _next_monday(today), "next_week"
+    raise ValueError(f"unknown date pattern {kind}")
+
+
+def _resolve_time(kind, match):
+    """Returns (hour, minute, exact) for a time match, or None if it isn't a valid time of day."""
+    if kind in _APPROXIMATE_HOURS:
+        return _APPROXIMATE_HOURS[kind], 0, False
+    if kind == "noon":
+        return 12, 0, True
+    hour = int(match.group(1))
+    minute = int(match.group(2)) if kind == "clock" else 0
+    meridiem = match.group(3) if kind == "clock" else (match.group(2) if kind == "ampm" else None)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.startswith("p") else 0)
+    if hour < EARLIEST_HOUR or hour > 23 or minute > 59:
+        # Also rejects durations such as "a 1h call"
+        return None
+    return hour, minute, True
+
+
+def parse_meeting_request(message, now, min_confidence=0.75):
+    """
+    Extracts a meeting datetime from a lead message without calling the LLM.
+    `now` is the timezone-aware current time; the result is in the same timezone.
+    Returns a dict shaped like the LLM's scheduling suggestion (datetime string,
+    mode, subject, has_specific_date_request, date_intent_type, parsed_date,
+    confidence) when confident enough, otherwise None.
+    """
+    result = _parse(message, now)
+    if result is None or result["confidence"] < min_confidence:
+        _count("deferred")
+        return None
+    _count("parsed")
+    return result
+
+
+def _parse(message, now):
+    text = (message or "").lower().replace("’", "'")
+    if _NEGATION.search(text) or _UNAVAILABLE.search(text):
+        return None
+    if _TIMEZONE_ABBREVIATION.search(message or "") or _TIMEZONE_NAME.search(text):
+        # Resolving it as Paris time would be confidently wrong
+        return None
+
+    taken = []
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    date_matches = list(_matches(_DATE_PATTERNS, text, taken))
+    kinds = {kind for kind, _ in date_matches}
+    phrases = [(match.start(), match.group(0).strip()) for _, match in date_matches]
+    dates = {}
+    try:
+        for kind, match in date_matches:
+            if kind == "next_week" and "weekday" in kinds:
+                # Narrowed down by the weekday, resolved below
+                continue
+            resolved, intent = _resolve_date(kind, match, today, in_next_week="next_week" in kinds)
+            dates.setdefault(resolved.date(), (resolved, intent))
+    except ValueError:
+        return None
+    if len(dates) != 1:
+        # No date at all, or several different ones ("Monday or Wednesday")
+        return None
+    day, intent = next(iter(dates.values()))
+
+    times = set()
+    approximate = set()
+    for kind, match in _matches(_TIME_PATTERNS, text, taken):
+        resolved = _resolve_time(kind, match)
+        if resolved is None:
+            # "12am", "25h" or a duration like "1h": let the LLM read it in context
+            return None
+        hour, minute, exact = resolved
+        (times if exact else approximate).add((hour, minute))
+        phrases.append((match.start(), match.group(0).strip()))
+    if len(times) > 1 or (not times and len(approximate) > 1):
+        return None
+    if not times and _BARE_HOUR.search(text):
+        # "tomorrow at 3" - am or pm is a guess we leave to the LLM
+        return None
+
+    if times:
+        hour, minute = times.pop()
+        confidence = 0.95
+    elif approximate:
+        hour, minute = approximate.pop()
+        confidence = 0.85
+    else:
+        hour, minute = DEFAULT_HOUR, 0
+        confidence = 0.8
+    if kinds == {"next_week"}:
+        # A whole week is a much weaker preference than a given day
+        confidence = min(confidence, 0.6)
+
+    # Rebuild through the timezone so DST is right for the target day
+    start = now.tzinfo.localize(datetime(day.year, day.month, day.day, hour, minute)) \
+        if hasattr(now.tzinfo, "localize") else day.replace(hour=hour, minute=minute)
+    if start <= now:
+        return None
+
+    if _IN_PERSON.search(text) and not _ONLINE.search(text):
+        mode = "in-person"
+    else:
+        mode = "online"
+
+    return {
+        "datetime": start.strftime("%A, %B %d, %Y at %I:%M %p"),
+        "mode": mode,
+        "subject": None,
+        "has_specific_date_request": True,
+        "date_intent_type": intent,
+        "parsed_date": " ".join(phrase for _, phrase in sorted(phrases)),
+        "confidence": confidence,
+    }
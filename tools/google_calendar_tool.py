@@ -1,193 +1,285 @@
 import os
 import json
+import base64
+import hashlib
 from datetime import datetime, timedelta, date, time
 import pytz
 import logging
+import threading
+import time as time_module
 from dotenv import load_dotenv
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
+from tools.availability import AvailabilityIndex, SLOT_GRANULARITY_MINUTES
+from tools.calendar_sync import CALENDAR_SYNC_ENABLED, get_event_store
+from tools.google_services import get_calendar_service
 
 load_dotenv()
 
+# Days ahead searched by find_free_slots (fetched with a single ranged query)
+SLOT_SEARCH_DAYS = 7
+# Calendars per freebusy().query request (API limit)
+FREEBUSY_MAX_CALENDARS = 50
+# Inserts per batch request sent by flush_events (Google recommends at most 50)
+CALENDAR_BATCH_SIZE = int(os.getenv("CALENDAR_BATCH_SIZE", "50"))
+CALENDAR_BATCH_MAX_RETRIES = int(os.getenv("CALENDAR_BATCH_MAX_RETRIES", "3"))
+CALENDAR_BATCH_RETRY_BACKOFF = float(os.getenv("CALENDAR_BATCH_RETRY_BACKOFF", "1.0"))
+# Rate limiting and server errors; other failures (bad request, forbidden) are final
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
 class GoogleCalendarOAuthTool:
-    def __init__(self, access_token: str):
-        """Initializes the tool using a pre-obtained OAuth access token."""
+    def __init__(self, access_token: str, use_sync: bool = None, calendar_id: str = "primary"):
+        """
+        Initializes the tool using a pre-obtained OAuth access token.
+        calendar_id is the calendar events are read from and created in.
+        With use_sync (default: CALENDAR_SYNC_ENABLED) event reads are served from a
+        local copy kept current with sync tokens (see tools/calendar_sync.py).
+        """
         if not access_token:
             raise ValueError("Access token is required for GoogleCalendarOAuthTool")
 
-        # Create credentials directly from the access token
+        # Services are cached per token (see tools/google_services.py), so building
+        # a tool per lead no longer re-parses the discovery document
         # Note: This assumes the token is valid and has the correct scopes.
-        # For refresh tokens, a more complex credential handling would be needed.
         try:
-            credentials = Credentials(token=access_token)
-            # Check if token is valid/expired (optional but good practice)
-            # if credentials.expired and credentials.refresh_token:
-            #     credentials.refresh(Request())
-            # elif credentials.expired:
-            #     raise ValueError("Access token is expired and no refresh token available.")
-
-            self.service = build("calendar", "v3", credentials=credentials)
+            self.service = get_calendar_service(access_token)
         except Exception as e:
             # Catch potential issues with building the service or invalid token format
             logging.error(f"Failed to build Google Calendar service with token: {e}")
             raise ValueError(f"Failed to initialize Google Calendar service: {e}")
 
-        self.calendar_id = "primary"
+        self.calendar_id = calendar_id
+        if use_sync is None:
+            use_sync = CALENDAR_SYNC_ENABLED
+        self.event_store = get_event_store(access_token, self.calendar_id) if use_sync else None
+        # Inserts waiting for flush_events
+        self._pending_events = []
+        self._pending_lock = threading.Lock()
 
-    def get_events(self, date: date):
-        """Get detailed event information for a specific date including titles and full-day events."""
-        # Use CET timezone for consistency
+    def _day_bounds(self, day: date):
+        """[start, end) of a calendar day in CET."""
         cet_tz = pytz.timezone('Europe/Paris')
-        start_time = datetime.combine(date, time.min)
-        start_time = cet_tz.localize(start_time)
-        end_time = datetime.combine(date, time.max)
-        end_time = cet_tz.localize(end_time)
-        
-        try:
+        start = cet_tz.localize(datetime.combine(day, time.min))
+        end = cet_tz.localize(datetime.combine(day + timedelta(days=1), time.min))
+        return start, end
+
+    def _parse_event(self, event):
+        start = event.get('start', {})
+        end = event.get('end', {})
+
+        # Handle full-day events (they have 'date' instead of 'dateTime'; the end date is exclusive)
+        is_full_day = 'date' in start
+
+        if is_full_day:
+            start_dt = self._day_bounds(date.fromisoformat(start.get('date')))[0]
+            end_dt = self._day_bounds(date.fromisoformat(end.get('date')))[0]
+        else:
+            # Regular event with specific times
+            start_dt = datetime.fromisoformat(start.get('dateTime').replace('Z', '+00:00'))
+            end_dt = datetime.fromisoformat(end.get('dateTime').replace('Z', '+00:00'))
+
+        return {
+            "title": event.get('summary', 'Untitled Event'),
+            "start": start_dt,
+            "end": end_dt,
+            "is_full_day": is_full_day,
+            "link": event.get('htmlLink', '')
+        }
+
+    def _days(self, start_date: date, end_date: date):
+        return [start_date + timedelta(days=i) for i in range((end_date - start_date).days)]
+
+    def get_events_range(self, start_date: date, end_date: date):
+        """
+        Get detailed event information for every day in [start_date, end_date) with a
+        single (paginated) events().list call. Returns {date: [events]}; an event
+        spanning several days is listed under each of them. Raises if the events
+        can't be read: an empty day must mean a free day.
+        """
+        return self._events_by_day(start_date, end_date)[0]
+
+    def _events_by_day(self, start_date: date, end_date: date):
+        """get_events_range plus whether the events came from the synced store."""
+        cet_tz = pytz.timezone('Europe/Paris')
+        window_start = self._day_bounds(start_date)[0]
+        window_end = self._day_bounds(end_date)[0]
+        events_by_day = {day: [] for day in self._days(start_date, end_date)}
+
+        events, from_store = self._list_events(window_start, window_end)
+        for event in events:
+            try:
+                parsed = self._parse_event(event)
+            except Exception as e:
+                logging.warning(f"Couldn't parse event: {e}")
+                continue
+            if not (parsed["start"] < window_end and window_start < parsed["end"]):
+                continue
+            # Only the days the event touches (its end is exclusive)
+            day = max(parsed["start"].astimezone(cet_tz).date(), start_date)
+            last_day = min((parsed["end"].astimezone(cet_tz) - timedelta(microseconds=1)).date(),
+                           end_date - timedelta(days=1))
+            while day <= last_day:
+                events_by_day[day].append(parsed)
+                day += timedelta(days=1)
+
+        return events_by_day, from_store
+
+    def _list_events(self, window_start: datetime, window_end: datetime):
+        """
+        Raw event resources overlapping the window, and whether they came from the
+        synced store. A failed store read falls back to one paginated listing;
+        a failed listing raises.
+        """
+        if self.event_store is not None and self.event_store.covers(window_start, window_end):
+            try:
+                return self.event_store.get_events(self.service, window_start, window_end), True
+            except Exception as e:
+                logging.error(f"Synced event store unavailable, listing events instead: {e}")
+
+        events = []
+        page_token = None
+        while True:
             events_result = self.service.events().list(
                 calendarId=self.calendar_id,
-                timeMin=start_time.isoformat(),
-                timeMax=end_time.isoformat(),
+                timeMin=window_start.isoformat(),
+                timeMax=window_end.isoformat(),
                 singleEvents=True,
                 orderBy='startTime',
-                timeZone='Europe/Paris'  # Explicitly request CET/CEST
+                timeZone='Europe/Paris',  # Explicitly request CET/CEST
+                maxResults=2500,
+                pageToken=page_token
             ).execute()
-            
-            events = events_result.get('items', [])
-            parsed_events = []
-            
-            # Debug output
-            logging.info(f"RAW events data for {date}: {events}")
-            
-            for event in events:
-                try:
-                    start = event.get('start', {})
-                    end = event.get('end', {})
-                    
-                    # Handle full-day events (they have 'date' instead of 'dateTime')
-                    is_full_day = 'date' in start
-                    
-                    if is_full_day:
-                        # Full-day event spans the entire day
-                        start_dt = datetime.fromisoformat(start.get('date')).replace(
-                            hour=0, minute=0, second=0).replace(tzinfo=pytz.utc)
-                        end_dt = datetime.fromisoformat(end.get('date')).replace(
-                            hour=23, minute=59, second=59).replace(tzinfo=pytz.utc)
-                    else:
-                        # Regular event with specific times
-                        start_dt = datetime.fromisoformat(start.get('dateTime').replace('Z', '+00:00'))
-                        end_dt = datetime.fromisoformat(end.get('dateTime').replace('Z', '+00:00'))
-                    
-                    # Log each event we're processing
-                    logging.info(f"Processing event: '{event.get('summary')}', full day: {is_full_day}, start: {start_dt}, end: {end_dt}")
-                    
-                    parsed_events.append({
-                        "title": event.get('summary', 'Untitled Event'),
-                        "start": start_dt,
-                        "end": end_dt,
-                        "is_full_day": is_full_day,
-                        "link": event.get('htmlLink', '')
-                    })
-                except Exception as e:
-                    logging.warning(f"Couldn't parse event: {e}")
-            
-            return parsed_events
-        except Exception as e:
-            logging.error(f"Error fetching events: {e}")
+            events.extend(events_result.get('items', []))
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
+
+        logging.info(f"Fetched {len(events)} events for {window_start.date()} to {window_end.date()}")
+        return events, False
+
+    def get_events(self, date: date):
+        """Get detailed event information for a specific date including titles and full-day events."""
+        return self.get_events_range(date, date + timedelta(days=1)).get(date, [])
+
+    def _query_free_busy(self, window_start: datetime, window_end: datetime):
+        """One freebusy().query call for the whole window. Returns a list of busy slots."""
+        return self._query_free_busy_many([self.calendar_id], window_start, window_end)[self.calendar_id]
+
+    def _query_free_busy_many(self, calendar_ids, window_start: datetime, window_end: datetime):
+        """
+        Busy slots of several calendars over the window, FREEBUSY_MAX_CALENDARS per
+        freebusy().query call. Returns {calendar_id: [busy slots]}; a calendar the
+        API reports an error for (not shared with us, unknown) maps to None.
+        """
+        slots_by_calendar = {}
+        for offset in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+            chunk = calendar_ids[offset:offset + FREEBUSY_MAX_CALENDARS]
+            body = {
+                "timeMin": window_start.isoformat(),
+                "timeMax": window_end.isoformat(),
+                "items": [{"id": calendar_id} for calendar_id in chunk],
+                "timeZone": "Europe/Paris"
+            }
+            response = self.service.freebusy().query(body=body).execute()
+            calendars = response.get("calendars", {})
+            logging.info(f"FreeBusy API response for {len(chunk)} calendar(s), {window_start.date()} to {window_end.date()}")
+
+            for calendar_id in chunk:
+                calendar = calendars.get(calendar_id, {})
+                if calendar.get("errors"):
+                    logging.warning(f"FreeBusy unavailable for {calendar_id}: {calendar['errors']}")
+                    slots_by_calendar[calendar_id] = None
+                    continue
+                api_slots = []
+                for slot in calendar.get("busy", []):
+                    try:
+                        api_slots.append({
+                            "start": datetime.fromisoformat(slot["start"].replace("Z", "+00:00")),
+                            "end": datetime.fromisoformat(slot["end"].replace("Z", "+00:00")),
+                        })
+                    except Exception as e:
+                        logging.warning(f"Couldn't parse busy slot: {e}")
+                slots_by_calendar[calendar_id] = api_slots
+        return slots_by_calendar
+
+    def _clip_to_day(self, slots, day: date):
+        """Merged slots clipped to the day, so slots spanning midnight count for both days."""
+        day_start, day_end = self._day_bounds(day)
+        return self._merge_slots([
+            {"start": max(slot["start"], day_start), "end": min(slot["end"], day_end)}
+            for slot in slots if slot["start"] < day_end and day_start < slot["end"]
+        ])
+
+    def _merge_slots(self, slots):
+        """Sorts slots and merges overlapping ones."""
+        if not slots:
             return []
-            
-    def get_busy_slots(self, date: date):
-        """Get busy time slots for a specific date using the freebusy query."""
-        # Use CET timezone for consistency
-        cet_tz = pytz.timezone('Europe/Paris')
-        start_time = datetime.combine(date, time.min)
-        start_time = cet_tz.localize(start_time)
-        end_time = datetime.combine(date, time.max)
-        end_time = cet_tz.localize(end_time)
+        slots = sorted((dict(slot) for slot in slots), key=lambda x: x["start"])
+        merged_slots = [slots[0]]
+        for current in slots[1:]:
+            previous = merged_slots[-1]
+            # If current slot overlaps with previous slot, merge them
+            if current["start"] <= previous["end"]:
+                previous["end"] = max(previous["end"], current["end"])
+            else:
+                merged_slots.append(current)
+        return merged_slots
 
-        # First get all events to handle full-day events properly
-        events = self.get_events(date)
-        
-        # Create busy slots from all events
-        manual_busy_slots = []
-        has_full_day_events = False
-        
-        for event in events:
-            # If there's a full-day event, mark the entire day as busy
-            if event["is_full_day"]:
-                has_full_day_events = True
-                logging.info(f"Full day event detected on {date}: {event['title']}")
-                # For full day events, create a slot for the entire day
-                manual_busy_slots.append({
-                    "start": start_time,
-                    "end": end_time
-                })
-                break  # One full-day event makes the entire day busy
+    def get_busy_slots_range(self, start_date: date, end_date: date):
+        """
+        Get busy time slots for every day in [start_date, end_date) from one events
+        listing and at most one freebusy query (none when reading from the synced
+        event store), bucketed per day locally.
+        Returns {date: [merged busy slots clipped to that day]}; raises if the
+        calendar can't be read.
+        """
+        events_by_day, from_store = self._events_by_day(start_date, end_date)
+        day_bounds = {day: self._day_bounds(day) for day in events_by_day}
+
+        manual_by_day = {}
+        open_days = []
+        for day, events in events_by_day.items():
+            day_start, day_end = day_bounds[day]
+            full_day = next((event for event in events if event["is_full_day"]), None)
+            if full_day:
+                # One full-day event makes the entire day busy
+                logging.info(f"Full day event detected on {day}: {full_day['title']}")
+                manual_by_day[day] = [{"start": day_start, "end": day_end}]
             else:
-                manual_busy_slots.append({
-                    "start": event["start"],
-                    "end": event["end"]
-                })
-        
-        # If we already detected full-day events, no need for the API call
-        if has_full_day_events:
-            logging.info(f"Day {date} is fully booked with full-day events")
-            return manual_busy_slots
-            
-        # Otherwise, also use the freebusy API as a backup
-        body = {
-            "timeMin": start_time.isoformat(),
-            "timeMax": end_time.isoformat(),
-            "items": [{"id": self.calendar_id}],
-            "timeZone": "Europe/Paris"
-        }
+                manual_by_day[day] = [{"start": event["start"], "end": event["end"]} for event in events]
+                open_days.append(day)
 
-        try:
-            response = self.service.freebusy().query(body=body).execute()
-            busy = response.get("calendars", {}).get(self.calendar_id, {}).get("busy", [])
-            
-            # Log the raw API response
-            logging.info(f"FreeBusy API response for {date}: {busy}")
-            
-            api_slots = []
-            for slot in busy:
-                try:
-                    api_slots.append({
-                        "start": datetime.fromisoformat(slot["start"].replace("Z", "+00:00")),
-                        "end": datetime.fromisoformat(slot["end"].replace("Z", "+00:00")),
-                    })
-                except Exception as e:
-                    logging.warning(f"Couldn't parse busy slot: {e}")
-            
-            # Combine manually extracted events with the API response
-            combined_slots = manual_busy_slots + api_slots
-            
-            # Deduplicate and merge overlapping slots
-            if combined_slots:
-                combined_slots.sort(key=lambda x: x["start"])
-                merged_slots = [combined_slots[0]]
-                
-                for current in combined_slots[1:]:
-                    previous = merged_slots[-1]
-                    # If current slot overlaps with previous slot, merge them
-                    if current["start"] <= previous["end"]:
-                        previous["end"] = max(previous["end"], current["end"])
-                    else:
-                        merged_slots.append(current)
-                        
-                return merged_slots
-            
-            return combined_slots
-            
-        except Exception as e:
-            logging.error(f"Error fetching busy slots: {e}")
-            # Fall back to the manually created list
-            return manual_busy_slots
+        # Days blocked by full-day events need no freebusy data, and neither does a
+        # synced store: it already holds every event of the calendar
+        api_slots = []
+        if open_days and not from_store:
+            try:
+                api_slots = self._query_free_busy(day_bounds[min(open_days)][0], day_bounds[max(open_days)][1])
+            except Exception as e:
+                # Fall back to the events listing alone
+                logging.error(f"Error fetching busy slots: {e}")
+
+        busy_by_day = {}
+        for day, manual_slots in manual_by_day.items():
+            if day not in open_days:
+                busy_by_day[day] = manual_slots
+            else:
+                busy_by_day[day] = self._clip_to_day(manual_slots + api_slots, day)
+        return busy_by_day
+
+    def get_busy_slots(self, date: date):
+        """Get busy time slots for a specific date using the events listing and the freebusy query."""
+        return self.get_busy_slots_range(date, date + timedelta(days=1)).get(date, [])
 
     def is_slot_free(self, start: datetime, end: datetime, busy_slots):
-        """Check if a time slot is free (not overlapping with any busy slots)."""
+        """
+        Check if a time slot is free (not overlapping with any busy slots).
+        busy_slots is a list of slots or an AvailabilityIndex (constant-time lookup).
+        """
+        if isinstance(busy_slots, AvailabilityIndex):
+            is_free = busy_slots.is_free(start, end)
+            logging.info(f"Slot is {'free' if is_free else 'busy'}: {start} to {end}")
+            return is_free
+
         for slot in busy_slots:
             # If there's any overlap between the proposed slot and a busy slot
             if slot["start"] < end and start < slot["end"]:
@@ -196,62 +288,101 @@ class GoogleCalendarOAuthTool:
         logging.info(f"Slot is free: {start} to {end}")
         return True
 
-    def find_next_free_slot(self, preferred_start: datetime, duration_minutes=30, busy_slots=[]):
-        """Find the next available time slot starting from a preferred time."""
-        logging.info(f"🔎 Searching for free slot starting from: {preferred_start}")
+    def find_free_slots(self, preferred_start: datetime, duration_minutes=30, k=3, granularity=SLOT_GRANULARITY_MINUTES,
+                        max_per_day=None, busy_slots=None, busy_by_day=None, days=SLOT_SEARCH_DAYS):
+        """
+        Find up to k free slots of duration_minutes from a preferred time, aligned to
+        `granularity` minutes within business hours (see tools/availability.py).
+        busy_by_day (as returned by get_busy_slots_range) saves the fetch; busy_slots,
+        if given, replaces the busy slots of the preferred day.
+        """
+        logging.info(f"🔎 Searching for free slots starting from: {preferred_start}")
 
-        # Make sure preferred_start is in CET for consistency 
+        # Make sure preferred_start is in CET for consistency
+        cet_tz = pytz.timezone('Europe/Paris')
         if preferred_start.tzinfo is None or preferred_start.tzinfo.utcoffset(preferred_start) is None:
-            cet_tz = pytz.timezone('Europe/Paris')
             preferred_start = cet_tz.localize(preferred_start)
-        elif preferred_start.tzinfo != pytz.timezone('Europe/Paris'):
+        else:
             # Convert to CET if in a different timezone
-            preferred_start = preferred_start.astimezone(pytz.timezone('Europe/Paris'))
-        
-        # First check if there are any full-day events that block the entire day
-        for slot in busy_slots:
-            # If a slot spans the entire day or most of it (>12 hours), consider the day fully booked
-            slot_duration = (slot["end"] - slot["start"]).total_seconds() / 3600
-            if slot_duration > 12:
-                logging.info(f"Day appears to be fully booked with a long event ({slot_duration} hours)")
-                return None
-
-        for offset_days in range(0, 7):  # Look ahead 1 week from preferred
-            current_day = preferred_start + timedelta(days=offset_days)
-            current_date = current_day.date()
-            
-            # Skip to the next day if we're not on the first iteration
-            if offset_days > 0:
-                current_day = current_day.replace(hour=9, minute=0, second=0, microsecond=0)
-            
-            # Get fresh busy slots for this specific day to ensure we have the most accurate data
-            if offset_days > 0:  # Only if we're looking at a different day
-                day_busy_slots = self.get_busy_slots(current_date)
-                # If we detect a full-day event, skip this day entirely
-                if any((slot["end"] - slot["start"]).total_seconds() / 3600 > 12 for slot in day_busy_slots):
-                    logging.info(f"Skipping {current_date} due to full-day events")
-                    continue
-            else:
-                day_busy_slots = busy_slots
-            
-            # Check each hour from 9 AM to 5 PM
-            for hour in range(9, 17):  # Working hours
-                # Skip hours earlier than our current time if we're checking today
-                if current_date == preferred_start.date() and hour < preferred_start.hour:
-                    continue
-                    
-                # Try each hour
-                start = current_day.replace(hour=hour, minute=0, second=0, microsecond=0)
-                end = start + timedelta(minutes=duration_minutes)
+            preferred_start = preferred_start.astimezone(cet_tz)
+
+        first_day = preferred_start.date()
+        last_day = first_day + timedelta(days=days)
+        if busy_by_day is None or any(day not in busy_by_day for day in self._days(first_day, last_day)):
+            busy_by_day = self.get_busy_slots_range(first_day, last_day)
+        if busy_slots is not None:
+            busy_by_day = {**busy_by_day, first_day: busy_slots}
+        # Only the search window, even if the caller fetched more
+        busy_by_day = {day: busy_by_day.get(day, []) for day in self._days(first_day, last_day)}
 
-                if self.is_slot_free(start, end, day_busy_slots):
-                    logging.info(f"✅ Found available slot: {start}")
-                    return start
+        slots = AvailabilityIndex(busy_by_day, tz=cet_tz).find_slots(
+            preferred_start, duration_minutes, granularity, k=k, max_per_day=max_per_day
+        )
+        if not slots:
+            logging.warning("❌ No available slot found")
+        return slots
 
-        logging.warning("❌ No available slot found")
+    def find_next_free_slot(self, preferred_start: datetime, duration_minutes=30, busy_slots=None,
+                            busy_by_day=None, days=SLOT_SEARCH_DAYS, granularity=SLOT_GRANULARITY_MINUTES):
+        """Find the next available slot from a preferred time (see find_free_slots). Returns None if there is none."""
+        slots = self.find_free_slots(preferred_start, duration_minutes, k=1, granularity=granularity,
+                                     busy_slots=busy_slots, busy_by_day=busy_by_day, days=days)
+        if slots:
+            logging.info(f"✅ Found available slot: {slots[0]}")
+            return slots[0]
         return None
 
-    def create_event(self, summary: str, description: str, start_time: datetime, duration_minutes=30, location=""):
+    def get_busy_slots_by_calendar(self, calendar_ids, start_date: date, end_date: date):
+        """
+        Busy slots of several calendars for every day in [start_date, end_date).
+        Our own calendar goes through get_busy_slots_range (events + freebusy); the
+        others are read with batched freebusy queries only.
+        Returns {calendar_id: {date: [merged busy slots]}}; calendars we can't read are
+        left out, so callers must not treat them as checked (e.g. invite them).
+        """
+        days = self._days(start_date, end_date)
+        others = [calendar_id for calendar_id in dict.fromkeys(calendar_ids) if calendar_id != self.calendar_id]
+        busy_by_calendar = {}
+        if self.calendar_id in calendar_ids:
+            busy_by_calendar[self.calendar_id] = self.get_busy_slots_range(start_date, end_date)
+        if others:
+            slots_by_calendar = self._query_free_busy_many(
+                others, self._day_bounds(start_date)[0], self._day_bounds(end_date)[0]
+            )
+            for calendar_id, slots in slots_by_calendar.items():
+                if slots is None:
+                    continue
+                busy_by_calendar[calendar_id] = {day: self._clip_to_day(slots, day) for day in days}
+        return busy_by_calendar
+
+    def find_common_slots(self, calendar_ids, preferred_start: datetime, duration_minutes=30, mode="all", k=3,
+                          granularity=SLOT_GRANULARITY_MINUTES, max_per_day=None, days=SLOT_SEARCH_DAYS):
+        """
+        Earliest slots that fit several calendars: every one of them (mode "all",
+        several attendees) or at least one (mode "any", a round-robin pool).
+        Returns up to k dicts {"start": datetime, "calendar_ids": [calendars free then]}.
+        """
+        cet_tz = pytz.timezone('Europe/Paris')
+        if preferred_start.tzinfo is None or preferred_start.tzinfo.utcoffset(preferred_start) is None:
+            preferred_start = cet_tz.localize(preferred_start)
+        else:
+            preferred_start = preferred_start.astimezone(cet_tz)
+
+        first_day = preferred_start.date()
+        busy_by_calendar = self.get_busy_slots_by_calendar(calendar_ids, first_day, first_day + timedelta(days=days))
+        missing = [calendar_id for calendar_id in calendar_ids if calendar_id not in busy_by_calendar]
+        if missing:
+            logging.warning(f"No free/busy data for {missing}; they are left out of the search")
+        availability = AvailabilityIndex.from_calendars(busy_by_calendar, mode=mode, tz=cet_tz)
+
+        slots = availability.find_slots(preferred_start, duration_minutes, granularity, k=k, max_per_day=max_per_day)
+        return [
+            {"start": start, "calendar_ids": availability.free_calendars(start, start + timedelta(minutes=duration_minutes))}
+            for start in slots
+        ]
+
+    def _event_body(self, summary: str, description: str, start_time: datetime, duration_minutes=30, location="",
+                    attendees=None):
         end_time = start_time + timedelta(minutes=duration_minutes)
 
         # Make sure times are in CET
@@ -274,7 +405,148 @@ class GoogleCalendarOAuthTool:
             },
             "location": location,
         }
+        if attendees:
+            # Calendar IDs of people are their email addresses
+            event["attendees"] = [{"email": attendee} for attendee in attendees]
+        # Client-generated ID derived from the event itself: an insert replayed after
+        # a lost response gets 409 instead of creating a duplicate. Event IDs use the
+        # base32hex alphabet (0-9, a-v).
+        digest = hashlib.sha256(f"{self.calendar_id}\x00{json.dumps(event, sort_keys=True)}".encode("utf-8")).digest()
+        event["id"] = base64.b32hexencode(digest).decode("ascii").lower().rstrip("=")
+        return event
+
+    def _is_duplicate(self, exception):
+        """409: an event with this ID exists, i.e. an earlier attempt of the same insert went through."""
+        return getattr(getattr(exception, "resp", None), "status", None) == 409
 
-        created = self.service.events().insert(calendarId=self.calendar_id, body=event).execute()
+    def _existing_link(self, event):
+        """
+        htmlLink of the event a 409 says we already created. If it has been deleted
+        since (Google keeps it with status "cancelled"), it is restored first.
+        Raises if it can't be read or restored: the meeting may not be booked.
+        """
+        existing = self.service.events().get(calendarId=self.calendar_id, eventId=event["id"]).execute()
+        if existing.get("status") == "cancelled":
+            logging.info(f"Event {event['id']} was deleted, restoring it")
+            existing = self.service.events().update(
+                calendarId=self.calendar_id, eventId=event["id"], body={**event, "status": "confirmed"}
+            ).execute()
+        return existing.get("htmlLink")
+
+    def create_event(self, summary: str, description: str, start_time: datetime, duration_minutes=30, location="",
+                     attendees=None):
+        event = self._event_body(summary, description, start_time, duration_minutes, location, attendees)
+        try:
+            created = self.service.events().insert(calendarId=self.calendar_id, body=event).execute()
+        except Exception as e:
+            if not self._is_duplicate(e):
+                raise
+            logging.info(f"Event {event['id']} already exists, not creating it again")
+            created = {"id": event["id"], "htmlLink": self._existing_link(event)}
+        if self.event_store is not None:
+            # Pick the new event up with the next incremental sync
+            self.event_store.invalidate()
         logging.info(f"📅 Created event: {created.get('htmlLink')}")
-        return created.get("htmlLink")
\ No newline at end of file
+        return created.get("htmlLink")
+
+    def queue_event(self, summary: str, description: str, start_time: datetime, duration_minutes=30, location="",
+                    attendees=None):
+        """Queues an insert for flush_events (same arguments as create_event). Returns its index in the queue."""
+        event = self._event_body(summary, description, start_time, duration_minutes, location, attendees)
+        with self._pending_lock:
+            self._pending_events.append(event)
+            return len(self._pending_events) - 1
+
+    def flush_events(self, max_retries=CALENDAR_BATCH_MAX_RETRIES):
+        """
+        Inserts every queued event with the Calendar batch endpoint, CALENDAR_BATCH_SIZE
+        inserts per HTTP request. Items failing with a rate-limit or server error, or
+        left unanswered by a failed batch request, are retried (up to max_retries times,
+        with exponential backoff); other errors are final. Events carry deterministic
+        IDs, so a retried insert that had already gone through answers 409 and counts
+        as created.
+        Returns one result per queued event, in queue order:
+        {"index", "ok", "id", "link", "error", "attempts"}.
+        """
+        with self._pending_lock:
+            events, self._pending_events = self._pending_events, []
+        if not events:
+            return []
+
+        results = [{"index": index, "ok": False, "id": None, "link": None, "error": None, "attempts": 0}
+                   for index in range(len(events))]
+        todo = list(range(len(events)))
+        requests_sent = 0
+        for attempt in range(max_retries + 1):
+            if attempt:
+                delay = CALENDAR_BATCH_RETRY_BACKOFF * 2 ** (attempt - 1)
+                logging.info(f"Retrying {len(todo)} event insert(s) in {delay:.1f}s")
+                time_module.sleep(delay)
+            retry = []
+            for offset in range(0, len(todo), CALENDAR_BATCH_SIZE):
+                chunk = todo[offset:offset + CALENDAR_BATCH_SIZE]
+                retry.extend(self._insert_batch(events, chunk, results))
+                requests_sent += 1
+            todo = retry
+            if not todo:
+                break
+
+        if self.event_store is not None and any(result["ok"] for result in results):
+            self.event_store.invalidate()
+        created = sum(1 for result in results if result["ok"])
+        logging.info(f"📅 Created {created}/{len(events)} events in {requests_sent} batch request(s)")
+        return results
+
+    def _is_retryable(self, exception):
+        status = getattr(getattr(exception, "resp", None), "status", None)
+        if status in RETRYABLE_STATUSES:
+            return True
+        # Quota errors come back as 403 rateLimitExceeded / userRateLimitExceeded
+        details = f"{getattr(exception, 'error_details', '')} {exception}".lower()
+        return status == 403 and ("ratelimitexceeded" in details or "rate limit exceeded" in details)
+
+    def _insert_batch(self, events, indexes, results):
+        """One batch request for events[indexes]; fills results and returns the indexes worth retrying."""
+        retry = []
+
+        answered = set()
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            answered.add(index)
+            result = results[index]
+            result["attempts"] += 1
+            if exception is None:
+                result.update(ok=True, id=response.get("id"), link=response.get("htmlLink"), error=None)
+                return
+            if self._is_duplicate(exception):
+                # Created by an earlier attempt whose response was lost
+                try:
+                    link = self._existing_link(events[index])
+                except Exception as e:
+                    result["error"] = f"Event {events[index]['id']} exists but couldn't be confirmed: {e}"
+                    if self._is_retryable(e):
+                        retry.append(index)
+                    return
+                result.update(ok=True, id=events[index]["id"], link=link, error=None)
+                return
+            result["error"] = str(exception)
+            if self._is_retryable(exception):
+                retry.append(index)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for index in indexes:
+            batch.add(self.service.events().insert(calendarId=self.calendar_id, body=events[index]),
+                      request_id=str(index))
+        try:
+            batch.execute()
+        except Exception as e:
+            # The whole request failed (network, auth): only items with no answer yet are
+            # retried; those Google may have applied come back as 409 on the retry
+            logging.error(f"Batch insert failed: {e}")
+            for index in indexes:
+                if index not in answered:
+                    results[index]["attempts"] += 1
+                    results[index]["error"] = str(e)
+                    retry.append(index)
+        return retry
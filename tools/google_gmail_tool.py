@@ -2,14 +2,12 @@ import os
 import logging
 import base64
 from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow # Might need this for initial auth helper later
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from tools.google_services import GMAIL_SCOPES, get_gmail_service
 
 # TODO: Define precise scopes needed
-SCOPES = ['https://www.googleapis.com/auth/gmail.compose', 'https://www.googleapis.com/auth/gmail.readonly']
+SCOPES = GMAIL_SCOPES
 
 class GoogleGmailTool:
     """Tool for interacting with the Gmail API, focusing on creating drafts."""
@@ -23,45 +21,10 @@ class GoogleGmailTool:
         self.service = self._get_service()
 
     def _get_service(self):
-        """Authenticates and returns the Gmail API service client."""
-        creds = None
-        # TODO: Implement robust credential loading/refreshing
-        # This initial version expects refresh token and client secrets in env vars
-        
-        client_id = os.getenv('GOOGLE_CLIENT_ID')
-        client_secret = os.getenv('GOOGLE_CLIENT_SECRET')
-        refresh_token = os.getenv('GOOGLE_REFRESH_TOKEN')
-
-        if not all([client_id, client_secret, refresh_token]):
-            logging.error("Missing Google OAuth environment variables (CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN)")
-            raise ValueError("Missing Google OAuth environment variables")
-
+        """Returns the shared Gmail API service client (credentials are cached and refreshed only when expired)."""
         try:
-            # Create credentials object from refresh token
-            creds = Credentials.from_authorized_user_info(
-                info={
-                    "refresh_token": refresh_token,
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                    "scopes": SCOPES # Ensure scopes match what the refresh token was granted for
-                },
-                scopes=SCOPES
-            )
-
-            # If credentials exist and are expired, refresh them
-            if creds and creds.expired and creds.refresh_token:
-                logging.info("Refreshing Google OAuth token.")
-                creds.refresh(Request())
-                # TODO: Persist the potentially updated credentials (if needed)
-            
-            if not creds or not creds.valid:
-                 # This path ideally shouldn't be hit if refresh token is valid
-                 # We might need an initial auth flow here if no refresh token exists
-                 logging.error("Failed to obtain valid Google OAuth credentials.")
-                 raise ValueError("Failed to obtain valid Google OAuth credentials.")
-
-            service = build('gmail', 'v1', credentials=creds)
-            logging.info("Gmail API service created successfully.")
+            service = get_gmail_service()
+            logging.info("Gmail API service ready.")
             return service
         except Exception as e:
             logging.error(f"Error creating Gmail service: {e}", exc_info=True)
@@ -0,0 +1,142 @@
+"""
+Shared Google API service objects.
+
+googleapiclient.discovery.build parses a discovery document and sets up a new
+HTTP transport every time it is called; the tools used to do that for every
+lead. Services built here use the discovery documents shipped with the library
+(no network fetch), are cached per credentials and scopes, and send each
+request through an AuthorizedHttp owned by the calling thread: httplib2
+connections are not thread-safe, but a per-thread one can be kept alive and
+reused across requests.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import google_auth_httplib2
+import httplib2
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpRequest
+
+GOOGLE_SERVICE_CACHE_SIZE = int(os.getenv("GOOGLE_SERVICE_CACHE_SIZE", "32"))
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "30"))
+# Transports kept per thread (one per credentials key); access tokens rotate, so older ones are closed
+GOOGLE_THREAD_HTTP_CACHE_SIZE = int(os.getenv("GOOGLE_THREAD_HTTP_CACHE_SIZE", "4"))
+
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.compose', 'https://www.googleapis.com/auth/gmail.readonly']
+
+_services = OrderedDict()
+_services_lock = threading.Lock()
+_thread_local = threading.local()
+_stats = {"built": 0, "reused": 0}
+
+_gmail_credentials = None
+_gmail_credentials_lock = threading.Lock()
+
+
+def _hash(*parts):
+    # Cache keys never hold tokens or secrets in clear
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_thread_http(credentials, key):
+    """
+    The calling thread's AuthorizedHttp for these credentials (created on first use).
+    Each thread keeps the GOOGLE_THREAD_HTTP_CACHE_SIZE most recently used ones.
+    """
+    https = getattr(_thread_local, "https", None)
+    if https is None:
+        https = _thread_local.https = OrderedDict()
+    http = https.get(key)
+    if http is not None:
+        https.move_to_end(key)
+        return http
+    http = https[key] = google_auth_httplib2.AuthorizedHttp(
+        credentials, http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT)
+    )
+    while len(https) > GOOGLE_THREAD_HTTP_CACHE_SIZE:
+        _, evicted = https.popitem(last=False)
+        try:
+            # Only this thread uses it, so nothing is in flight on its sockets
+            evicted.close()
+        except Exception as e:
+            logging.warning(f"Failed to close Google HTTP transport: {e}")
+    return http
+
+
+def get_service(api, version, credentials, key):
+    """
+    Cached service for (api, version, key); key identifies the credentials and
+    scopes (see _hash). Requests go through the calling thread's transport.
+    """
+    cache_key = (api, version, key)
+    with _services_lock:
+        service = _services.get(cache_key)
+        if service is not None:
+            _services.move_to_end(cache_key)
+            _stats["reused"] += 1
+            return service
+
+        def request_builder(http, *args, **kwargs):
+            # Ignore the service-wide http: each thread uses its own
+            return HttpRequest(get_thread_http(credentials, key), *args, **kwargs)
+
+        service = build(api, version, credentials=credentials, static_discovery=True,
+                        cache_discovery=False, requestBuilder=request_builder)
+        _services[cache_key] = service
+        _stats["built"] += 1
+        while len(_services) > GOOGLE_SERVICE_CACHE_SIZE:
+            _services.popitem(last=False)
+        logging.info(f"Built Google {api} {version} service ({len(_services)} cached)")
+        return service
+
+
+def get_calendar_service(access_token):
+    """Calendar v3 service for a pre-obtained OAuth access token."""
+    return get_service("calendar", "v3", Credentials(token=access_token), _hash("access_token", access_token))
+
+
+def get_gmail_credentials():
+    """
+    Credentials from GOOGLE_CLIENT_ID / GOOGLE_CLIENT_SECRET / GOOGLE_REFRESH_TOKEN,
+    built once and refreshed only when the access token is missing or expired.
+    """
+    global _gmail_credentials
+    with _gmail_credentials_lock:
+        if _gmail_credentials is None:
+            client_id = os.getenv('GOOGLE_CLIENT_ID')
+            client_secret = os.getenv('GOOGLE_CLIENT_SECRET')
+            refresh_token = os.getenv('GOOGLE_REFRESH_TOKEN')
+            if not all([client_id, client_secret, refresh_token]):
+                logging.error("Missing Google OAuth environment variables (CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN)")
+                raise ValueError("Missing Google OAuth environment variables")
+            _gmail_credentials = Credentials.from_authorized_user_info(
+                info={
+                    "refresh_token": refresh_token,
+                    "client_id": client_id,
+                    "client_secret": client_secret,
+                    "scopes": GMAIL_SCOPES # Ensure scopes match what the refresh token was granted for
+                },
+                scopes=GMAIL_SCOPES
+            )
+
+        if not _gmail_credentials.valid:
+            logging.info("Refreshing Google OAuth token.")
+            _gmail_credentials.refresh(Request())
+        return _gmail_credentials
+
+
+def get_gmail_service():
+    """Gmail v1 service for the account configured in the environment."""
+    credentials = get_gmail_credentials()
+    key = _hash("refresh_token", credentials.client_id or "", credentials.refresh_token or "", *GMAIL_SCOPES)
+    return get_service("gmail", "v1", credentials, key)
+
+
+def get_service_stats():
+    with _services_lock:
+        return {**_stats, "cached": len(_services)}
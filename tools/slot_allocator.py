@@ -0,0 +1,199 @@
+"""
+In-memory slot reservations, so leads scheduled at the same time can't be
+booked into the same slot.
+
+Two leads processed concurrently both see a slot as free until one of them
+has created its event (and the other has re-read the calendar). A
+SlotAllocator is shared by every lead scheduling into the same calendar: a
+slot is held in memory as soon as it is picked, and holds are painted into
+each lead's availability snapshot before it picks. Holds outlive the insert
+by CALENDAR_RESERVATION_TTL_SECONDS so snapshots read before the event
+existed still see it.
+
+allocate() assigns slots to many requests at once against one snapshot;
+schedule_batch() does the whole round trip (one availability fetch, the
+assignment, one batched insert).
+"""
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from tools.availability import AvailabilityIndex, SLOT_GRANULARITY_MINUTES
+
+CALENDAR_RESERVATION_TTL_SECONDS = float(os.getenv("CALENDAR_RESERVATION_TTL_SECONDS", "300"))
+CALENDAR_MAX_ALLOCATORS = 32
+
+
+class SlotAllocator:
+    """Reservations held in memory for one calendar."""
+
+    def __init__(self, ttl_seconds=CALENDAR_RESERVATION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._held = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.stats = {"reserved": 0, "conflicts": 0, "released": 0, "committed": 0}
+
+    def _expire(self):
+        # Caller holds the lock
+        now = time.monotonic()
+        for reservation_id in [rid for rid, held in self._held.items() if held["expires"] <= now]:
+            del self._held[reservation_id]
+
+    def _hold(self, start, end, lead_id):
+        # Caller holds the lock
+        reservation_id = next(self._ids)
+        self._held[reservation_id] = {"start": start, "end": end, "lead_id": lead_id,
+                                      "expires": time.monotonic() + self.ttl_seconds}
+        self.stats["reserved"] += 1
+        return reservation_id
+
+    def held_slots(self):
+        with self._lock:
+            self._expire()
+            return [{"start": held["start"], "end": held["end"]} for held in self._held.values()]
+
+    def apply(self, availability):
+        """Marks every held slot busy in an availability snapshot (before searching it for alternatives)."""
+        for slot in self.held_slots():
+            availability.mark_busy(slot["start"], slot["end"])
+        return availability
+
+    def try_reserve(self, start, end, lead_id=None):
+        """Holds [start, end) unless another lead holds an overlapping slot. Returns the reservation id or None."""
+        with self._lock:
+            self._expire()
+            for held in self._held.values():
+                if held["start"] < end and start < held["end"]:
+                    self.stats["conflicts"] += 1
+                    logging.info(f"Slot {start} to {end} is already held for lead {held['lead_id']}")
+                    return None
+            return self._hold(start, end, lead_id)
+
+    def release(self, reservation_id):
+        """Drops a hold (the event couldn't be created)."""
+        with self._lock:
+            if self._held.pop(reservation_id, None) is not None:
+                self.stats["released"] += 1
+
+    def confirm(self, reservation_id):
+        """The event exists: keep the hold one more TTL, until every snapshot includes the event."""
+        with self._lock:
+            held = self._held.get(reservation_id)
+            if held is not None:
+                held["expires"] = time.monotonic() + self.ttl_seconds
+                self.stats["committed"] += 1
+
+    def allocate(self, requests, availability, granularity=SLOT_GRANULARITY_MINUTES):
+        """
+        Assigns a slot to each request against one availability snapshot and holds them.
+        A request is a dict with preferred_start (aware datetime), duration_minutes and
+        optionally window_end (latest acceptable start) and lead_id. Requests with the
+        earliest deadline pick first; each takes its preferred start if free, otherwise
+        the first free slot after it within business hours.
+        Returns one dict per request, in input order: {"index", "lead_id", "start",
+        "end", "reservation_id"} with start None if nothing fits the window.
+        """
+        results = [None] * len(requests)
+        order = sorted(range(len(requests)), key=lambda i: (
+            requests[i].get("window_end") or requests[i]["preferred_start"] + timedelta(days=365),
+            requests[i]["preferred_start"]
+        ))
+        with self._lock:
+            self._expire()
+            for held in self._held.values():
+                availability.mark_busy(held["start"], held["end"])
+
+            for index in order:
+                request = requests[index]
+                preferred = request["preferred_start"]
+                duration = timedelta(minutes=int(request.get("duration_minutes", 30)))
+                window_end = request.get("window_end")
+                if availability.is_free(preferred, preferred + duration):
+                    start = preferred
+                else:
+                    slots = availability.find_slots(preferred, int(duration.total_seconds() // 60), granularity, k=1)
+                    start = slots[0] if slots and (window_end is None or slots[0] <= window_end) else None
+
+                result = {"index": index, "lead_id": request.get("lead_id"), "start": start, "end": None,
+                          "reservation_id": None}
+                if start is not None:
+                    availability.mark_busy(start, start + duration)
+                    result.update(end=start + duration,
+                                  reservation_id=self._hold(start, start + duration, request.get("lead_id")))
+                results[index] = result
+
+        logging.info(f"Allocated {sum(1 for r in results if r['start'])}/{len(requests)} requests")
+        return results
+
+    def get_stats(self):
+        with self._lock:
+            self._expire()
+            return {**self.stats, "held": len(self._held)}
+
+
+_allocators = OrderedDict()
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(access_token, calendar_id):
+    """Returns the shared allocator for this user's calendar (keyed by a hash of the token, never the token)."""
+    key = (hashlib.sha256(access_token.encode("utf-8")).hexdigest(), calendar_id)
+    with _allocators_lock:
+        allocator = _allocators.get(key)
+        if allocator is None:
+            allocator = _allocators[key] = SlotAllocator()
+        _allocators.move_to_end(key)
+        while len(_allocators) > CALENDAR_MAX_ALLOCATORS:
+            _allocators.popitem(last=False)
+        return allocator
+
+
+def schedule_batch(calendar_api, allocator, requests, granularity=SLOT_GRANULARITY_MINUTES):
+    """
+    Schedules many meetings into calendar_api's calendar: one get_busy_slots_range
+    call covering every request's window, allocate() against that snapshot, and
+    one flush_events for the inserts. Requests are allocate() requests that may
+    also carry summary, description, location and attendees for the event.
+    Returns allocate()'s results with "link" and "error" added.
+    """
+    if not requests:
+        return []
+    first_day = min(request["preferred_start"] for request in requests).date()
+    last_day = max((request.get("window_end") or request["preferred_start"] + timedelta(days=7))
+                   for request in requests).date() + timedelta(days=1)
+    busy_by_day = calendar_api.get_busy_slots_range(first_day, last_day)
+    availability = AvailabilityIndex(busy_by_day)
+
+    results = allocator.allocate(requests, availability, granularity=granularity)
+    queued = {}
+    for result in results:
+        result.update(link=None, error=None)
+        if result["start"] is None:
+            result["error"] = "No free slot in the requested window"
+            continue
+        request = requests[result["index"]]
+        position = calendar_api.queue_event(
+            summary=request.get("summary", "Meeting"),
+            description=request.get("description", ""),
+            start_time=result["start"],
+            duration_minutes=int(request.get("duration_minutes", 30)),
+            location=request.get("location", ""),
+            attendees=request.get("attendees")
+        )
+        queued[position] = result
+
+    for inserted in calendar_api.flush_events():
+        result = queued[inserted["index"]]
+        if inserted["ok"]:
+            result["link"] = inserted["link"]
+            allocator.confirm(result["reservation_id"])
+        else:
+            result["error"] = inserted["error"]
+            allocator.release(result["reservation_id"])
+    return results
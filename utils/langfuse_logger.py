@@ -1,16 +1,31 @@
 import os
+import threading
 from dotenv import load_dotenv
-from langfuse import Langfuse
 import logging
 
 # Load environment variables
 load_dotenv()
 
+# One client per process; built on first use so importing this module stays cheap
+_langfuse = None
+_langfuse_initialized = False
+_langfuse_lock = threading.Lock()
+
 def get_langfuse_handler():
     """
-    Creates and returns a Langfuse client using credentials from environment variables.
+    Returns the shared Langfuse client, creating it from environment variables on first call.
     Returns None if the required credentials are not available.
     """
+    global _langfuse, _langfuse_initialized
+    if _langfuse_initialized:
+        return _langfuse
+    with _langfuse_lock:
+        if not _langfuse_initialized:
+            _langfuse = _create_langfuse()
+            _langfuse_initialized = True
+    return _langfuse
+
+def _create_langfuse():
     try:
         public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
         secret_key = os.getenv("LANGFUSE_SECRET_KEY")
@@ -19,7 +34,9 @@ def get_langfuse_handler():
         if not public_key or not secret_key:
             logging.warning("Langfuse credentials not found in environment variables. Telemetry disabled.")
             return None
-            
+
+        # Imported here: the SDK is slow to import and only needed when telemetry is on
+        from langfuse import Langfuse
         return Langfuse(
             public_key=public_key,
             secret_key=secret_key,
@@ -1,155 +1,994 @@
-from openai import OpenAI, APIConnectionError, RateLimitError, APIError
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, RateLimitError, APIError, InternalServerError
 import os
+import asyncio
+import threading
+import time
+import weakref
+import json
 import logging
-from dotenv import load_dotenv
+import httpx
+from dotenv import load_dotenv, dotenv_values
 from pathlib import Path
 import re
+from datetime import datetime
 from utils.langfuse_logger import get_langfuse_handler
+from utils.llm_cache import LLMCache, make_cache_key
+from utils.llm_cassette import Cassette
+from utils.rate_limiter import RateLimiter
+from utils.structured_output import parse_structured_output, SchemaValidationError
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Find the root directory and load .env file
+# Nothing expensive or credential-dependent happens at import time: the OpenAI
+# client, the response cache and the Langfuse handler are built on first use
+# (see get_client, get_cache, get_langfuse_handler), so the orchestrator, tests and
+# benchmarks can be imported without an API key.
 root_dir = Path(__file__).parent.parent.absolute()
 env_path = root_dir / '.env'
 
-# Clear any existing OPENAI_API_KEY from the environment
-if "OPENAI_API_KEY" in os.environ:
-    logger.info("Clearing existing OPENAI_API_KEY from environment")
-    del os.environ["OPENAI_API_KEY"]
+# Make LLM_* settings from .env visible to the configuration below
+load_dotenv(env_path)
 
-# First try loading with dotenv
-load_dotenv()
+def _resolve_api_key():
+    """Returns the OpenAI key, preferring the project's .env over the inherited environment."""
+    api_key = None
+    if env_path.exists():
+        api_key = dotenv_values(env_path).get("OPENAI_API_KEY")
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        logger.error(f"OPENAI_API_KEY not found. Looking for .env in: {env_path}")
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    return api_key
 
-# Get the API key
-api_key = os.getenv("OPENAI_API_KEY")
+# HTTP connection pool settings shared by the sync and async clients.
+# Keep-alive connections let many concurrent lead pipelines reuse the same
+# TLS sessions to the OpenAI API instead of reconnecting on every call.
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "30"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
 
-# If that didn't work, try to parse the .env file directly
-if not api_key and env_path.exists():
-    logger.info(f"Trying to parse .env file directly from: {env_path}")
+def _http_limits():
+    return httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY
+    )
+
+def _http_timeout():
+    return httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the process-wide pooled OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Retries are handled by our own backoff engine (see _complete), so the SDK's are disabled
+                _client = OpenAI(
+                    api_key=_resolve_api_key(),
+                    max_retries=0,
+                    http_client=httpx.Client(limits=_http_limits(), timeout=_http_timeout())
+                )
+    return _client
+
+# Async clients are tied to the event loop their connection pool was opened on,
+# so keep one per loop (dropped automatically when the loop is garbage collected)
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_client():
+    """Returns the pooled AsyncOpenAI client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = AsyncOpenAI(
+            api_key=_resolve_api_key(),
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout())
+        )
+        _async_clients[loop] = async_client
+    return async_client
+
+async def aclose_async_client():
+    """Closes the async client of the running event loop and its pooled connections."""
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
+SYSTEM_PROMPT = "You're a helpful assistant focused on providing clear, accurate, and well-reasoned responses."
+MODEL = "gpt-4"  # or "gpt-3.5-turbo" for cheaper tests
+TEMPERATURE = 0.3
+
+# Per-call-site model routing: small, fast models for classification and
+# extraction, the large model only for the prose we send to leads.
+# Override or extend with LLM_ROUTES='{"reply.draft": {"model": "gpt-4o"}}'.
+LLM_ROUTES = {
+    "default": {"model": MODEL, "temperature": TEMPERATURE, "max_tokens": None},
+    "inbox.qualify": {"model": "gpt-4o-mini", "temperature": 0.0, "max_tokens": 500},
+    "calendar.date_intent": {"model": "gpt-4o-mini", "temperature": 0.0, "max_tokens": 150},
+    "calendar.schedule": {"model": "gpt-4o-mini", "temperature": 0.0, "max_tokens": 200},
+    "calendar.schedule_single_pass": {"model": "gpt-4o-mini", "temperature": 0.0, "max_tokens": 250},
+    "crm.extract": {"model": "gpt-4o-mini", "temperature": 0.0, "max_tokens": 300},
+    "reply.draft": {"model": MODEL, "temperature": TEMPERATURE, "max_tokens": 800},
+}
+
+if os.getenv("LLM_ROUTES"):
     try:
-        with open(env_path, 'r') as file:
-            for line in file:
-                if line.startswith('OPENAI_API_KEY='):
-                    # Extract everything after the equals sign
-                    api_key = line.strip().split('=', 1)[1]
-                    # Remove any quotes if present
-                    api_key = api_key.strip('"\'')
-                    # Set it in environment for other parts of the application
-                    os.environ["OPENAI_API_KEY"] = api_key
-                    break
-            else:
-                logger.error("Could not find OPENAI_API_KEY in .env file")
-    except Exception as e:
-        logger.error(f"Error reading .env file: {str(e)}")
+        for route_name, overrides in json.loads(os.getenv("LLM_ROUTES")).items():
+            LLM_ROUTES[route_name] = {**LLM_ROUTES.get(route_name, LLM_ROUTES["default"]), **overrides}
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Ignoring invalid LLM_ROUTES override: {e}")
+
+# Models that reject response_format={"type": "json_object"} (JSON mode arrived with
+# the 1106 models). A route can also set "supports_json_mode" explicitly.
+JSON_MODE_UNSUPPORTED_MODELS = {
+    "gpt-4", "gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0314", "gpt-4-32k-0613",
+    "gpt-3.5-turbo-0301", "gpt-3.5-turbo-0613", "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613",
+}
+
+def supports_json_mode(route):
+    """True if the route's model accepts the JSON response format."""
+    if route.get("supports_json_mode") is not None:
+        return bool(route["supports_json_mode"])
+    return route["model"] not in JSON_MODE_UNSUPPORTED_MODELS
+
+def get_route(name="default"):
+    """Returns the model settings for a call site, falling back to the default route."""
+    if name not in LLM_ROUTES:
+        logger.warning(f"Unknown LLM route '{name}', using default")
+    route = LLM_ROUTES.get(name, LLM_ROUTES["default"])
+    return {**LLM_ROUTES["default"], **route, "name": name}
+
+class _RouteStats:
+    """Per-route call, token and latency counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, usage):
+        with self._lock:
+            stats = self._routes.setdefault(route["name"], {
+                "model": route["model"], "calls": 0, "api_calls": 0,
+                "input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "latency_ms": 0.0
+            })
+            stats["calls"] += 1
+            if usage.get("source") in ("api", "replay"):
+                stats["api_calls"] += 1
+            stats["input_tokens"] += usage.get("input", 0)
+            stats["output_tokens"] += usage.get("output", 0)
+            stats["total_tokens"] += usage.get("total", 0)
+            stats["latency_ms"] += usage.get("latency_ms", 0.0)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                name: {
+                    **stats,
+                    "latency_ms": round(stats["latency_ms"], 1),
+                    "avg_latency_ms": round(stats["latency_ms"] / stats["calls"], 1) if stats["calls"] else None
+                }
+                for name, stats in self._routes.items()
+            }
+
+_route_stats = _RouteStats()
 
-if not api_key:
-    logger.error(f"OPENAI_API_KEY not found. Looking for .env in: {env_path}")
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
+# Prompt/response cache (in-memory LRU in front of an on-disk SQLite table)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(root_dir / ".llm_cache.sqlite3"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_MAX_DISK_ENTRIES = int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "10000"))
 
-# Log the first few characters of the API key for debugging
-if api_key:
-    logger.info(f"API key found (starts with: {api_key[:10]}...)")
+# Backend: "live" calls OpenAI, "record" also appends every exchange to a cassette,
+# "replay" answers from the cassette with no network access or API key
+LLM_BACKEND = os.getenv("LLM_BACKEND", "live").lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", str(root_dir / "benchmarks" / "cassettes" / "llm.jsonl"))
+# Sleep for the recorded latency when replaying (scaled), to keep realistic timing
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "false").lower() in ("1", "true", "yes")
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+# Serve another recording of the same route when a prompt has none (opt-in: the
+# answer then isn't the one recorded for that prompt)
+LLM_REPLAY_ROUTE_FALLBACK = os.getenv("LLM_REPLAY_ROUTE_FALLBACK", "false").lower() in ("1", "true", "yes")
+# Fixed "now" (ISO 8601) for prompts that embed the date; replays default to the recording time
+LLM_FROZEN_NOW = os.getenv("LLM_FROZEN_NOW")
 
-client = OpenAI(api_key=api_key)
+if LLM_BACKEND not in ("live", "record", "replay"):
+    raise ValueError(f"LLM_BACKEND must be live, record or replay, not '{LLM_BACKEND}'")
 
-# Initialize Langfuse handler
-langfuse_handler = get_langfuse_handler()
+_llm_cache = None
+_cache_lock = threading.Lock()
 
-def llm_think(prompt):
+def get_cache():
+    """Returns the shared LLM response cache (opened on first use), or None if caching is disabled."""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        with _cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMCache(
+                    # Recording and replaying must not depend on what earlier runs left on disk
+                    path=(LLM_CACHE_PATH or None) if LLM_BACKEND == "live" else None,
+                    ttl_seconds=LLM_CACHE_TTL_SECONDS,
+                    max_memory_entries=LLM_CACHE_MAX_ENTRIES,
+                    max_disk_entries=LLM_CACHE_MAX_DISK_ENTRIES
+                )
+    return _llm_cache
+
+# Request/token budget per model, shared by every agent in the process (OpenAI
+# limits are per model; the defaults apply to each model until its headers arrive)
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "500"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "40000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+# Expected completion size, used to reserve tokens before the real usage is known
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "400"))
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model):
+    """Returns the process-wide RateLimiter of a model (created on first use)."""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is None:
+            limiter = _rate_limiters[model] = RateLimiter(
+                requests_per_minute=LLM_RPM_LIMIT,
+                tokens_per_minute=LLM_TPM_LIMIT,
+                max_concurrency=LLM_MAX_CONCURRENCY,
+                backoff_base=LLM_BACKOFF_BASE_SECONDS,
+                backoff_max=LLM_BACKOFF_MAX_SECONDS
+            )
+        return limiter
+
+def get_rate_limiter_stats():
+    """Rate limiter counters per model."""
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return {model: limiter.get_stats() for model, limiter in limiters.items()}
+
+class LLMError(RuntimeError):
+    """Raised when an LLM call fails for good (after retries for transient errors)."""
+
+    def __init__(self, message, error_type="unexpected"):
+        super().__init__(message)
+        self.error_type = error_type
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+def get_cassette():
+    """Returns the record/replay cassette, or None with the live backend."""
+    global _cassette
+    if LLM_BACKEND == "live":
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(LLM_CASSETTE_PATH, load=LLM_BACKEND == "replay")
+                logger.info(f"LLM backend '{LLM_BACKEND}' using cassette {LLM_CASSETTE_PATH}")
+    return _cassette
+
+def llm_now(tz):
+    """
+    The current time for prompts that embed it: LLM_FROZEN_NOW if set, the time
+    the cassette was recorded when replaying, else the real time. Replayed
+    prompts then match their recorded keys on any day.
+    """
+    if LLM_FROZEN_NOW:
+        frozen = datetime.fromisoformat(LLM_FROZEN_NOW)
+        return frozen.astimezone(tz) if frozen.tzinfo else tz.localize(frozen)
+    if LLM_BACKEND == "replay":
+        recorded_at = get_cassette().recorded_at
+        if recorded_at is not None:
+            return datetime.fromtimestamp(recorded_at, tz)
+    return datetime.now(tz)
+
+def get_cache_stats():
+    """Returns hit/miss counters of the LLM response cache (empty dict if disabled)."""
+    # Don't open the cache just to report that nothing has happened yet
+    return _llm_cache.get_stats() if _llm_cache else {}
+
+def _start_span(prompt, route):
+    """Start a new span for an LLM call if Langfuse is configured."""
+    langfuse_handler = get_langfuse_handler()
+    if not langfuse_handler:
+        return None
     try:
-        # Start a new span for this LLM call if we're inside a trace
-        span = None
-        if langfuse_handler:
-            span = langfuse_handler.span(
-                name="llm_call",
+        return langfuse_handler.span(
+            name="llm_call",
+            metadata={
+                "model": route["model"],
+                "route": route["name"],
+                "prompt_length": len(prompt),
+                "temperature": route["temperature"]
+            }
+        )
+    except Exception as e:
+        logger.warning(f"Failed to create Langfuse span: {str(e)}")
+        return None
+
+def _build_messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def _request_params(prompt, route):
+    """Chat completion arguments for a prompt on a given route."""
+    params = {
+        "model": route["model"],
+        "messages": _build_messages(prompt),
+        "temperature": route["temperature"]
+    }
+    if route.get("max_tokens"):
+        params["max_tokens"] = route["max_tokens"]
+    if route.get("json_mode"):
+        params["response_format"] = {"type": "json_object"}
+    return params
+
+def _log_response_safely(span, content, usage):
+    """Log the completion in Langfuse - safely calling methods that might not exist"""
+    try:
+        # Try observation method first (pre-2.0)
+        if hasattr(span, "observation"):
+            span.observation(
+                name="llm_response",
+                value=usage.total_tokens,
                 metadata={
-                    "model": "gpt-4",
-                    "prompt_length": len(prompt),
-                    "temperature": 0.3
+                    "completion_length": len(content),
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens
                 }
             )
+        # Try add_observation next (some versions)
+        elif hasattr(span, "add_observation"):
+            span.add_observation(
+                name="llm_response",
+                value=usage.total_tokens,
+                metadata={
+                    "completion_length": len(content),
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens
+                }
+            )
+        # Fall back to event (Langfuse 2.0)
+        elif hasattr(span, "event"):
+            span.event(
+                name="llm_response",
+                metadata={
+                    "completion_length": len(content),
+                    "prompt_tokens": usage.prompt_tokens,
+                    "completion_tokens": usage.completion_tokens,
+                    "total_tokens": usage.total_tokens
+                }
+            )
+        # If none of these methods exist, log the issue
+        else:
+            logger.warning("Unable to log observation to Langfuse: no compatible method found on span")
+    except Exception as e:
+        logger.warning(f"Failed to log observation to Langfuse: {str(e)}")
 
-        response = client.chat.completions.create(
-            model="gpt-4",  # or "gpt-3.5-turbo" for cheaper tests
-            messages=[
-                {"role": "system", "content": "You're a helpful assistant focused on providing clear, accurate, and well-reasoned responses."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3
-        )
+def _estimate_tokens(prompt, route):
+    # ~4 characters per token for English text, plus room for the completion
+    return (len(SYSTEM_PROMPT) + len(prompt)) // 4 + (route.get("max_tokens") or LLM_EXPECTED_COMPLETION_TOKENS)
 
-        content = response.choices[0].message.content
-        tokens_used = response.usage.total_tokens
+def _usage_record(route, usage=None, latency_ms=0.0, source="api"):
+    """
+    Structured usage returned by llm_think: prompt/completion token split,
+    wall-clock latency and model. source is "api", "replay", "cache" or
+    "coalesced"; only "api" and "replay" records carry tokens, since the others
+    spent none (replayed records report the tokens spent when recorded).
+    """
+    return {
+        "input": usage.prompt_tokens if usage is not None else 0,
+        "output": usage.completion_tokens if usage is not None else 0,
+        "total": usage.total_tokens if usage is not None else 0,
+        "latency_ms": round(latency_ms, 1),
+        "model": route["model"],
+        "source": source
+    }
 
-        # Log the completion in Langfuse - safely calling methods that might not exist
-        if span:
+def merge_usage(*records):
+    """Sums several usage records, e.g. for an agent that makes more than one LLM call."""
+    merged = {"input": 0, "output": 0, "total": 0, "latency_ms": 0.0, "model": None, "source": None}
+    models = []
+    sources = set()
+    for record in records:
+        if not record:
+            continue
+        for key in ("input", "output", "total", "latency_ms"):
+            merged[key] += record.get(key, 0) or 0
+        if record.get("model") and record["model"] not in models:
+            models.append(record["model"])
+        if record.get("source"):
+            sources.add(record["source"])
+    merged["latency_ms"] = round(merged["latency_ms"], 1)
+    merged["model"] = ",".join(models) if models else None
+    merged["source"] = sources.pop() if len(sources) == 1 else ("mixed" if sources else None)
+    return merged
+
+def _is_retryable(error):
+    if isinstance(error, RateLimitError):
+        # An exhausted quota won't recover by waiting
+        return getattr(error, "code", None) != "insufficient_quota"
+    return isinstance(error, (APIConnectionError, InternalServerError))
+
+def _error_headers(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+def _raise_llm_error(span, error):
+    """Logs an OpenAI exception and re-raises it as LLMError."""
+    if isinstance(error, APIConnectionError):
+        logger.error(f"Could not connect to OpenAI: {str(error)}")
+        error_type = "connection"
+    elif isinstance(error, RateLimitError):
+        logger.error(f"Rate limit exceeded: {str(error)}")
+        error_type = "rate_limit"
+    elif isinstance(error, APIError):
+        logger.error(f"OpenAI API error: {str(error)}")
+        error_type = "api"
+    else:
+        logger.error(f"Unexpected error: {str(error)}")
+        error_type = "unexpected"
+    if span:
+        log_error_safely(span, error_type, str(error))
+    raise LLMError(f"LLM call failed ({error_type}): {error}", error_type=error_type) from error
+
+class _SingleFlight:
+    """
+    Coalesces concurrent identical LLM requests.
+    The first caller for a key (the leader) makes the upstream call; callers arriving
+    while it is in flight wait for it and share its result instead of calling again.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.stats = {"upstream_calls": 0, "coalesced_calls": 0}
+
+    def do(self, key, fn):
+        """Runs fn() once per in-flight key. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._Call()
+                self._calls[key] = call
+                self.stats["upstream_calls"] += 1
+            else:
+                self.stats["coalesced_calls"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key, coro_fn):
+        """Awaits coro_fn() once per in-flight key on the running loop. Returns (result, shared)."""
+        loop_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            future = self._async_calls.get(loop_key)
+            leader = future is None
+            if leader:
+                future = asyncio.get_running_loop().create_future()
+                self._async_calls[loop_key] = future
+                self.stats["upstream_calls"] += 1
+            else:
+                self.stats["coalesced_calls"] += 1
+        if not leader:
+            # shield() so a cancelled follower doesn't cancel the shared request
+            return await asyncio.shield(future), True
+
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no follower was waiting
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._async_calls.pop(loop_key, None)
+        return result, False
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self._calls) + len(self._async_calls)
+        return stats
+
+_single_flight = _SingleFlight()
+
+def get_llm_stats():
+    """Returns process-wide LLM counters (cache, coalescing, rate limiting, streaming and per-route usage)."""
+    return {
+        "routes": _route_stats.get_stats(),
+        "cache": get_cache_stats(),
+        "single_flight": _single_flight.get_stats(),
+        "rate_limiter": get_rate_limiter_stats(),
+        "streaming": _stream_stats.get_stats(),
+        "structured_output": dict(_structured_stats),
+        "backend": {"mode": LLM_BACKEND, **(_cassette.get_stats() if _cassette else {})}
+    }
+
+def _request_key(prompt, route, cache_salt):
+    return make_cache_key(
+        route["model"], SYSTEM_PROMPT, prompt, route["temperature"],
+        [route.get("max_tokens"), bool(route.get("json_mode")), cache_salt]
+    )
+
+def _cassette_key(prompt, route):
+    # Like _request_key without the cache salt, which only controls cache freshness
+    return make_cache_key(
+        route["model"], SYSTEM_PROMPT, prompt, route["temperature"],
+        [route.get("max_tokens"), bool(route.get("json_mode"))]
+    )
+
+def _replay_entry(prompt, route):
+    """Looks up the recorded exchange for a request. Raises LLMError if there is none."""
+    entry = get_cassette().lookup(_cassette_key(prompt, route), route["name"], LLM_REPLAY_ROUTE_FALLBACK)
+    if entry is None:
+        logger.error(f"No recorded LLM response for route '{route['name']}' in {LLM_CASSETTE_PATH}")
+        raise LLMError(f"LLM call failed (cassette_miss): nothing recorded for route '{route['name']}'", error_type="cassette_miss")
+    return entry
+
+def _replay_delay(entry, ttft=False):
+    """Seconds to sleep to reproduce the recorded latency (0 unless LLM_REPLAY_LATENCY is set)."""
+    if not LLM_REPLAY_LATENCY:
+        return 0.0
+    latency_ms = entry.get("ttft_ms") if ttft and entry.get("ttft_ms") is not None else entry.get("latency_ms", 0.0)
+    return max(0.0, latency_ms or 0.0) * LLM_REPLAY_LATENCY_SCALE / 1000
+
+def _replayed_usage(route, entry, latency_ms):
+    return {**_usage_record(route, latency_ms=latency_ms, source="replay"), **entry["usage"]}
+
+def _replay(prompt, route):
+    started = time.perf_counter()
+    entry = _replay_entry(prompt, route)
+    time.sleep(_replay_delay(entry))
+    return entry["content"], _replayed_usage(route, entry, (time.perf_counter() - started) * 1000)
+
+async def _replay_async(prompt, route):
+    started = time.perf_counter()
+    entry = _replay_entry(prompt, route)
+    await asyncio.sleep(_replay_delay(entry))
+    return entry["content"], _replayed_usage(route, entry, (time.perf_counter() - started) * 1000)
+
+def _record(prompt, route, content, usage, ttft_ms=None):
+    if LLM_BACKEND == "record":
+        get_cassette().record(_cassette_key(prompt, route), route, prompt, content, usage, ttft_ms)
+
+def _complete(prompt, route, cache_key):
+    """
+    Makes the upstream call and stores a successful result under cache_key.
+    Transient failures (429, connection errors, 5xx) are retried with jittered
+    exponential backoff inside the shared rate limit; anything else raises LLMError.
+    With LLM_BACKEND=replay the answer comes from the cassette instead.
+    """
+    if LLM_BACKEND == "replay":
+        content, usage = _replay(prompt, route)
+        if cache_key:
+            get_cache().set(cache_key, {"content": content, "usage": usage})
+        return content, usage
+
+    span = None
+    try:
+        # Start a new span for this LLM call if we're inside a trace
+        span = _start_span(prompt, route)
+        estimated_tokens = _estimate_tokens(prompt, route)
+        rate_limiter = get_rate_limiter(route["model"])
+        started = time.perf_counter()
+
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            rate_limiter.acquire(estimated_tokens)
             try:
-                # Try observation method first (pre-2.0)
-                if hasattr(span, "observation"):
-                    span.observation(
-                        name="llm_response",
-                        value=tokens_used,
-                        metadata={
-                            "completion_length": len(content),
-                            "prompt_tokens": response.usage.prompt_tokens,
-                            "completion_tokens": response.usage.completion_tokens
-                        }
-                    )
-                # Try add_observation next (some versions)
-                elif hasattr(span, "add_observation"):
-                    span.add_observation(
-                        name="llm_response",
-                        value=tokens_used,
-                        metadata={
-                            "completion_length": len(content),
-                            "prompt_tokens": response.usage.prompt_tokens,
-                            "completion_tokens": response.usage.completion_tokens
-                        }
-                    )
-                # Fall back to event (Langfuse 2.0)
-                elif hasattr(span, "event"):
-                    span.event(
-                        name="llm_response",
-                        metadata={
-                            "completion_length": len(content),
-                            "prompt_tokens": response.usage.prompt_tokens,
-                            "completion_tokens": response.usage.completion_tokens,
-                            "total_tokens": tokens_used
-                        }
-                    )
-                # If none of these methods exist, log the issue
-                else:
-                    logger.warning("Unable to log observation to Langfuse: no compatible method found on span")
+                raw = get_client().chat.completions.with_raw_response.create(**_request_params(prompt, route))
+                response = raw.parse()
             except Exception as e:
-                logger.warning(f"Failed to log observation to Langfuse: {str(e)}")
-
-        return content, tokens_used
+                headers = _error_headers(e)
+                rate_limiter.release(estimated_tokens, rate_limited=isinstance(e, RateLimitError), headers=headers)
+                if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = rate_limiter.backoff_delay(attempt, headers)
+                logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            rate_limiter.release(estimated_tokens, actual_tokens=response.usage.total_tokens, headers=raw.headers)
+            break
 
-    except APIConnectionError as e:
-        logger.error(f"Could not connect to OpenAI: {str(e)}")
+        content = response.choices[0].message.content
         if span:
-            log_error_safely(span, "connection", str(e))
-        return "Connection error", 0
+            _log_response_safely(span, content, response.usage)
+        usage = _usage_record(route, response.usage, (time.perf_counter() - started) * 1000)
+        _record(prompt, route, content, usage)
+        if cache_key:
+            get_cache().set(cache_key, {"content": content, "usage": usage})
+        return content, usage
 
-    except RateLimitError as e:
-        logger.error(f"Rate limit exceeded: {str(e)}")
-        if span:
-            log_error_safely(span, "rate_limit", str(e))
-        return "Rate limit exceeded", 0
+    except Exception as e:
+        _raise_llm_error(span, e)
+
+async def _complete_async(prompt, route, cache_key):
+    if LLM_BACKEND == "replay":
+        content, usage = await _replay_async(prompt, route)
+        if cache_key:
+            get_cache().set(cache_key, {"content": content, "usage": usage})
+        return content, usage
+
+    span = None
+    try:
+        span = _start_span(prompt, route)
+        estimated_tokens = _estimate_tokens(prompt, route)
+        rate_limiter = get_rate_limiter(route["model"])
+        started = time.perf_counter()
 
-    except APIError as e:
-        logger.error(f"OpenAI API error: {str(e)}")
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await rate_limiter.acquire_async(estimated_tokens)
+            try:
+                raw = await get_async_client().chat.completions.with_raw_response.create(**_request_params(prompt, route))
+                response = raw.parse()
+            except Exception as e:
+                headers = _error_headers(e)
+                rate_limiter.release(estimated_tokens, rate_limited=isinstance(e, RateLimitError), headers=headers)
+                if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                    raise
+                delay = rate_limiter.backoff_delay(attempt, headers)
+                logger.warning(f"LLM call failed ({type(e).__name__}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            rate_limiter.release(estimated_tokens, actual_tokens=response.usage.total_tokens, headers=raw.headers)
+            break
+
+        content = response.choices[0].message.content
         if span:
-            log_error_safely(span, "api", str(e))
-        return "API error", 0
+            _log_response_safely(span, content, response.usage)
+        usage = _usage_record(route, response.usage, (time.perf_counter() - started) * 1000)
+        _record(prompt, route, content, usage)
+        if cache_key:
+            get_cache().set(cache_key, {"content": content, "usage": usage})
+        return content, usage
 
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        if span:
-            log_error_safely(span, "unexpected", str(e))
-        return "Unexpected error", 0
+        _raise_llm_error(span, e)
+
+def llm_think(prompt, cache=True, cache_salt=None, route="default"):
+    """
+    Sends a prompt to the LLM and returns (content, usage), where usage is a dict
+    with "input"/"output"/"total" tokens, "latency_ms", "model" and "source".
+
+    route names the call site in LLM_ROUTES, which picks model, temperature and max_tokens.
+    Successful responses are cached on (model, system prompt, prompt, temperature).
+    Pass cache=False for prompts that must always hit the model, or a cache_salt
+    (e.g. today's date) for prompts whose answer depends on more than their text.
+    Concurrent identical calls are coalesced into one upstream request.
+    Cache hits and coalesced calls cost no tokens and report 0 (see _usage_record).
+    Raises LLMError if the model can't be reached, so failures are never
+    mistaken for generated content.
+    """
+    return _think(prompt, get_route(route), cache, cache_salt)
+
+def _think(prompt, route, cache, cache_salt):
+    started = time.perf_counter()
+    key = _request_key(prompt, route, cache_salt)
+    llm_cache = get_cache() if cache else None
+    use_cache = llm_cache is not None
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            usage = _usage_record(route, latency_ms=(time.perf_counter() - started) * 1000, source="cache")
+            _route_stats.record(route, usage)
+            return cached["content"], usage
+
+    (content, usage), shared = _single_flight.do(
+        key, lambda: _complete(prompt, route, key if use_cache else None)
+    )
+    if shared:
+        usage = _usage_record(route, latency_ms=(time.perf_counter() - started) * 1000, source="coalesced")
+    _route_stats.record(route, usage)
+    return content, usage
+
+async def llm_think_async(prompt, cache=True, cache_salt=None, route="default"):
+    """
+    Coroutine version of llm_think running on the pooled async HTTP client.
+    Lets one process keep many lead pipelines in flight without a thread per call.
+    Returns the same (content, usage) tuple as llm_think and shares its cache.
+    """
+    return await _think_async(prompt, get_route(route), cache, cache_salt)
+
+async def _think_async(prompt, route, cache, cache_salt):
+    started = time.perf_counter()
+    key = _request_key(prompt, route, cache_salt)
+    llm_cache = get_cache() if cache else None
+    use_cache = llm_cache is not None
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            usage = _usage_record(route, latency_ms=(time.perf_counter() - started) * 1000, source="cache")
+            _route_stats.record(route, usage)
+            return cached["content"], usage
+
+    (content, usage), shared = await _single_flight.do_async(
+        key, lambda: _complete_async(prompt, route, key if use_cache else None)
+    )
+    if shared:
+        usage = _usage_record(route, latency_ms=(time.perf_counter() - started) * 1000, source="coalesced")
+    _route_stats.record(route, usage)
+    return content, usage
+
+class StructuredOutputError(LLMError):
+    """Raised when the model's reply can't be parsed/validated, even after repair and a re-ask."""
+
+    def __init__(self, message, raw_response=None, usage=None):
+        super().__init__(message, error_type="invalid_output")
+        self.raw_response = raw_response
+        self.usage = usage
+
+_structured_stats = {"parsed": 0, "repaired": 0, "reasked": 0, "failed": 0}
+_structured_stats_lock = threading.Lock()
+
+def _count_structured(outcome):
+    with _structured_stats_lock:
+        _structured_stats[outcome] += 1
+
+def _try_parse(content, schema):
+    """Returns (data, error); repairs the text locally before giving up."""
+    try:
+        data, repaired = parse_structured_output(content, schema)
+    except (ValueError, SchemaValidationError) as e:
+        return None, e
+    _count_structured("repaired" if repaired else "parsed")
+    return data, None
+
+def _reask_prompt(prompt, content, error):
+    return (
+        f"{prompt}\n\nYour previous answer could not be used:\n{content}\n\n"
+        f"Problem: {error}\nReturn only the corrected JSON object."
+    )
+
+def _structured_failure(route, content, error, usage):
+    _count_structured("failed")
+    logger.error(f"Structured output for route '{route['name']}' failed validation: {error}")
+    return StructuredOutputError(f"Invalid structured output: {error}", raw_response=content, usage=usage)
+
+def llm_think_json(prompt, schema=None, cache=True, cache_salt=None, route="default"):
+    """
+    Structured-output variant of llm_think. Uses the provider's JSON response mode
+    when the route's model supports it (the prompt must ask for JSON either way),
+    validates the reply against `schema` locally and repairs common formatting
+    mistakes (code fences, preambles, trailing commas) before re-asking the model once.
+    Returns (data, usage); raises StructuredOutputError if no valid object is obtained.
+    """
+    route = get_route(route)
+    route = {**route, "json_mode": supports_json_mode(route)}
+    content, usage = _think(prompt, route, cache, cache_salt)
+    data, error = _try_parse(content, schema)
+    if error is None:
+        return data, usage
+
+    # The bad reply may have been cached; make sure it's not served again
+    key = _request_key(prompt, route, cache_salt)
+    llm_cache = get_cache() if cache else None
+    if llm_cache:
+        llm_cache.delete(key)
+    logger.warning(f"Structured output for route '{route['name']}' invalid ({error}), re-asking once")
+    _count_structured("reasked")
+    retry_content, retry_usage = _think(_reask_prompt(prompt, content, error), route, False, cache_salt)
+    usage = merge_usage(usage, retry_usage)
+    data, error = _try_parse(retry_content, schema)
+    if error is not None:
+        raise _structured_failure(route, retry_content, error, usage)
+    if llm_cache:
+        llm_cache.set(key, {"content": json.dumps(data), "usage": usage})
+    return data, usage
+
+async def llm_think_json_async(prompt, schema=None, cache=True, cache_salt=None, route="default"):
+    """Coroutine version of llm_think_json."""
+    route = get_route(route)
+    route = {**route, "json_mode": supports_json_mode(route)}
+    content, usage = await _think_async(prompt, route, cache, cache_salt)
+    data, error = _try_parse(content, schema)
+    if error is None:
+        return data, usage
+
+    key = _request_key(prompt, route, cache_salt)
+    llm_cache = get_cache() if cache else None
+    if llm_cache:
+        llm_cache.delete(key)
+    logger.warning(f"Structured output for route '{route['name']}' invalid ({error}), re-asking once")
+    _count_structured("reasked")
+    retry_content, retry_usage = await _think_async(_reask_prompt(prompt, content, error), route, False, cache_salt)
+    usage = merge_usage(usage, retry_usage)
+    data, error = _try_parse(retry_content, schema)
+    if error is not None:
+        raise _structured_failure(route, retry_content, error, usage)
+    if llm_cache:
+        llm_cache.set(key, {"content": json.dumps(data), "usage": usage})
+    return data, usage
+
+class _StreamStats:
+    """Time-to-first-token counters for streamed completions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.ttft_ms_total = 0.0
+        self.ttft_ms_max = 0.0
+        self.ttft_ms_last = None
+
+    def record(self, ttft_ms):
+        with self._lock:
+            self.streams += 1
+            self.ttft_ms_total += ttft_ms
+            self.ttft_ms_max = max(self.ttft_ms_max, ttft_ms)
+            self.ttft_ms_last = ttft_ms
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "streams": self.streams,
+                "ttft_ms_avg": round(self.ttft_ms_total / self.streams, 1) if self.streams else None,
+                "ttft_ms_max": round(self.ttft_ms_max, 1),
+                "ttft_ms_last": round(self.ttft_ms_last, 1) if self.ttft_ms_last is not None else None
+            }
+
+_stream_stats = _StreamStats()
+
+class LLMStream:
+    """
+    Iterator over the text deltas of a streamed completion (see llm_think_stream).
+    Once exhausted, .content holds the full text, .usage the usage record and
+    .ttft_ms the time to first token.
+    """
+
+    def __init__(self, prompt, cache=True, cache_salt=None, route="default"):
+        self.prompt = prompt
+        self.route = get_route(route)
+        self.cache = cache
+        self.cache_salt = cache_salt
+        self.content = None
+        self.usage = None
+        self.ttft_ms = None
+
+    def __iter__(self):
+        started = time.perf_counter()
+        key = _request_key(self.prompt, self.route, self.cache_salt)
+        llm_cache = get_cache() if self.cache else None
+        use_cache = llm_cache is not None
+        if use_cache:
+            cached = llm_cache.get(key)
+            if cached is not None:
+                self.ttft_ms = (time.perf_counter() - started) * 1000
+                self.content = cached["content"]
+                self.usage = _usage_record(self.route, latency_ms=self.ttft_ms, source="cache")
+                _route_stats.record(self.route, self.usage)
+                yield cached["content"]
+                return
+
+        if LLM_BACKEND == "replay":
+            yield from self._replay(started)
+            if use_cache:
+                llm_cache.set(key, {"content": self.content, "usage": self.usage})
+            return
+
+        span = _start_span(self.prompt, self.route)
+        estimated_tokens = _estimate_tokens(self.prompt, self.route)
+        rate_limiter = get_rate_limiter(self.route["model"])
+        stream, headers = self._open(span, estimated_tokens)
+
+        parts = []
+        usage = None
+        released = False
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if self.ttft_ms is None:
+                    self.ttft_ms = (time.perf_counter() - started) * 1000
+                    _stream_stats.record(self.ttft_ms)
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            rate_limiter.release(estimated_tokens, rate_limited=isinstance(e, RateLimitError), headers=headers)
+            released = True
+            _raise_llm_error(span, e)
+        finally:
+            # Also reached when the consumer stops iterating early
+            if not released:
+                rate_limiter.release(
+                    estimated_tokens,
+                    actual_tokens=usage.total_tokens if usage is not None else None,
+                    headers=headers
+                )
+
+        self.content = "".join(parts)
+        self.usage = _usage_record(self.route, usage, (time.perf_counter() - started) * 1000)
+        _route_stats.record(self.route, self.usage)
+        if span and usage is not None:
+            _log_response_safely(span, self.content, usage)
+        _record(self.prompt, self.route, self.content, self.usage, self.ttft_ms)
+        if use_cache:
+            llm_cache.set(key, {"content": self.content, "usage": self.usage})
+
+    def _replay(self, started):
+        """Replays a recorded completion word by word, spreading the recorded generation time over the words."""
+        entry = _replay_entry(self.prompt, self.route)
+        time.sleep(_replay_delay(entry, ttft=True))
+        self.ttft_ms = (time.perf_counter() - started) * 1000
+        _stream_stats.record(self.ttft_ms)
+        words = re.findall(r"\S+\s*|\s+", entry["content"]) or [""]
+        pause = max(0.0, _replay_delay(entry) - _replay_delay(entry, ttft=True)) / len(words)
+        for index, word in enumerate(words):
+            if index and pause:
+                time.sleep(pause)
+            yield word
+        self.content = entry["content"]
+        self.usage = _replayed_usage(self.route, entry, (time.perf_counter() - started) * 1000)
+        _route_stats.record(self.route, self.usage)
+
+    def _open(self, span, estimated_tokens):
+        """Opens the stream, retrying transient failures like _complete does."""
+        rate_limiter = get_rate_limiter(self.route["model"])
+        try:
+            for attempt in range(LLM_MAX_RETRIES + 1):
+                rate_limiter.acquire(estimated_tokens)
+                try:
+                    raw = get_client().chat.completions.with_raw_response.create(
+                        **_request_params(self.prompt, self.route),
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                    return raw.parse(), raw.headers
+                except Exception as e:
+                    headers = _error_headers(e)
+                    rate_limiter.release(estimated_tokens, rate_limited=isinstance(e, RateLimitError), headers=headers)
+                    if not _is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                        raise
+                    delay = rate_limiter.backoff_delay(attempt, headers)
+                    logger.warning(f"LLM stream failed to open ({type(e).__name__}), retry {attempt + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                    time.sleep(delay)
+        except Exception as e:
+            _raise_llm_error(span, e)
+
+def llm_think_stream(prompt, cache=True, cache_salt=None, route="default"):
+    """
+    Streaming variant of llm_think for long generations such as reply drafts.
+    Returns an LLMStream; iterate it to receive text deltas as they arrive.
+    Shares the cache and rate limit with llm_think (streams are not coalesced).
+    """
+    return LLMStream(prompt, cache=cache, cache_salt=cache_salt, route=route)
 
 def log_error_safely(span, error_type, error_message):
     """Safely log an error to Langfuse span, handling different API versions"""
@@ -186,6 +1025,7 @@ def test_langfuse_integration():
     Returns a tuple of (success, message) where success is a boolean and message describes the test result.
     """
     try:
+        langfuse_handler = get_langfuse_handler()
         if not langfuse_handler:
             return False, "Langfuse handler not initialized. Check your API credentials."
         
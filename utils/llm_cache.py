@@ -0,0 +1,151 @@
+"""
+Prompt/response cache for llm_think.
+
+Two tiers: an in-memory LRU for the hot set and an on-disk SQLite table that
+survives restarts (webhook retries, duplicate leads, repeated revisions).
+Entries expire after a TTL and both tiers are capped in size.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(model, system_prompt, prompt, temperature, salt=None):
+    """Builds a stable key from everything that determines the completion."""
+    payload = json.dumps(
+        [model, system_prompt, prompt, temperature, salt],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Thread-safe LRU + SQLite cache of LLM responses with TTL eviction."""
+
+    def __init__(self, path=None, ttl_seconds=86400, max_memory_entries=1000, max_disk_entries=10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+        if path:
+            try:
+                self._conn = sqlite3.connect(str(path), check_same_thread=False)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"LLM disk cache disabled, could not open {path}: {e}")
+                self._conn = None
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        if now - row[1] <= self.ttl_seconds:
+                            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                            self._conn.commit()
+                            value = json.loads(row[0])
+                            self._remember(key, row[1], value)
+                            self.stats["disk_hits"] += 1
+                            return value
+                        self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                        self._conn.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"LLM disk cache read failed: {e}")
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        """Stores a JSON-serialisable value in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self.stats["writes"] += 1
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                self._evict_disk(now)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"LLM disk cache write failed: {e}")
+
+    def delete(self, key):
+        """Removes a single entry from both tiers."""
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"LLM disk cache delete failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM llm_cache")
+                self._conn.commit()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, created_at, value):
+        # Caller holds the lock
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self, now):
+        # Caller holds the lock; drop expired rows, then the least recently used overflow
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.stats["evictions"] += overflow
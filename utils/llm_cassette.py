@@ -0,0 +1,101 @@
+"""
+Cassettes for the record/replay LLM backend (see LLM_BACKEND in utils/llm.py).
+
+A cassette is a JSONL file with one recorded exchange per line: the request key,
+route, model, prompt, completion, token usage and the latency observed when it was
+recorded. Replaying a cassette runs the whole pipeline offline with the
+recorded answers and, optionally, the recorded timing. Lookups are by exact
+request key; serving another recording of the same route on a miss is opt-in
+(route_fallback), since under concurrency the recording a request gets then
+depends on timing and may be another lead's answer.
+"""
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+
+class Cassette:
+    """Thread-safe append-only store of recorded LLM exchanges."""
+
+    def __init__(self, path, load=True):
+        self.path = Path(path)
+        self._by_key = {}
+        self._by_route = {}
+        self._route_cursor = {}
+        # Epoch seconds of the earliest recording: replays freeze "now" there (see utils.llm.llm_now)
+        self.recorded_at = None
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "hits": 0, "route_fallbacks": 0, "misses": 0}
+        if load:
+            self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            logging.warning(f"LLM cassette {self.path} does not exist; every replayed call will miss")
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logging.warning(f"Skipping malformed cassette line {line_number} in {self.path}: {e}")
+                    continue
+                self._index(entry)
+
+    def _index(self, entry):
+        # Later recordings of the same request win
+        self._by_key[entry["key"]] = entry
+        self._by_route.setdefault(entry.get("route"), []).append(entry)
+        if entry.get("recorded_at") is not None and (self.recorded_at is None or entry["recorded_at"] < self.recorded_at):
+            self.recorded_at = entry["recorded_at"]
+
+    def record(self, key, route, prompt, content, usage, ttft_ms=None):
+        """Appends one exchange; the file is flushed per line so a crashed run keeps what it recorded."""
+        entry = {
+            "key": key,
+            "route": route["name"],
+            "model": route["model"],
+            "prompt": prompt,
+            "content": content,
+            "usage": {k: usage.get(k, 0) for k in ("input", "output", "total")},
+            "latency_ms": usage.get("latency_ms", 0.0),
+            "ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+            "recorded_at": time.time()
+        }
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._index(entry)
+            self.stats["recorded"] += 1
+
+    def lookup(self, key, route_name, route_fallback=False):
+        """
+        Returns the recorded exchange for key, or None (counted and logged as a miss).
+        With route_fallback a miss is served one of the route's recordings,
+        round-robin: only for smoke runs, the answer is not the one for this prompt.
+        """
+        with self._lock:
+            entry = self._by_key.get(key)
+            if entry is not None:
+                self.stats["hits"] += 1
+                return entry
+            candidates = self._by_route.get(route_name) if route_fallback else None
+            if candidates:
+                cursor = self._route_cursor.get(route_name, 0)
+                self._route_cursor[route_name] = cursor + 1
+                self.stats["route_fallbacks"] += 1
+                logging.warning(f"Cassette miss on route '{route_name}': serving another recording "
+                                f"({self.stats['route_fallbacks']} fallback(s) so far)")
+                return candidates[cursor % len(candidates)]
+            self.stats["misses"] += 1
+            logging.error(f"Cassette miss on route '{route_name}' ({self.stats['misses']} miss(es) so far)")
+            return None
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._by_key), "path": str(self.path)}
@@ -0,0 +1,216 @@
+"""
+Process-wide rate limiting for OpenAI calls.
+
+Two token buckets (requests/min and tokens/min) are combined with an AIMD
+concurrency window: every successful call widens the window a little, every 429
+halves it and pauses new calls. The buckets are kept in sync with the
+x-ratelimit-* response headers so the local view matches the server's budget.
+"""
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value):
+    """Parses OpenAI reset headers such as '1s', '6m0s' or '20ms' into seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header(headers, name):
+    if not headers:
+        return None
+    try:
+        return headers.get(name)
+    except Exception:
+        return None
+
+
+def _int_header(headers, name):
+    value = _header(headers, name)
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers):
+    """Returns the server-requested wait from retry-after(-ms) headers, if any."""
+    retry_after_ms = _header(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    return parse_reset_duration(_header(headers, "retry-after"))
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to `capacity` units per minute."""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.level = min(self.capacity, self.level + elapsed * self.capacity / 60.0)
+            self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (amounts above capacity wait for a full bucket)."""
+        self.refill(now)
+        amount = min(float(amount), self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+    def consume(self, amount):
+        # May go negative when reconciling an underestimate; refill pays it back
+        self.level -= amount
+
+    def sync(self, remaining, limit=None, reset_seconds=None, now=None):
+        """Aligns the bucket with the server's remaining budget."""
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+            if reset_seconds and remaining <= 0 and now is not None:
+                # Nothing left until the server-side window resets
+                self.level = -reset_seconds * self.capacity / 60.0
+
+
+class RateLimiter:
+    """Shared RPM/TPM budget and AIMD concurrency control for all LLM callers in the process."""
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=40000, max_concurrency=16,
+                 min_concurrency=1, backoff_base=1.0, backoff_max=30.0, decrease_factor=0.5):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.decrease_factor = decrease_factor
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.in_flight = 0
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self.stats = {"acquired": 0, "rate_limited": 0, "wait_seconds": 0.0}
+
+    def _try_acquire(self, estimated_tokens, now):
+        """Takes a slot and budget if available. Returns 0 on success, else seconds to wait. Caller holds the lock."""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.in_flight >= int(self.concurrency_limit):
+            # Woken by release(); the timeout only guards against missed notifications
+            return 0.05
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(estimated_tokens, now))
+        if wait > 0:
+            return wait
+        self.requests.consume(1)
+        self.tokens.consume(estimated_tokens)
+        self.in_flight += 1
+        self.stats["acquired"] += 1
+        return 0.0
+
+    def acquire(self, estimated_tokens):
+        """Blocks until a request with `estimated_tokens` fits in the shared budget."""
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                wait = self._try_acquire(estimated_tokens, time.monotonic())
+                if wait == 0:
+                    break
+                self._cond.wait(timeout=wait)
+            self.stats["wait_seconds"] += time.monotonic() - started
+
+    async def acquire_async(self, estimated_tokens):
+        """Coroutine version of acquire() that sleeps on the event loop instead of blocking it."""
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                wait = self._try_acquire(estimated_tokens, time.monotonic())
+                if wait == 0:
+                    self.stats["wait_seconds"] += time.monotonic() - started
+                    return
+            await asyncio.sleep(wait)
+
+    def release(self, estimated_tokens, actual_tokens=None, rate_limited=False, headers=None):
+        """Frees the slot, reconciles the token estimate and adjusts the concurrency window."""
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if actual_tokens is not None:
+                self.tokens.consume(actual_tokens - estimated_tokens)
+
+            if rate_limited:
+                # Multiplicative decrease and a pause for everyone sharing the budget
+                self.stats["rate_limited"] += 1
+                self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit * self.decrease_factor)
+                pause = retry_after_seconds(headers) or self.backoff_base
+                self._blocked_until = max(self._blocked_until, now + pause)
+                logging.warning(f"LLM rate limited; concurrency window now {int(self.concurrency_limit)}, pausing {pause:.2f}s")
+            else:
+                # Additive increase: roughly +1 slot per window's worth of successes
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+            self._sync_from_headers(headers, now)
+            self._cond.notify_all()
+
+    def _sync_from_headers(self, headers, now):
+        if not headers:
+            return
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        self.requests.sync(
+            _int_header(headers, "x-ratelimit-remaining-requests"),
+            limit=_int_header(headers, "x-ratelimit-limit-requests"),
+            reset_seconds=parse_reset_duration(_header(headers, "x-ratelimit-reset-requests")),
+            now=now
+        )
+        self.tokens.sync(
+            _int_header(headers, "x-ratelimit-remaining-tokens"),
+            limit=_int_header(headers, "x-ratelimit-limit-tokens"),
+            reset_seconds=parse_reset_duration(_header(headers, "x-ratelimit-reset-tokens")),
+            now=now
+        )
+
+    def backoff_delay(self, attempt, headers=None):
+        """Exponential backoff with full jitter, never shorter than the server's retry-after."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = retry_after_seconds(headers)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def get_stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                **self.stats,
+                "wait_seconds": round(self.stats["wait_seconds"], 3),
+                "in_flight": self.in_flight,
+                "concurrency_limit": round(self.concurrency_limit, 2),
+                "requests_available": round(self.requests.level, 1),
+                "tokens_available": round(self.tokens.level, 1),
+            }
@@ -0,0 +1,10 @@
+"""Small statistics helpers shared by the batch runner and the benchmarks."""
+import math
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
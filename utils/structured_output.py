@@ -0,0 +1,118 @@
+"""
+Local parsing, repair and validation of JSON returned by the LLM.
+
+Cheap fixes (code fences, preambles, trailing commas, smart quotes, Python
+literals) are tried before anyone pays for another model call. Validation
+covers the subset of JSON Schema our prompts use: type, properties, required,
+enum, items, minimum and maximum.
+"""
+import json
+import re
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_PYTHON_LITERALS = {r"\bTrue\b": "true", r"\bFalse\b": "false", r"\bNone\b": "null"}
+_SMART_QUOTES = {"“": '"', "”": '"', "‘": "'", "’": "'"}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+class SchemaValidationError(ValueError):
+    """Raised when parsed JSON does not match the expected schema."""
+
+
+def _candidates(text):
+    """Yields progressively more aggressive clean-ups of the raw text."""
+    text = (text or "").strip()
+    yield text
+
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+        yield text
+
+    # Drop any preamble/epilogue around the outermost object or array
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if starts:
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        if end > start:
+            text = text[start:end + 1]
+            yield text
+
+    for smart, plain in _SMART_QUOTES.items():
+        text = text.replace(smart, plain)
+    text = _TRAILING_COMMA.sub(r"\1", text)
+    yield text
+
+    for pattern, literal in _PYTHON_LITERALS.items():
+        text = re.sub(pattern, literal, text)
+    yield text
+
+
+def repair_json_text(text):
+    """
+    Parses JSON from an LLM reply, repairing common formatting mistakes locally.
+    Returns (data, repaired) where repaired tells whether a fix was needed.
+    Raises json.JSONDecodeError if no candidate parses.
+    """
+    last_error = None
+    for attempt, candidate in enumerate(_candidates(text)):
+        try:
+            return json.loads(candidate), attempt > 0
+        except json.JSONDecodeError as e:
+            last_error = e
+    raise last_error
+
+
+def _matches_type(value, expected):
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _TYPES.get(expected, object))
+
+
+def validate_schema(data, schema, path="$"):
+    """Validates data against a (subset of) JSON Schema. Raises SchemaValidationError."""
+    if not schema:
+        return
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_matches_type(data, t) for t in types):
+            raise SchemaValidationError(f"{path}: expected {' or '.join(types)}, got {type(data).__name__}")
+
+    if "enum" in schema and data not in schema["enum"]:
+        raise SchemaValidationError(f"{path}: {data!r} is not one of {schema['enum']}")
+
+    if isinstance(data, (int, float)) and not isinstance(data, bool):
+        if "minimum" in schema and data < schema["minimum"]:
+            raise SchemaValidationError(f"{path}: {data} is below the minimum {schema['minimum']}")
+        if "maximum" in schema and data > schema["maximum"]:
+            raise SchemaValidationError(f"{path}: {data} is above the maximum {schema['maximum']}")
+
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                raise SchemaValidationError(f"{path}: missing required field '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in data:
+                validate_schema(data[key], subschema, f"{path}.{key}")
+
+    if isinstance(data, list) and "items" in schema:
+        for index, item in enumerate(data):
+            validate_schema(item, schema["items"], f"{path}[{index}]")
+
+
+def parse_structured_output(text, schema=None):
+    """Repairs and validates an LLM reply. Returns (data, repaired)."""
+    data, repaired = repair_json_text(text)
+    validate_schema(data, schema)
+    return data, repaired